@@ -0,0 +1,108 @@
+import threading
+from config import ALBUM_WINDOW
+from utils import logger
+
+
+class AlbumBatcher:
+    """
+    Groups photos from the same device that arrive within `window` seconds of each
+    other into albums of up to 10 photos.
+
+    When a device's window closes its album is handed to `dispatch(device_id, task)`,
+    which should run `task` where the device's files are processed, e.g. Pipeline.run_on_device,
+    so a device's albums and other files are sent in arrival order while devices send in
+    parallel. Without `dispatch` the album is sent from the timer thread. A full album is
+    sent right away by the thread that added its last photo.
+    `send_album` returns one message id per photo or None; if an album cannot be sent,
+    its photos are sent one by one via `send_single`. `on_complete` is called with
+    (filepath, message_id) for every photo; message_id is None on failure.
+    """
+
+    MAX_ALBUM_SIZE = 10
+
+    def __init__(self, send_album, send_single, on_complete, window=ALBUM_WINDOW, dispatch=None):
+        self.send_single = send_single
+        self.on_complete = on_complete
+        self.send_album = send_album
+        self.window = window
+        self.dispatch = dispatch
+        self._pending = {}  # device_id -> list of (filepath, filename)
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, device_id, filepath, filename):
+        """Add a photo to the device's pending album."""
+        full = None
+        with self._lock:
+            album = self._pending.setdefault(device_id, [])
+            if any(pending_path == filepath for pending_path, _ in album):
+                return
+            album.append((filepath, filename))
+            timer = self._timers.pop(device_id, None)
+            if timer:
+                timer.cancel()
+            if len(album) >= self.MAX_ALBUM_SIZE:
+                full = self._take(device_id)
+            else:
+                timer = threading.Timer(self.window, self._on_timer, args=(device_id, album))
+                timer.daemon = True
+                self._timers[device_id] = timer
+                timer.start()
+        logger.debug("Added %s to pending album for device %s.", filename, device_id)
+        if full:
+            self._send(full)
+
+    def _on_timer(self, device_id, album):
+        if self.dispatch:
+            self.dispatch(device_id, lambda: self.release(device_id, album))
+        else:
+            self.release(device_id, album)
+
+    def _take(self, device_id, album=None):
+        """
+        Remove and return the device's pending album, only if it is still `album` when given.
+        Caller must hold the lock.
+        """
+        if album is not None and self._pending.get(device_id) is not album:
+            return None
+        timer = self._timers.pop(device_id, None)
+        if timer:
+            timer.cancel()
+        return self._pending.pop(device_id, None)
+
+    def release(self, device_id, album=None):
+        """
+        Send the device's pending album now, from the calling thread. Call it before sending
+        another file of the device, so the file does not overtake earlier photos.
+        """
+        with self._lock:
+            album = self._take(device_id, album)
+        if album:
+            self._send(album)
+
+    def _send(self, album):
+        try:
+            message_ids = self.send_album(album) if len(album) > 1 else None
+        except Exception as e:
+            logger.error("Unexpected error sending album: %s", e)
+            message_ids = None
+        if message_ids:
+            results = [(filepath, message_id) for (filepath, _), message_id in zip(album, message_ids)]
+        else:
+            if len(album) > 1:
+                logger.warning("Album of %s photos failed. Falling back to single sends.", len(album))
+            results = [(filepath, self.send_single(filepath, filename)) for filepath, filename in album]
+
+        for filepath, message_id in results:
+            try:
+                self.on_complete(filepath, message_id)
+            except Exception as e:
+                logger.error("Error completing %s after album send: %s", filepath, e)
+
+    def close(self):
+        """Send every pending album immediately, from the calling thread."""
+        with self._lock:
+            albums = [self._take(device_id) for device_id in list(self._pending)]
+        for album in albums:
+            if album:
+                self._send(album)
@@ -0,0 +1,122 @@
+# async_elasticsearch_client.py
+
+import asyncio
+from elasticsearch import AsyncElasticsearch
+from config import ELASTICSEARCH_HOST, ELASTICSEARCH_INDEX, ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE
+from elasticsearch_client import BulkIndexer, create_index
+from metrics import STAGE_SECONDS
+from utils import logger
+
+
+class AsyncBulkIndexer(BulkIndexer):
+    """
+    BulkIndexer for the asyncio pipeline, sending through an AsyncElasticsearch client.
+
+    Flushing runs as a task on the event loop instead of a thread, so bulk requests never
+    block it. Documents can still be added from any thread, e.g. metadata workers in an executor.
+    """
+
+    def start(self):
+        """Start the flush task on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._thread = self._loop.create_task(self._run())  # The flush task stands in for the thread
+
+    def _ensure_started(self):
+        if self._thread is None:
+            raise RuntimeError("AsyncBulkIndexer.start() must be awaited on the event loop first")
+
+    def add(self, document, doc_id=None, on_stored=None):
+        """Queue a document for indexing. Safe to call from any thread."""
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append(self._action(document, doc_id, on_stored))
+            full = len(self._buffer) >= self.bulk_size
+        if full:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _run_callbacks(self, callbacks):
+        """Runs `on_stored` callbacks in the default executor, as they may write to the job store."""
+        self._loop.run_in_executor(None, super()._run_callbacks, callbacks)
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error flushing documents to Elasticsearch: %s", e)
+
+    async def flush(self):
+        """Send everything currently buffered and replay the spool file if the cluster is reachable."""
+        async with self._flush_lock:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    break
+                if not await self._send(batch):
+                    self._spool_remaining(batch)
+                    return
+
+            if self._replay_due():
+                await self._replay_spool()
+
+    async def _send(self, actions):
+        """
+        Index a batch, retrying items that failed with a retryable status.
+        Returns False if the cluster could not be reached and the batch should be spooled.
+        """
+        if self.ensure_index and not self._index_ready:
+            # Through the shared synchronous client, once, before the first document
+            self._index_ready = await asyncio.to_thread(create_index, self.index)
+        pending = actions
+        for attempt in range(self.max_retries + 1):
+            try:
+                with STAGE_SECONDS.time(stage='es_bulk'):
+                    response = await self.client.bulk(operations=self._operations(pending))
+            except Exception as e:
+                self._bulk_failed(e)
+                return False
+            pending = self._to_retry(pending, response, attempt)
+            if not pending:
+                return True
+            await asyncio.sleep(self._retry_delay(attempt))
+        self._give_up(pending)
+        return True
+
+    async def _replay_spool(self):
+        """Resend spooled actions in bulk-sized batches. Anything left undelivered is spooled again."""
+        replay = self._replay_batches(self._take_spool())
+        indexed = None
+        while True:
+            try:
+                batch = replay.send(indexed)
+            except StopIteration:
+                return
+            indexed = await self._send(batch)
+
+    async def close(self):
+        """Stop the flush task, send whatever is still buffered and close the client."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._wakeup.set()
+            await self._thread
+            await self.flush()
+        await self.client.close()
+
+
+def create_async_indexer():
+    """
+    Returns an AsyncBulkIndexer with its own AsyncElasticsearch client (requires aiohttp).
+    Call start() on it from the event loop before adding documents.
+    """
+    client = AsyncElasticsearch(
+        hosts=ELASTICSEARCH_HOST,
+        api_key=(ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE)
+    )
+    return AsyncBulkIndexer(client, ELASTICSEARCH_INDEX, ensure_index=True)
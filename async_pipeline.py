@@ -0,0 +1,196 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from config import ASYNC_CONCURRENCY, QUEUE_SIZE, LOG_FILE_PATH, STARTUP_SCAN
+from utils import logger, get_device_id, file_fields
+from file_processor import SendAttempt, prepare_file, complete_file, scan_and_send, resume_unfinished
+from retry_scheduler import retry_scheduler, failed_redriver
+from delivery import Delivery
+from async_telegram_client import AsyncTelegramClient
+from async_elasticsearch_client import create_async_indexer
+from image_transformer import shutdown as shutdown_transformer
+from file_organizer import flush_archive
+from monitor import start_log_monitoring
+from metrics import STAGE_SECONDS, QUEUE_DEPTH, QUEUE_WAIT_SECONDS, start_server, stop_server, dump_json
+
+
+async def deliver_file_async(telegram, filepath, file_type, filename, device_id):
+    """
+    asyncio version of delivery.deliver_file: uploads once, then sends the file_id to the
+    device's other chats concurrently. Returns the message id in the first chat if every
+    chat has the file, a SendFailure otherwise. Hashing and the job store run in the default executor.
+    """
+    delivery = await asyncio.to_thread(Delivery, filepath, file_type, filename, device_id)
+    chat_id = delivery.upload_chat()
+    if chat_id and not await asyncio.to_thread(
+            delivery.record, chat_id, await telegram.send_file(filepath, file_type, filename, chat_id)):
+        return delivery.result()
+
+    if delivery.pending:
+        send = delivery.fanout_send(telegram.send_file, telegram.send_existing)
+        messages = await asyncio.gather(*(send(chat_id) for chat_id in delivery.pending))
+        for chat_id, message in zip(delivery.pending, messages):
+            await asyncio.to_thread(delivery.record, chat_id, message)
+    return delivery.result()
+
+
+class AsyncPipeline:
+    """
+    Processes uploaded files as tasks on a single event loop.
+
+    Every device gets its own queue and consumer task, so a camera's files are handled
+    in arrival order while different cameras proceed concurrently. At most `concurrency`
+    files are processed at once and at most `queue_size` are accepted before submit()
+    blocks. Hashing, metadata extraction and file moves run in the default executor;
+    uploads and bulk requests are awaited on the loop. Photos are sent one by one,
+    album batching is only available in the threaded pipeline.
+    """
+
+    def __init__(self, telegram, indexer, concurrency=ASYNC_CONCURRENCY, queue_size=QUEUE_SIZE):
+        self.telegram = telegram
+        self.indexer = indexer
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+        self._loop = None
+        self._queues = {}
+        self._tasks = []
+        self._in_flight = set()
+        self._submitted = 0
+        self._processed = 0
+        self._errors = 0
+        self._started_at = None
+
+    async def start(self):
+        """Bind the pipeline to the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._active = asyncio.Semaphore(self.concurrency)
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._started_at = time.monotonic()
+        QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in list(self._queues.values())))
+        logger.info("Started asyncio processing pipeline with concurrency %s.", self.concurrency)
+
+    def submit(self, filepath):
+        """
+        Queue a file from another thread, e.g. the log monitor. Blocks while the pipeline is full.
+        """
+        asyncio.run_coroutine_threadsafe(self.enqueue(filepath), self._loop).result()
+
+    async def enqueue(self, filepath):
+        """Queue a file on its device's queue, waiting for a free slot."""
+        if filepath in self._in_flight:
+            logger.debug("%s is already queued. Skipping.", filepath)
+            return
+        self._in_flight.add(filepath)
+        await self._slots.acquire()
+        device_id = get_device_id(os.path.basename(filepath))
+        q = self._queues.get(device_id)
+        if q is None:
+            q = self._queues[device_id] = asyncio.Queue()
+            self._tasks.append(self._loop.create_task(self._consume(q), name=f"device-{device_id}"))
+        q.put_nowait((filepath, time.monotonic()))
+        self._submitted += 1
+        logger.debug("Queued %s for device %s.", filepath, device_id)
+
+    async def _consume(self, q):
+        """Process one device's files until a stop sentinel is received."""
+        while True:
+            item = await q.get()
+            if item is None:
+                break
+            filepath, queued_at = item
+            QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+            try:
+                async with self._active:
+                    await self.process(filepath)
+            except Exception as e:
+                self._errors += 1
+                logger.error("Unhandled error processing %s: %s", filepath, e,
+                             extra=file_fields(os.path.basename(filepath)))
+            finally:
+                self._in_flight.discard(filepath)
+                self._processed += 1
+                self._slots.release()
+
+    async def process(self, filepath):
+        """The asyncio equivalent of process_file, sharing its stages before and after sending."""
+        with STAGE_SECONDS.time(stage='process_file'):
+            await self._process(filepath)
+
+    async def _process(self, filepath):
+        prepared = await asyncio.to_thread(prepare_file, filepath, self.indexer)
+        if not prepared:
+            return
+        file_type, device_id = prepared
+        filename = os.path.basename(filepath)
+
+        attempt = SendAttempt(filename)
+        if attempt.allowed:
+            with attempt:
+                attempt.result = await deliver_file_async(self.telegram, filepath, file_type, filename, device_id)
+        await asyncio.to_thread(complete_file, filepath, attempt.result)
+
+    def stats(self):
+        """Return a snapshot of the pipeline counters."""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "devices": len(self._queues),
+            "submitted": self._submitted,
+            "processed": self._processed,
+            "errors": self._errors,
+            "files_per_second": self._processed / elapsed if elapsed else 0.0,
+        }
+
+    async def stop(self):
+        """Process everything already queued, then stop the consumer tasks."""
+        for q in self._queues.values():
+            q.put_nowait(None)
+        await asyncio.gather(*self._tasks)
+        logger.info("Stopped asyncio processing pipeline. Final stats: %s", self.stats())
+
+
+async def run_async():
+    """
+    Runs the application on an asyncio event loop until SIGTERM or SIGINT.
+    The log monitor and the backlog scan keep their own threads and hand files over with submit().
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    telegram = AsyncTelegramClient()
+    await telegram.start()
+    indexer = create_async_indexer()
+    indexer.start()
+    pipeline = AsyncPipeline(telegram, indexer)
+    await pipeline.start()
+    retry_scheduler.start(pipeline.submit)
+    failed_redriver.start(pipeline.submit)
+    metrics_server = start_server()
+
+    observer = event_handler = None
+    try:
+        # Without the scan, files left unfinished by the last run are still resumed
+        threading.Thread(target=scan_and_send if STARTUP_SCAN else resume_unfinished, args=(pipeline.submit,),
+                         name="backlog-scan", daemon=True).start()
+        observer, event_handler = start_log_monitoring(LOG_FILE_PATH, pipeline.submit)
+        await stop.wait()
+        logger.info("Stopping File Sender Application.")
+    finally:
+        if observer is not None:
+            observer.stop()
+            await asyncio.to_thread(observer.join)
+            event_handler.close()
+        # Their threads may be blocked in submit() until the loop takes the file
+        await asyncio.to_thread(failed_redriver.stop)
+        await asyncio.to_thread(retry_scheduler.stop)
+        await pipeline.stop()
+        await indexer.close()
+        await telegram.close()
+        shutdown_transformer()
+        await asyncio.to_thread(flush_archive)
+        stop_server(metrics_server)
+        dump_json()
+        logger.info("File Sender Application stopped.")
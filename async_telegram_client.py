@@ -0,0 +1,155 @@
+# async_telegram_client.py
+
+import asyncio
+import json
+import os
+import time
+import aiohttp
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_API_URL, TELEGRAM_CONNECT_TIMEOUT,
+                    TELEGRAM_READ_TIMEOUT, ASYNC_CONCURRENCY)
+from rate_limiter import rate_limiter
+from image_transformer import prepare_uploads, release_uploads
+from telegram_client import TelegramClient, TRANSIENT, RATE_LIMITED, REJECTED, ERROR, failure_for_status
+from utils import logger, file_fields
+from metrics import STAGE_SECONDS, UPLOAD_BYTES, TELEGRAM_REQUESTS
+
+
+class AsyncTelegramClient:
+    """
+    asyncio counterpart of TelegramClient, used by the asyncio pipeline.
+
+    One aiohttp session keeps up to `concurrency` connections to the Bot API open.
+    aiohttp streams file uploads from disk, and rate limit permits are awaited, so
+    many sends can be in flight on a single thread.
+    """
+
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID, api_url=TELEGRAM_API_URL,
+                 concurrency=ASYNC_CONCURRENCY, connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+                 read_timeout=TELEGRAM_READ_TIMEOUT):
+        self.chat_id = chat_id
+        self.base_url = f'{api_url.rstrip("/")}/bot{token}/'
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+
+    async def start(self):
+        """Open the session. Must be called from the event loop the client is used on."""
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             timeout=self.timeout)
+
+    async def _post(self, method, data, files, description):
+        """
+        Posts a Bot API request as a multipart body and logs its timing at debug level.
+        `files` is a list of (form name, filename, path). Returns (status, parsed JSON or None, text).
+        """
+        start = time.perf_counter()
+        form = aiohttp.FormData()
+        for name, value in data.items():
+            form.add_field(name, str(value))
+        opened = []
+        try:
+            for name, filename, path in files:
+                f = open(path, 'rb')
+                opened.append(f)
+                form.add_field(name, f, filename=filename, content_type='application/octet-stream')
+            async with self.session.post(self.base_url + method, data=form) as response:
+                status = response.status
+                text = await response.text()
+        finally:
+            for f in opened:
+                f.close()
+        TELEGRAM_REQUESTS.inc(method=method, status=status)
+        if files:
+            UPLOAD_BYTES.observe(sum(os.path.getsize(path) for _, _, path in files))
+        logger.debug("%s for %s: status=%s total=%.3fs", method, description, status, time.perf_counter() - start)
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        return status, payload, text
+
+    async def _send(self, method, data, files, chat_id, cost, description):
+        """
+        Awaits a rate limit permit and posts the request.
+        Returns the `result` of a successful response, a SendFailure otherwise.
+        """
+        await rate_limiter.acquire_async(chat_id, cost=cost)
+        status, payload, text = await self._post(method, data, files, description)
+
+        if status == 200 and payload:
+            return payload['result']
+        elif status == 429:
+            retry_after = (payload or {}).get('parameters', {}).get('retry_after', 30)
+            logger.error("Rate limit exceeded when sending %s. Retry after %s seconds.", description, retry_after)
+            rate_limiter.pause(retry_after)
+            return RATE_LIMITED
+        logger.error("Failed to send %s. Status Code: %s, Response: %s", description, status, text)
+        return failure_for_status(status)
+
+    async def send_file(self, filepath, file_type, filename, chat_id=None):
+        """
+        Uploads a file via Telegram to `chat_id`, or the default chat.
+        Returns a Message with the message id and file_id if successful, a SendFailure otherwise.
+        """
+        logger.debug("send_file called with: %s, file_type: %s", filename, file_type)
+
+        chat_id = chat_id or self.chat_id
+        method, data = TelegramClient._media_request(file_type, chat_id)
+        if not method:
+            logger.warning("send_file: Unsupported file type for file %s. Skipping.", filename)
+            return REJECTED
+
+        upload_paths = [filepath]
+        start = time.perf_counter()
+        try:
+            # Downscaling and header reads block, so they run in the default executor
+            if file_type == 'photo':
+                upload_paths = await asyncio.to_thread(prepare_uploads, [filepath])
+            elif file_type == 'video':
+                data.update(await asyncio.to_thread(TelegramClient._video_parameters, filepath))
+            result = await self._send(method, data, [(file_type, filename, upload_paths[0])], chat_id, 1, filename)
+            if result:
+                logger.info("Successfully sent %s via Telegram.", filename, extra=file_fields(
+                    filename, stage='send_file', duration=round(time.perf_counter() - start, 3)))
+                return TelegramClient._message(result)
+            return result
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Request error while sending %s: %r", filename, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending %s: %s", filename, e)
+            return ERROR
+        finally:
+            release_uploads([filepath], upload_paths)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage='send_file')
+
+    async def send_existing(self, file_type, file_id, filename, chat_id):
+        """
+        Sends an already uploaded file to another chat by its file_id, without uploading it again.
+        Returns a Message if successful, a SendFailure otherwise.
+        """
+        method, data = TelegramClient._media_request(file_type, chat_id)
+        if not method:
+            logger.warning("send_existing: Unsupported file type for file %s. Skipping.", filename)
+            return REJECTED
+        data[file_type] = file_id
+
+        description = f"{filename} to chat {chat_id}"
+        try:
+            result = await self._send(method, data, [], chat_id, 1, description)
+            if result:
+                logger.info("Successfully sent %s via Telegram.", description)
+                return TelegramClient._message(result)
+            return result
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Request error while sending %s: %r", description, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending %s: %s", description, e)
+            return ERROR
+
+    async def close(self):
+        """Close the pooled connections."""
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,185 @@
+"""
+Re-indexes the processed archive into Elasticsearch, e.g. after a mapping change or data loss.
+
+Usage: python backfill.py [--index NAME] [--directory DIR] [--processes N] [--restart]
+
+Walks the year-month directories under PROCESSED_DIRECTORY in order, extracts metadata in
+a process pool and bulk indexes one document per file. Documents are keyed by the file's
+content hash, the same _id the live pipeline uses, so reruns overwrite instead of
+duplicating; whether a photo was suppressed as a near-duplicate comes from the job store. Files are never moved and nothing is sent to Telegram. Progress is saved
+after every bulk request that was indexed, so an interrupted run resumes where it stopped.
+Batches the cluster does not accept are spooled to BACKFILL_SPOOL_FILE and replayed by the
+next flush.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from config import (PROCESSED_DIRECTORY, ELASTICSEARCH_INDEX, ES_BULK_SIZE, BACKFILL_PROGRESS_FILE,
+                    BACKFILL_PROCESSES, BACKFILL_SPOOL_FILE, BACKLOG_PROGRESS_INTERVAL)
+from device_coordinates import DEVICE_COORDINATES
+from elasticsearch_client import get_client, BulkIndexer, build_document, create_index
+from job_store import get_job_store, file_hash
+from metadata_extractor import read_metadata, read_video_metadata
+from utils import logger, setup_logging, get_file_type, get_device_id
+
+MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+MAP_CHUNK_SIZE = 32
+
+
+def _init_worker():
+    """
+    Workers log warnings to stderr only. The application log file is rotated by the parent,
+    and the per-file metadata messages would drown it.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel("WARNING")
+
+
+def extract_document(filepath):
+    """
+    Returns (content hash, document) for an archived photo or video, or None if it has
+    no location and no fallback coordinates or cannot be read. Runs in the worker processes.
+    """
+    filename = os.path.basename(filepath)
+    file_type = get_file_type(filename)
+    device_id = get_device_id(filename)
+    if file_type == 'photo':
+        metadata = read_metadata(filepath)
+    elif file_type == 'video':
+        metadata = read_video_metadata(filepath)
+    else:
+        return None
+
+    gps_coords = metadata.gps or DEVICE_COORDINATES.get(device_id)
+    if not gps_coords:
+        return None
+    try:
+        # Archiving keeps the modification time, which is closer to the capture than the current time
+        timestamp = metadata.timestamp or datetime.fromtimestamp(os.path.getmtime(filepath), timezone.utc)
+        content_hash = file_hash(filepath)
+    except OSError as e:
+        logger.warning("Skipping unreadable file %s: %s", filepath, e)
+        return None
+    return content_hash, build_document(device_id, gps_coords, timestamp, filename)
+
+
+def load_progress(progress_file, index):
+    """Returns the (month, filename) position of an earlier run into the same index, or None."""
+    if not os.path.exists(progress_file):
+        return None
+    try:
+        with open(progress_file) as f:
+            progress = json.load(f)
+    except Exception as e:
+        logger.warning("Ignoring unreadable backfill progress %s: %s", progress_file, e)
+        return None
+    if progress.get('index') != index:
+        logger.info("Backfill progress in %s is for index %s. Starting over.",
+                    progress_file, progress.get('index'))
+        return None
+    return tuple(progress['position'])
+
+
+def save_progress(progress_file, index, position):
+    """Persist the last (month, filename) whose document was delivered."""
+    tmp_path = f"{progress_file}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'index': index, 'position': list(position)}, f)
+    os.replace(tmp_path, progress_file)
+
+
+def archive_months(directory):
+    """Returns the year-month directory names under `directory`, oldest first."""
+    with os.scandir(directory) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir() and MONTH_PATTERN.match(entry.name))
+
+
+def month_files(directory, month, after=None):
+    """Returns the names of the supported files in a month directory, sorted, after `after` if given."""
+    with os.scandir(os.path.join(directory, month)) as entries:
+        names = [entry.name for entry in entries if entry.is_file() and get_file_type(entry.name)]
+    return sorted(name for name in names if after is None or name > after)
+
+
+def backfill(directory=PROCESSED_DIRECTORY, index=ELASTICSEARCH_INDEX, processes=BACKFILL_PROCESSES,
+             progress_file=BACKFILL_PROGRESS_FILE, spool_file=BACKFILL_SPOOL_FILE, restart=False):
+    """Re-indexes every archived file under `directory`. Returns (indexed, skipped)."""
+    position = None if restart else load_progress(progress_file, index)
+    if position:
+        logger.info("Resuming backfill into %s after %s/%s.", index, position[0], position[1])
+
+    create_index(index)
+    indexer = BulkIndexer(get_client(), index, spool_file=spool_file)
+    indexed = skipped = since_flush = 0
+    start = last_report = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as executor:
+        for month in archive_months(directory):
+            if position and month < position[0]:
+                continue
+            names = month_files(directory, month, position[1] if position and month == position[0] else None)
+            if not names:
+                continue
+            logger.info("Backfilling %s files from %s.", len(names), month)
+
+            paths = [os.path.join(directory, month, name) for name in names]
+            for name, result in zip(names, executor.map(extract_document, paths, chunksize=MAP_CHUNK_SIZE)):
+                if result:
+                    content_hash, document = result
+                    job = get_job_store().get(content_hash)
+                    if job and job.duplicate_of:
+                        document["duplicate_of"] = job.duplicate_of
+                    indexer.add(document, doc_id=content_hash)
+                    indexed += 1
+                    since_flush += 1
+                else:
+                    skipped += 1
+
+                if since_flush >= ES_BULK_SIZE:
+                    if indexer.flush():
+                        save_progress(progress_file, index, (month, name))
+                    since_flush = 0
+
+                now = time.monotonic()
+                if now - last_report >= BACKLOG_PROGRESS_INTERVAL:
+                    last_report = now
+                    logger.info("Backfill progress: %s, %s indexed, %s skipped, %.0f files/s",
+                                month, indexed, skipped, (indexed + skipped) / (now - start))
+
+            if indexer.flush():
+                save_progress(progress_file, index, (month, names[-1]))
+            since_flush = 0
+
+    indexer.close()
+    elapsed = time.monotonic() - start
+    logger.info("Backfill into %s finished: %s indexed, %s skipped without a location or unreadable, "
+                "in %.1fs (%.0f files/s).",
+                index, indexed, skipped, elapsed, (indexed + skipped) / elapsed if elapsed else 0)
+    return indexed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-index the processed archive into Elasticsearch.")
+    parser.add_argument('--directory', default=PROCESSED_DIRECTORY, help="Archive root with YYYY-MM directories")
+    parser.add_argument('--index', default=ELASTICSEARCH_INDEX, help="Index to write to, created if missing")
+    parser.add_argument('--processes', type=int, default=BACKFILL_PROCESSES, help="Metadata extraction processes")
+    parser.add_argument('--progress-file', default=BACKFILL_PROGRESS_FILE)
+    parser.add_argument('--spool-file', default=BACKFILL_SPOOL_FILE, help="Documents the cluster did not accept")
+    parser.add_argument('--restart', action='store_true', help="Ignore the progress of an earlier run")
+    args = parser.parse_args()
+    setup_logging()
+    backfill(args.directory, args.index, args.processes, args.progress_file, args.spool_file, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Side-by-side throughput of the threaded and the asyncio pipeline against local stub servers.
+
+Usage: python benchmarks/bench_async_pipeline.py [files] [devices] [telegram_latency_s]
+
+A burst of small geotagged photos spread over `devices` cameras is processed by each
+mode in a fresh child process. Both modes send photos one by one (ALBUM_WINDOW=0) and
+rate limits are raised so the stub latency, not the limiter, is the bottleneck.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+
+def make_photos(directory, files, devices, size=(640, 480)):
+    """Writes `files` geotagged JPEGs spread over `devices` cameras, each with unique content."""
+    import piexif
+    from PIL import Image
+    gps = {
+        piexif.GPSIFD.GPSLatitudeRef: b"N",
+        piexif.GPSIFD.GPSLatitude: ((60, 1), (49, 1), (5376, 100)),
+        piexif.GPSIFD.GPSLongitudeRef: b"E",
+        piexif.GPSIFD.GPSLongitude: ((14, 1), (11, 1), (5346, 100)),
+    }
+    paths = []
+    for index in range(files):
+        path = os.path.join(directory, f"{index % devices:03d}-IMG_{index:05d}.jpg")
+        exif = piexif.dump({
+            "0th": {piexif.ImageIFD.ImageDescription: f"frame {index}".encode()},
+            "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2024:10:01 05:30:00"},
+            "GPS": gps,
+        })
+        Image.new("RGB", size, (index % 256, 110, 70)).save(path, quality=85, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def run_threads(paths):
+    from pipeline import Pipeline
+    from elasticsearch_client import close_indexer
+    pipeline = Pipeline()
+    pipeline.start()
+    for path in paths:
+        pipeline.submit(path)
+    pipeline.stop()
+    close_indexer()
+
+
+async def run_asyncio(paths):
+    from async_pipeline import AsyncPipeline
+    from async_telegram_client import AsyncTelegramClient
+    from async_elasticsearch_client import create_async_indexer
+    telegram = AsyncTelegramClient()
+    await telegram.start()
+    indexer = create_async_indexer()
+    indexer.start()
+    pipeline = AsyncPipeline(telegram, indexer)
+    await pipeline.start()
+    for path in paths:
+        await pipeline.enqueue(path)
+    await pipeline.stop()
+    await indexer.close()
+    await telegram.close()
+
+
+def child(mode, files, devices):
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    from config import ensure_directories
+    from utils import setup_logging
+    setup_logging()
+    ensure_directories()
+    paths = make_photos(os.environ["FILES_DIRECTORY"], files, devices)
+    start = time.perf_counter()
+    if mode == "threads":
+        run_threads(paths)
+    else:
+        asyncio.run(run_asyncio(paths))
+    elapsed = time.perf_counter() - start
+    from image_transformer import shutdown
+    shutdown()
+    processed = sum(len(names) for _, _, names in os.walk(os.environ["PROCESSED_DIRECTORY"]))
+    print(f"{mode:<8} {files} files from {devices} devices in {elapsed:6.2f}s: "
+          f"{files / elapsed:7.1f} files/s, {processed} moved to processed")
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    from stub_servers import telegram_server, elasticsearch_server
+    telegram = telegram_server(latency=latency).start()
+    elasticsearch = elasticsearch_server(latency=0.02).start()
+    try:
+        for mode in ("threads", "asyncio"):
+            work_dir = tempfile.mkdtemp(prefix=f"bench_async_{mode}_")
+            env = dict(os.environ)
+            for name in ("FILES", "PROCESSED", "FAILED"):
+                env[f"{name}_DIRECTORY"] = os.path.join(work_dir, name.lower())
+            env.update({
+                "JOB_STORE_PATH": os.path.join(work_dir, "jobs.db"),
+                "APP_LOG_FILE": os.path.join(work_dir, "app.log"),
+                "ES_SPOOL_FILE": os.path.join(work_dir, "es_spool.jsonl"),
+                "TELEGRAM_API_URL": telegram.url,
+                "TELEGRAM_BOT_TOKEN": "TOKEN",
+                "TELEGRAM_CHAT_ID": "1",
+                "TELEGRAM_GLOBAL_RATE": "10000",
+                "TELEGRAM_CHAT_RATE": "10000",
+                "ELASTICSEARCH_HOST": elasticsearch.url,
+                "ELASTICSEARCH_INDEX": "bench",
+                "ELASTICSEARCH_APIKEY_ID": "bench",
+                "ELASTICSEARCH_APIKEY_VALUE": "bench",
+                "ALBUM_WINDOW": "0",
+                "LOG_LEVEL": "WARNING",
+            })
+            subprocess.run([sys.executable, __file__, "--child", mode, str(files), str(devices)],
+                           env=env, check=True)
+    finally:
+        telegram.stop()
+        elasticsearch.stop()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
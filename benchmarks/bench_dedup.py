@@ -0,0 +1,76 @@
+"""
+Micro-benchmark: perceptual hash and window comparison cost per frame.
+
+Usage: python benchmarks/bench_dedup.py [image.jpg ...]
+Without arguments a synthetic burst of 12 MP frames is generated: a static scene with
+sensor noise (near-duplicates) followed by frames where the scene changes.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+from duplicate_filter import DuplicateFilter, dhash, hamming_distances
+
+ITERATIONS = 20
+COMPARISONS = 100000
+
+
+def full_decode_dhash(path):
+    """The same hash computed without draft mode, decoding every pixel."""
+    with Image.open(path) as img:
+        small = img.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).view('>u8')[0].astype(np.uint64)
+
+
+def make_burst(directory, static=6, changed=4):
+    rng = np.random.default_rng(1)
+    scene = rng.integers(0, 255, (30, 40, 3), dtype=np.uint8)
+    scene = np.asarray(Image.fromarray(scene).resize((4000, 3000), Image.Resampling.BICUBIC))
+    paths = []
+    for index in range(static + changed):
+        frame = scene.astype(np.int16) + rng.integers(-6, 7, scene.shape)
+        if index >= static:
+            frame = np.roll(frame, (index - static + 1) * 600, axis=1)
+        path = os.path.join(directory, f"001-{index:03d}.jpg")
+        Image.fromarray(frame.clip(0, 255).astype(np.uint8)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def bench(label, func, paths):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for path in paths:
+            func(path)
+    per_file = (time.perf_counter() - start) / (ITERATIONS * len(paths)) * 1e6
+    print(f"{label:<28} {per_file:10.1f} us/frame")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sys.argv[1:] or make_burst(directory)
+        bench("dhash, full decode", full_decode_dhash, paths)
+        bench("dhash, draft mode", dhash, paths)
+
+        window = np.random.default_rng(2).integers(0, 2**63, 20, dtype=np.uint64)
+        frame_hash = np.uint64(12345)
+        start = time.perf_counter()
+        for _ in range(COMPARISONS):
+            hamming_distances(window, frame_hash)
+        per_compare = (time.perf_counter() - start) / COMPARISONS * 1e6
+        print(f"{'compare against 20 hashes':<28} {per_compare:10.1f} us/frame")
+
+        duplicate_filter = DuplicateFilter()
+        suppressed = [os.path.basename(path) for path in paths
+                      if duplicate_filter.check("001", os.path.basename(path), dhash(path))]
+        print(f"suppressed {len(suppressed)}/{len(paths)} frames: {', '.join(suppressed) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
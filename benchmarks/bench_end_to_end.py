@@ -0,0 +1,268 @@
+"""
+End-to-end benchmark: synthetic cameras uploading to a fake vsftpd log, processed by main.py.
+
+Usage: python benchmarks/bench_end_to_end.py [--photos N] [--videos N] [--devices N] [--rate UPLOADS_PER_S]
+                                             [--burst N] [--mode threads|asyncio] [--output results.json] ...
+
+Geotagged JPEGs and MP4s named with device-id prefixes are generated up front. They are
+then "uploaded" in bursts of `--burst` files from one camera at `--rate` files per second.
+Each upload is renamed into FILES_DIRECTORY and gets an `OK UPLOAD:` line in the fake log,
+like vsftpd writes once a transfer completes. main.py runs unmodified in a child process
+against local stub Telegram and Elasticsearch servers, which inject latency, 429s and
+failures. Nothing leaves the machine.
+
+Reported: files/s, p50/p99 latency from the log line to the file arriving in the
+processed archive (polled every 10 ms), peak RSS of the largest application process,
+the stub servers' view of the traffic and the application's own stage metrics.
+Environment variables are passed through, so any setting can be varied between runs.
+With the default of one chat, Telegram's per-chat rate limit dominates; --unthrottled
+lifts it to compare the pipeline itself.
+"""
+import argparse
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_async_pipeline import make_photos
+from bench_video_metadata import make_mp4
+from stub_servers import telegram_server, elasticsearch_server
+
+UPLOAD_LINE = ('{time} [pid 1234] [camera] OK UPLOAD: Client "10.0.0.2", '
+               '"/upload/{name}", {size} bytes, 2048.00Kbyte/sec\n')
+POLL_INTERVAL = 0.01
+
+
+def make_uploads(staging, photos, videos, devices, video_mb, photo_size):
+    """Generates the files in `staging` and returns their paths grouped by device."""
+    by_device = {}
+    for path in make_photos(staging, photos, devices, photo_size):
+        by_device.setdefault(os.path.basename(path).split("-")[0], []).append(path)
+    for index in range(videos):
+        device_id = f"{index % devices:03d}"
+        path = make_mp4(os.path.join(staging, f"{device_id}-VID_{index:05d}.mp4"), size_mb=video_mb,
+                        created=int(time.time()) + index)  # Distinct content per clip
+        by_device.setdefault(device_id, []).append(path)
+    return by_device
+
+
+def upload_schedule(by_device, burst):
+    """Orders the files into bursts of up to `burst` consecutive files per camera, cameras taking turns."""
+    queues = [list(paths) for _, paths in sorted(by_device.items())]
+    schedule = []
+    while any(queues):
+        for paths in queues:
+            schedule.append(paths[:burst])
+            del paths[:burst]
+    return [group for group in schedule if group]
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def archived(directory):
+    """Returns the names of the files under a year-month archive directory."""
+    names = set()
+    for root, _, files in os.walk(directory):
+        if os.path.basename(root) != ".objects" and ".objects" not in root:
+            names.update(name for name in files if not name.endswith(".part"))
+    return names
+
+
+def wait_for_startup(app_log, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"main.py exited with {process.returncode} during startup. See {app_log}.")
+        if os.path.exists(app_log):
+            with open(app_log) as f:
+                if "Started monitoring log file" in f.read():
+                    return
+        time.sleep(0.05)
+    raise RuntimeError(f"main.py did not start monitoring within {timeout}s. See {app_log}.")
+
+
+def stage_summary(metrics_file):
+    """Returns {stage: (count, p50, p99)} from the application's metrics dump."""
+    try:
+        with open(metrics_file) as f:
+            series = json.load(f)["metrics"]["filesender_stage_seconds"]["series"]
+    except (OSError, KeyError, ValueError):
+        return {}
+    return {entry["labels"]["stage"]: (entry["count"], entry["p50"], entry["p99"]) for entry in series}
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="bench_end_to_end_")
+    directories = {name: os.path.join(work_dir, name.lower()) for name in ("FILES", "PROCESSED", "FAILED")}
+    for directory in directories.values():
+        os.makedirs(directory, exist_ok=True)
+    staging = os.path.join(work_dir, "staging")
+    os.makedirs(staging)
+    log_path = os.path.join(work_dir, "ftp", "vsftpd.log")
+    os.makedirs(os.path.dirname(log_path))
+    open(log_path, "w").close()
+    app_log = os.path.join(work_dir, "app.log")
+    metrics_file = os.path.join(work_dir, "metrics.json")
+
+    print(f"Generating {args.photos} photos and {args.videos} videos of {args.video_mb} MB "
+          f"from {args.devices} devices in {work_dir}")
+    photo_size = tuple(int(value) for value in args.photo_size.split("x"))
+    schedule = upload_schedule(make_uploads(staging, args.photos, args.videos, args.devices, args.video_mb,
+                                            photo_size), args.burst)
+    total = sum(len(group) for group in schedule)
+
+    telegram = telegram_server(latency=args.telegram_latency, rate_limit_ratio=args.rate_limit_ratio,
+                               failure_ratio=args.failure_ratio, seed=1).start()
+    elasticsearch = elasticsearch_server(latency=args.es_latency, seed=2).start()
+
+    env = dict(os.environ)
+    env.update({f"{name}_DIRECTORY": path for name, path in directories.items()})
+    env.update({
+        "LOG_FILE_PATH": log_path,
+        "APP_LOG_FILE": app_log,
+        "JOB_STORE_PATH": os.path.join(work_dir, "jobs.db"),
+        "ES_SPOOL_FILE": os.path.join(work_dir, "es_spool.jsonl"),
+        "LOG_CHECKPOINT_FILE": os.path.join(work_dir, "log_checkpoint.json"),
+        "METRICS_FILE": metrics_file,
+        "TELEGRAM_API_URL": telegram.url,
+        "TELEGRAM_BOT_TOKEN": "TOKEN",
+        "TELEGRAM_CHAT_ID": "1",
+        "ELASTICSEARCH_HOST": elasticsearch.url,
+        "ELASTICSEARCH_INDEX": "bench",
+        "ELASTICSEARCH_APIKEY_ID": "bench",
+        "ELASTICSEARCH_APIKEY_VALUE": "bench",
+        "PIPELINE_MODE": args.mode,
+        "STARTUP_SCAN": "false",
+    })
+    # Keep retries of injected failures within the run unless set explicitly
+    env.setdefault("RETRY_BASE_DELAY", "1")
+    env.setdefault("REDRIVE_INTERVAL", "5")
+    if args.unthrottled:
+        env.update({"TELEGRAM_GLOBAL_RATE": "10000", "TELEGRAM_CHAT_RATE": "10000"})
+
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")], cwd=work_dir, env=env,
+                               stdout=subprocess.DEVNULL)
+    try:
+        wait_for_startup(app_log, process)
+
+        uploaded_at = {}
+        delivered_at = {}
+        failed = set()
+        interval = 1 / args.rate if args.rate > 0 else 0
+        start = next_upload = time.perf_counter()
+        pending = list(schedule)
+        deadline = None
+        with open(log_path, "a") as log:
+            while True:
+                now = time.perf_counter()
+                if pending and now >= next_upload:
+                    group = pending.pop(0)
+                    for path in group:
+                        name = os.path.basename(path)
+                        os.rename(path, os.path.join(directories["FILES"], name))
+                        log.write(UPLOAD_LINE.format(time=time.strftime("%a %b %e %H:%M:%S %Y", time.gmtime()),
+                                                     name=name, size=os.path.getsize(
+                                                         os.path.join(directories["FILES"], name))))
+                        log.flush()
+                        uploaded_at[name] = time.perf_counter()
+                    next_upload += interval * len(group)
+                    if not pending:
+                        deadline = time.perf_counter() + args.timeout
+
+                now = time.perf_counter()
+                for name in archived(directories["PROCESSED"]) - delivered_at.keys():
+                    delivered_at[name] = now
+                failed = archived(directories["FAILED"])
+                if not pending and len(delivered_at) + len(failed) >= total:
+                    break
+                if deadline and now > deadline:
+                    print(f"Timed out after {args.timeout}s with {total - len(delivered_at) - len(failed)} "
+                          f"files outstanding.")
+                    break
+                time.sleep(POLL_INTERVAL)
+        elapsed = max(delivered_at.values(), default=start) - start
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        telegram.stop()
+        elasticsearch.stop()
+
+    latencies = [delivered_at[name] - uploaded_at[name] for name in delivered_at if name in uploaded_at]
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss  # KiB on Linux
+    telegram_outcomes = {}
+    for request in telegram.requests:
+        telegram_outcomes[request["outcome"]] = telegram_outcomes.get(request["outcome"], 0) + 1
+    results = {
+        "mode": args.mode,
+        "files": total,
+        "delivered": len(delivered_at),
+        "failed": len(failed),
+        "seconds": elapsed,
+        "files_per_second": len(delivered_at) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+        "peak_rss_mb": peak_rss_kb / 1024,
+        "telegram_requests": telegram_outcomes,
+        "telegram_bytes": sum(request["bytes"] for request in telegram.requests),
+        "documents_indexed": sum(request.get("documents", 0) for request in elasticsearch.requests
+                                 if request.get("outcome", "ok") == "ok"),
+        "stages": stage_summary(metrics_file),
+        "work_dir": work_dir,
+    }
+
+    print(f"{args.mode}: {results['delivered']}/{total} delivered, {results['failed']} failed "
+          f"in {elapsed:.1f}s: {results['files_per_second']:.1f} files/s")
+    print(f"upload-to-delivered latency p50={results['latency_p50'] * 1000:.0f} ms "
+          f"p99={results['latency_p99'] * 1000:.0f} ms, peak RSS {results['peak_rss_mb']:.0f} MB")
+    print(f"telegram requests {telegram_outcomes}, {results['telegram_bytes'] / 1e6:.1f} MB uploaded, "
+          f"{results['documents_indexed']} documents indexed")
+    for stage, (count, p50, p99) in sorted(results["stages"].items()):
+        print(f"  {stage:<16} n={count:<6} p50={p50 * 1000:9.1f} ms p99={p99 * 1000:9.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against stub Telegram and Elasticsearch.")
+    parser.add_argument("--photos", type=int, default=200)
+    parser.add_argument("--videos", type=int, default=10)
+    parser.add_argument("--photo-size", default="1920x1080", help="WIDTHxHEIGHT of each synthetic photo")
+    parser.add_argument("--video-mb", type=int, default=8, help="Size of each synthetic clip")
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20, help="Uploads per second, 0 uploads everything at once")
+    parser.add_argument("--burst", type=int, default=5, help="Consecutive uploads from one camera")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--telegram-latency", type=float, default=0.1, help="Seconds per Telegram request")
+    parser.add_argument("--es-latency", type=float, default=0.02, help="Seconds per Elasticsearch request")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.01, help="Share of Telegram requests answered 429")
+    parser.add_argument("--failure-ratio", type=float, default=0.01, help="Share of requests answered 5xx")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="Lift the Telegram rate limits, so the pipeline rather than the limiter is measured")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait after the last upload")
+    parser.add_argument("--output", help="Write the results as JSON for comparing releases")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark: single-pass header-only EXIF reader vs. the previous two-open approach.
+
+Usage: python benchmarks/bench_exif.py [image.jpg ...]
+Without arguments a synthetic 24 MP JPEG with GPS and DateTimeOriginal tags is generated.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import piexif
+from PIL import Image
+import metadata_extractor
+from metadata_extractor import read_metadata
+
+ITERATIONS = 200
+
+
+def legacy_extract(path):
+    """The pre-refactor extraction: two Image.open calls and two EXIF parses."""
+    img = Image.open(path)
+    exif_data = piexif.load(img.info.get("exif", b""))
+    gps = exif_data.get("GPS", {})
+    img = Image.open(path)
+    timestamp = (img._getexif() or {}).get(36867)
+    return gps, timestamp
+
+
+def make_sample(directory):
+    path = os.path.join(directory, "001-sample.jpg")
+    exif = piexif.dump({
+        "0th": {piexif.ImageIFD.Orientation: 1},
+        "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2024:10:01 05:30:00"},
+        "GPS": {
+            piexif.GPSIFD.GPSLatitudeRef: b"N",
+            piexif.GPSIFD.GPSLatitude: ((60, 1), (49, 1), (5376, 100)),
+            piexif.GPSIFD.GPSLongitudeRef: b"E",
+            piexif.GPSIFD.GPSLongitude: ((14, 1), (11, 1), (5346, 100)),
+        },
+    })
+    Image.new("RGB", (6000, 4000), (90, 110, 70)).save(path, quality=90, exif=exif)
+    return path
+
+
+def bench(label, func, paths):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for path in paths:
+            func(path)
+    elapsed = time.perf_counter() - start
+    per_file = elapsed / (ITERATIONS * len(paths)) * 1e6
+    print(f"{label:<28} {per_file:10.1f} us/file")
+
+
+def uncached(path):
+    metadata_extractor._read_metadata_cached.cache_clear()
+    return read_metadata(path)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sys.argv[1:] or [make_sample(directory)]
+        bench("legacy (two opens)", legacy_extract, paths)
+        bench("header-only, uncached", uncached, paths)
+        bench("header-only, cached", read_metadata, paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measures upload-to-detection latency of the log monitor backends.
+
+Usage: python benchmarks/bench_log_detection.py [uploads]
+
+For each backend an upload line is appended to a fake vsftpd log and the time until
+LogHandler submits the file is recorded. CPU time used by the process while idle
+is reported as well.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_log_detection_")
+for name in ("FILES", "PROCESSED", "FAILED"):
+    os.environ[f"{name}_DIRECTORY"] = os.path.join(WORK_DIR, name.lower())
+os.environ["JOB_STORE_PATH"] = os.path.join(WORK_DIR, "jobs.db")
+os.environ["APP_LOG_FILE"] = os.path.join(WORK_DIR, "app.log")
+os.environ["LOG_CHECKPOINT_FILE"] = os.path.join(WORK_DIR, "log_checkpoint.json")
+os.environ.setdefault("ELASTICSEARCH_HOST", "http://127.0.0.1:9200")
+os.environ.setdefault("ELASTICSEARCH_APIKEY_ID", "bench")
+os.environ.setdefault("ELASTICSEARCH_APIKEY_VALUE", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import FILES_DIRECTORY, LOG_CHECKPOINT_FILE, ensure_directories
+from monitor import start_log_monitoring
+from utils import setup_logging
+
+UPLOAD_LINE = ('Thu Oct 17 05:30:00 2024 [pid 1234] [camera] OK UPLOAD: Client "10.0.0.2", '
+               '"/upload/{name}", 1024 bytes, 512.00Kbyte/sec\n')
+
+
+def bench_backend(backend, uploads):
+    log_path = os.path.join(WORK_DIR, f"vsftpd-{backend}.log")
+    open(log_path, "w").close()
+    # Every backend starts at the end of its own log, not from the previous backend's checkpoint
+    if os.path.exists(LOG_CHECKPOINT_FILE):
+        os.remove(LOG_CHECKPOINT_FILE)
+    detected = {}
+    event = threading.Event()
+
+    def submit(filepath):
+        detected[os.path.basename(filepath)] = time.perf_counter()
+        event.set()
+
+    observer, handler = start_log_monitoring(log_path, submit, backend=backend)
+    time.sleep(0.5)
+
+    latencies = []
+    for i in range(uploads):
+        name = f"001-{backend}-{i:04d}.jpg"
+        open(os.path.join(FILES_DIRECTORY, name), "wb").close()
+        event.clear()
+        written = time.perf_counter()
+        with open(log_path, "a") as log:
+            log.write(UPLOAD_LINE.format(name=name))
+        if event.wait(10):
+            latencies.append(detected[name] - written)
+        time.sleep(0.05)
+
+    cpu_before = time.process_time()
+    time.sleep(5)
+    idle_cpu = (time.process_time() - cpu_before) / 5
+
+    observer.stop()
+    observer.join()
+    handler.close()
+
+    latencies.sort()
+    print(f"{backend:<8} detected={len(latencies)}/{uploads} "
+          f"p50={statistics.median(latencies) * 1000:8.1f} ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:8.1f} ms "
+          f"idle_cpu={idle_cpu:.2%}")
+
+
+def main():
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    setup_logging()
+    ensure_directories()
+    for backend in ("inotify", "polling"):
+        bench_backend(backend, uploads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Catch-up throughput of the log reader on a large synthetic vsftpd log.
+
+Usage: python benchmarks/bench_log_reader.py [size_mb] [upload_percent]
+
+Writes a log of `size_mb` megabytes (2 GB by default) of CONNECT, LOGIN, DOWNLOAD and
+UPLOAD lines, with `upload_percent` of them successful uploads and a few invalid UTF-8
+bytes. It is then read once with the previous approach, readlines() with decoding and a
+regex per line, and once with LogReader, reporting lines/s, MB/s and the growth of peak RSS.
+Each reader runs in its own process so their peak memory does not mix.
+"""
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LINES = (
+    'Thu Oct 17 05:30:{second:02d} 2024 [pid {pid}] CONNECT: Client "10.0.{a}.{b}"\n',
+    'Thu Oct 17 05:30:{second:02d} 2024 [pid {pid}] [camera{a}] OK LOGIN: Client "10.0.{a}.{b}"\n',
+    'Thu Oct 17 05:30:{second:02d} 2024 [pid {pid}] [camera{a}] OK DOWNLOAD: Client "10.0.{a}.{b}", '
+    '"/pub/firmware-{b}.bin", 1048576 bytes, 4096.00Kbyte/sec\n',
+    'Thu Oct 17 05:30:{second:02d} 2024 [pid {pid}] [camera{a}] FAIL UPLOAD: Client "10.0.{a}.{b}", '
+    '"/upload/{a:03d}-IMG_{pid:05d}.JPG", 0.00Kbyte/sec\n',
+)
+UPLOAD = ('Thu Oct 17 05:30:{second:02d} 2024 [pid {pid}] [camera{a}] OK UPLOAD: Client "10.0.{a}.{b}", '
+          '"/upload/{a:03d}-IMG_{pid:05d}.JPG", 2873211 bytes, 2048.00Kbyte/sec\n')
+
+
+def make_log(path, size_mb, upload_percent):
+    """Writes a block of varied lines repeatedly until the log reaches `size_mb` megabytes."""
+    lines = []
+    for index in range(20000):
+        values = {"second": index % 60, "pid": index, "a": index % 250, "b": index % 200}
+        if index % 100 < upload_percent:
+            lines.append(UPLOAD.format(**values).encode())
+        else:
+            lines.append(LINES[index % len(LINES)].format(**values).encode())
+        if index % 5000 == 0:
+            lines.append(b'Thu Oct 17 05:30:00 2024 [pid 1] CONNECT: Client "\xff\xfe\xfd"\n')
+    block = b"".join(lines)
+    target = size_mb * 1024 * 1024
+    with open(path, "wb") as f:
+        while f.tell() < target:
+            f.write(block)
+
+
+def read_lines(path):
+    """The reader before LogReader: every line is decoded and matched."""
+    pattern = re.compile(r'OK UPLOAD:.*?"[^"]+",\s*"([^"]+)"')
+    lines = uploads = 0
+    with open(path, "rb") as f:
+        for line in f.readlines():
+            text = line.decode("utf-8", errors="replace")
+            lines += 1
+            if 'OK UPLOAD:' in text and pattern.search(text):
+                uploads += 1
+    return lines, uploads
+
+
+def read_chunks(path):
+    from log_reader import LogReader
+    with open(path, "rb") as f:
+        reader = LogReader(f)
+        uploads = sum(1 for upload in reader.uploads() if upload.path)
+    return reader.lines, uploads
+
+
+def child(name, path):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    lines, uploads = (read_lines if name == "readlines" else read_chunks)(path)
+    elapsed = time.perf_counter() - start
+    growth_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+    size_mb = os.path.getsize(path) / 1e6
+    print(f"{name:<10} {lines} lines, {uploads} uploads in {elapsed:6.2f}s: "
+          f"{lines / elapsed / 1e6:6.2f} M lines/s {size_mb / elapsed:7.1f} MB/s, "
+          f"peak RSS +{growth_mb:.0f} MB")
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    upload_percent = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    with tempfile.TemporaryDirectory(prefix="bench_log_reader_") as directory:
+        path = os.path.join(directory, "vsftpd.log")
+        make_log(path, size_mb, upload_percent)
+        print(f"Synthetic log: {os.path.getsize(path) / 1e6:.0f} MB, {upload_percent}% uploads")
+        env = dict(os.environ, APP_LOG_FILE=os.path.join(directory, "app.log"))
+        for name in ("readlines", "chunked"):
+            subprocess.run([sys.executable, __file__, "--child", name, path], env=env, check=True)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main()
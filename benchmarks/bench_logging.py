@@ -0,0 +1,97 @@
+"""
+Latency that logging adds to the threads that log, with and without the queue handler.
+
+Usage: python benchmarks/bench_logging.py [threads] [records_per_thread] [stall_ms]
+
+Each configuration runs in its own process with the application's setup_logging(). A
+burst of `threads` threads logs per-file records, like the pipeline workers do, while
+every 200th flush of the log file stalls for `stall_ms` milliseconds, as a write to an
+SD card occasionally does. Reports the time spent in each logger call and the burst's
+wall time, for the text and JSON formats.
+"""
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIGURATIONS = (
+    ("direct", "text", "false"),
+    ("queue", "text", "true"),
+    ("direct", "json", "false"),
+    ("queue", "json", "true"),
+)
+
+
+def child(threads, records, stall_ms):
+    sys.path.insert(0, ROOT)
+    from logging.handlers import RotatingFileHandler
+    from utils import logger, setup_logging, stop_logging, file_fields
+
+    flushes = [0]
+    original_flush = RotatingFileHandler.flush
+
+    def stalling_flush(self):
+        flushes[0] += 1
+        if flushes[0] % 200 == 0:
+            time.sleep(stall_ms / 1000)
+        original_flush(self)
+
+    RotatingFileHandler.flush = stalling_flush
+    setup_logging()
+    durations = [[] for _ in range(threads)]
+
+    def work(index):
+        timings = durations[index]
+        for number in range(records):
+            filename = f"{index:03d}-IMG_{number:05d}.JPG"
+            start = time.perf_counter()
+            logger.info("Successfully sent %s via Telegram.", filename,
+                        extra=file_fields(filename, stage='send_file', duration=0.25))
+            timings.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    stop_logging()
+    written = time.perf_counter() - start
+
+    calls = sorted(duration for timings in durations for duration in timings)
+    print(f"{os.environ['BENCH_NAME']:<6} {os.environ['LOG_FORMAT']:<4} "
+          f"call p50={statistics.median(calls) * 1e6:7.1f} us "
+          f"p99={calls[int(len(calls) * 0.99)] * 1e6:8.1f} us max={calls[-1] * 1e3:7.1f} ms, "
+          f"burst {elapsed * 1e3:7.0f} ms, all written after {written * 1e3:7.0f} ms", file=sys.stderr)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    stall_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(f"{threads} threads x {records} records, {stall_ms:.0f} ms stall every 200 flushes")
+    with tempfile.TemporaryDirectory(prefix="bench_logging_") as directory:
+        for name, log_format, log_queue in CONFIGURATIONS:
+            env = dict(os.environ, BENCH_NAME=name, LOG_FORMAT=log_format, LOG_QUEUE=log_queue,
+                       LOG_LEVEL="INFO", APP_LOG_FILE=os.path.join(directory, f"{name}-{log_format}.log"))
+            # Log records also go to stdout, the child reports on stderr
+            result = subprocess.run([sys.executable, __file__, "--child", str(threads), str(records), str(stall_ms)],
+                                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True, text=True)
+            lines = 0
+            for path in glob.glob(env["APP_LOG_FILE"] + "*"):  # Including rotated files
+                with open(path) as f:
+                    lines += sum(1 for _ in f)
+            print(f"{result.stderr.strip()}, {lines} lines in the log file")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        main()
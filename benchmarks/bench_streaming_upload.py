@@ -0,0 +1,91 @@
+"""
+Checks that video uploads stream in constant memory.
+
+Usage: python benchmarks/bench_streaming_upload.py [size_mb ...]
+
+For each size a sparse file is uploaded through TelegramClient to a local stub
+server running in a child process. The peak RSS growth of this process must stay
+below a fixed bound regardless of file size; the legacy `requests.post(files=...)`
+upload is measured last for comparison (ru_maxrss only ever grows).
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix="bench_streaming_upload_")
+for name in ("FILES", "PROCESSED", "FAILED"):
+    os.environ[f"{name}_DIRECTORY"] = os.path.join(WORK_DIR, name.lower())
+os.environ["JOB_STORE_PATH"] = os.path.join(WORK_DIR, "jobs.db")
+os.environ["APP_LOG_FILE"] = os.path.join(WORK_DIR, "app.log")
+os.environ.setdefault("ELASTICSEARCH_HOST", "http://127.0.0.1:9200")
+os.environ.setdefault("ELASTICSEARCH_APIKEY_ID", "bench")
+os.environ.setdefault("ELASTICSEARCH_APIKEY_VALUE", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import requests
+from telegram_client import TelegramClient
+
+MEMORY_BOUND_MB = 32
+
+SERVER_SCRIPT = """
+import sys, time
+sys.path.insert(0, {bench_dir!r})
+from stub_servers import telegram_server
+server = telegram_server().start()
+print(server.url, flush=True)
+while True:
+    time.sleep(3600)
+"""
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_file(size_mb):
+    path = os.path.join(WORK_DIR, f"001-{size_mb}mb.mp4")
+    with open(path, "wb") as f:
+        f.truncate(size_mb * 1024 * 1024)
+    return path
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50, 200, 400]
+    server = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT.format(bench_dir=BENCH_DIR)],
+                              stdout=subprocess.PIPE, text=True)
+    url = server.stdout.readline().strip()
+    try:
+        client = TelegramClient(token="TOKEN", chat_id="1", api_url=url)
+        baseline = peak_rss_mb()
+        ok = True
+        for size_mb in sizes:
+            path = make_file(size_mb)
+            start = time.perf_counter()
+            response = client._post("sendVideo", {"chat_id": "1"}, [("video", os.path.basename(path), path)],
+                                    os.path.basename(path))
+            growth = peak_rss_mb() - baseline
+            within = growth < MEMORY_BOUND_MB
+            ok = ok and within and response.status_code == 200
+            print(f"streamed  {size_mb:5d} MB: status={response.status_code} "
+                  f"peak RSS growth={growth:7.1f} MB {'ok' if within else 'EXCEEDED'} "
+                  f"({time.perf_counter() - start:.2f}s)")
+            os.remove(path)
+
+        path = make_file(sizes[-1])
+        with open(path, "rb") as f:
+            requests.post(f"{url}/botTOKEN/sendVideo", data={"chat_id": "1"}, files={"video": f}, timeout=600)
+        print(f"requests  {sizes[-1]:5d} MB: peak RSS growth={peak_rss_mb() - baseline:7.1f} MB")
+        os.remove(path)
+    finally:
+        server.terminate()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
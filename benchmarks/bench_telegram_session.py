@@ -0,0 +1,61 @@
+"""
+Benchmark: per-file upload latency with a fresh connection per request (the old
+module-level requests.post) vs. the pooled keep-alive TelegramClient session.
+
+Usage: python benchmarks/bench_telegram_session.py [files] [connect_delay_ms]
+
+The stub server runs on localhost over plain HTTP, so the handshake saved per file
+is only a TCP connect. `connect_delay_ms` adds a delay to every newly accepted
+connection to approximate a TCP+TLS handshake over a slow uplink.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from stub_servers import telegram_server
+from telegram_client import TelegramClient
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    connect_delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.3
+
+    server = telegram_server()
+    original_finish_request = server.finish_request
+
+    def delayed_finish_request(request, client_address):
+        time.sleep(connect_delay)
+        original_finish_request(request, client_address)
+
+    server.finish_request = delayed_finish_request
+    server.start()
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as photo:
+        photo.write(os.urandom(500 * 1024))
+        photo.flush()
+
+        url = f"{server.url}/botTOKEN/sendPhoto"
+        start = time.perf_counter()
+        for _ in range(count):
+            with open(photo.name, "rb") as f:
+                requests.post(url, data={"chat_id": "1"}, files={"photo": f}, timeout=60)
+        per_file_before = (time.perf_counter() - start) / count
+
+        client = TelegramClient(token="TOKEN", chat_id="1", api_url=server.url)
+        start = time.perf_counter()
+        for _ in range(count):
+            client._post("sendPhoto", {"chat_id": "1"}, [("photo", "photo.jpg", photo.name)], "bench")
+        per_file_after = (time.perf_counter() - start) / count
+        client.close()
+
+    server.stop()
+    print(f"requests.post per call:   {per_file_before * 1000:8.1f} ms/file")
+    print(f"pooled session:           {per_file_after * 1000:8.1f} ms/file")
+
+
+if __name__ == "__main__":
+    main()
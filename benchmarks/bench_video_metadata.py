@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: header-only MP4/MOV metadata reader on large clips.
+
+Usage: python benchmarks/bench_video_metadata.py [video.mp4 ...]
+Without arguments synthetic clips of 400 MB are generated (sparse files) with the moov
+atom both after the media data, as trail cameras write it, and before it (faststart).
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metadata_extractor
+from metadata_extractor import read_video_metadata
+
+ITERATIONS = 2000
+MP4_EPOCH_OFFSET = 2082844800  # Seconds from 1904-01-01 to 1970-01-01
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def make_mp4(path, size_mb=400, width=1920, height=1080, duration=10, gps="+60.8149+014.1981/",
+             faststart=False, created=1727760600):
+    """
+    Writes a minimal MP4 with an mvhd, an audio and a video tkhd and a udta/©xyz location.
+    The mdat box is a sparse hole of `size_mb` megabytes.
+    """
+    mvhd = box(b"mvhd", struct.pack(">B3xIIII", 0, created + MP4_EPOCH_OFFSET, 0, 1000, duration * 1000)
+               + bytes(80))
+    identity = struct.pack(">9i", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    audio = box(b"trak", box(b"tkhd", struct.pack(">B3x5I", 0, 0, 0, 2, 0, 0) + bytes(16) + identity
+                             + struct.pack(">II", 0, 0)))
+    video = box(b"trak", box(b"tkhd", struct.pack(">B3x5I", 0, 0, 0, 1, 0, 0) + bytes(16) + identity
+                             + struct.pack(">II", width << 16, height << 16)))
+    location = gps.encode()
+    udta = box(b"udta", box(b"\xa9xyz", struct.pack(">HH", len(location), 0x15c7) + location))
+    moov = box(b"moov", mvhd + audio + video + udta)
+    ftyp = box(b"ftyp", b"isom\x00\x00\x02\x00isomiso2mp41")
+    mdat_size = size_mb * 1024 * 1024
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        if faststart:
+            f.write(moov)
+        f.write(struct.pack(">I4sQ", 1, b"mdat", mdat_size + 16))
+        f.seek(mdat_size, os.SEEK_CUR)
+        if not faststart:
+            f.write(moov)
+        else:
+            f.truncate()
+    return path
+
+
+def uncached(path):
+    metadata_extractor._read_video_metadata_cached.cache_clear()
+    return read_video_metadata(path)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sys.argv[1:] or [make_mp4(os.path.join(directory, "001-trailing.mp4")),
+                                 make_mp4(os.path.join(directory, "001-faststart.mp4"), faststart=True)]
+        for path in paths:
+            print(f"{os.path.basename(path)}: {os.path.getsize(path) / 1e6:.0f} MB {uncached(path)}")
+            start = time.perf_counter()
+            for _ in range(ITERATIONS):
+                uncached(path)
+            per_file = (time.perf_counter() - start) / ITERATIONS * 1e6
+            print(f"{'header-only, uncached':<28} {per_file:10.1f} us/file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Import-time regression check for the application entry point.
+
+Usage: python benchmarks/check_import_time.py [budget_ms]
+
+Runs `python -X importtime -c "import main"` in a fresh process from an empty working
+directory, prints the slowest modules by cumulative import time and fails if one of
+the heavy libraries that are only needed once a file is processed (Elasticsearch, PIL,
+numpy, aiohttp, ...) was imported, if the import created any file or directory, such as
+the job store, the log file or the upload directories, or if importing main took longer
+than `budget_ms`.
+It then starts main.py and reports how long it takes to log "Started monitoring".
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that must not be imported by `import main`
+HEAVY_MODULES = ("elasticsearch", "elastic_transport", "aiohttp", "PIL", "piexif", "numpy", "pytz", "asyncio")
+LINE_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def environment(directory):
+    env = dict(os.environ)
+    for name in ("FILES", "PROCESSED", "FAILED"):
+        env[f"{name}_DIRECTORY"] = os.path.join(directory, name.lower())
+    env.update({
+        "JOB_STORE_PATH": os.path.join(directory, "jobs.db"),
+        "APP_LOG_FILE": os.path.join(directory, "app.log"),
+        "LOG_FILE_PATH": os.path.join(directory, "vsftpd.log"),
+        "LOG_CHECKPOINT_FILE": os.path.join(directory, "checkpoint.json"),
+        "STARTUP_SCAN": "false",
+        "ELASTICSEARCH_HOST": env.get("ELASTICSEARCH_HOST", "http://127.0.0.1:9200"),
+        "ELASTICSEARCH_APIKEY_ID": env.get("ELASTICSEARCH_APIKEY_ID", "bench"),
+        "ELASTICSEARCH_APIKEY_VALUE": env.get("ELASTICSEARCH_APIKEY_VALUE", "bench"),
+    })
+    return env
+
+
+def import_times(env, cwd):
+    """Returns {module: cumulative microseconds} for `import main`, run from `cwd`."""
+    env = dict(env, PYTHONPATH=ROOT)
+    # Relative paths such as jobs.db and app.log resolve to the empty working directory
+    for name in ("JOB_STORE_PATH", "APP_LOG_FILE", "LOG_CHECKPOINT_FILE", "ES_SPOOL_FILE"):
+        env.pop(name, None)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def time_to_monitoring(env, log_path, timeout=30):
+    """Seconds from starting main.py until it logs that monitoring started, or None."""
+    open(log_path, "w").close()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        deadline = start + timeout
+        for line in process.stdout:
+            if "Started monitoring" in line:
+                return time.perf_counter() - start
+            if time.perf_counter() > deadline:
+                break
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    with tempfile.TemporaryDirectory(prefix="check_import_time_") as directory:
+        env = environment(directory)
+        import_directory = os.path.join(directory, "import")
+        os.mkdir(import_directory)
+        modules = import_times(env, import_directory)
+        created = sorted(os.listdir(import_directory)) + sorted(set(os.listdir(directory)) - {"import"})
+        total_ms = modules.get("main", 0) / 1000
+        print(f"import main: {total_ms:.1f} ms")
+        for name, micros in sorted(modules.items(), key=lambda item: -item[1])[:15]:
+            print(f"  {micros / 1000:8.1f} ms  {name}")
+
+        heavy = sorted({name for name in modules if name.split(".")[0] in HEAVY_MODULES})
+        failed = False
+        if heavy:
+            print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+            failed = True
+        if created:
+            print(f"FAIL: import main created files: {', '.join(created)}")
+            failed = True
+        if budget_ms is not None and total_ms > budget_ms:
+            print(f"FAIL: import main took {total_ms:.1f} ms, budget {budget_ms:.1f} ms")
+            failed = True
+
+        elapsed = time_to_monitoring(env, env["LOG_FILE_PATH"])
+        if elapsed is None:
+            print("main.py did not report monitoring")
+        else:
+            print(f"main.py reached monitoring in {elapsed * 1000:.0f} ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Local stand-ins for the Telegram Bot API and Elasticsearch used by the benchmarks.
+
+Both servers speak HTTP/1.1 with keep-alive, can inject latency, 429s and failures,
+and record what they received so benchmarks can measure delivery.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class, latency=0.0, rate_limit_ratio=0.0, failure_ratio=0.0, seed=None):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.failure_ratio = failure_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def roll(self):
+        """Pick the outcome for one request: 'ok', 'rate_limited' or 'failed'."""
+        with self.lock:
+            value = self.random.random()
+        if value < self.rate_limit_ratio:
+            return "rate_limited"
+        if value < self.rate_limit_ratio + self.failure_ratio:
+            return "failed"
+        return "ok"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # Bytes of each request body kept for inspection; the rest is read and discarded
+    # so large uploads do not inflate the memory of the process hosting the stub
+    BODY_HEAD_SIZE = 1 << 20
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        remaining = length
+        head = []
+        kept = 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            if kept < self.BODY_HEAD_SIZE:
+                head.append(chunk)
+                kept += len(chunk)
+            remaining -= len(chunk)
+        self.body_length = length - remaining
+        return b"".join(head)
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _TelegramHandler(_StubHandler):
+    def do_POST(self):
+        received_at = time.time()
+        body = self._read_body()
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        method = self.path.rsplit("/", 1)[-1]
+        outcome = server.roll()
+        with server.lock:
+            message_id = len(server.requests) + 1
+            server.requests.append({
+                "method": method, "bytes": self.body_length, "received_at": received_at,
+                "outcome": outcome, "body_head": body[:4096],
+            })
+        if outcome == "rate_limited":
+            self._reply(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}})
+        elif outcome == "failed":
+            self._reply(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+        else:
+            def message(message_id):
+                file_id = f"stub-file-{message_id}"
+                return {"message_id": message_id, "photo": [{"file_id": file_id}], "video": {"file_id": file_id}}
+
+            if method == "sendMediaGroup":
+                count = max(1, body.count(b"\"type\""))
+                result = [message(message_id * 100 + index) for index in range(count)]
+            else:
+                result = message(message_id)
+            self._reply(200, {"ok": True, "result": result})
+
+
+class _ElasticsearchHandler(_StubHandler):
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, {"version": {"number": "8.17.0"}, "tagline": "You Know, for Search"})
+
+    def do_PUT(self):
+        if self.path.split("?")[0].rstrip("/").endswith("_bulk"):
+            self.do_POST()
+            return
+        self._read_body()
+        self._reply(200, {"acknowledged": True})
+
+    def do_POST(self):
+        body = self._read_body()
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if not self.path.split("?")[0].rstrip("/").endswith("_bulk"):
+            with server.lock:
+                server.requests.append({"path": self.path, "documents": 1})
+            self._reply(201, {"result": "created"})
+            return
+        lines = [line for line in body.splitlines() if line.strip()]
+        documents = len(lines) // 2
+        outcome = server.roll()
+        if outcome == "failed":
+            self._reply(503, {"error": "unavailable"})
+            return
+        status = 429 if outcome == "rate_limited" else 201
+        with server.lock:
+            server.requests.append({"path": self.path, "documents": documents, "outcome": outcome})
+        items = [{"index": {"status": status}} for _ in range(documents)]
+        self._reply(200, {"errors": status != 201, "items": items})
+
+
+def telegram_server(**kwargs):
+    return _StubServer(_TelegramHandler, **kwargs)
+
+
+def elasticsearch_server(**kwargs):
+    return _StubServer(_ElasticsearchHandler, **kwargs)
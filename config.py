@@ -7,33 +7,117 @@ load_dotenv()
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 10))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 60))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 256 * 1024))  # Bytes read per chunk when streaming uploads
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 4))  # Parallel sends of an uploaded file to further chats
+
+# Telegram rate limits (messages per second, per private chat per second, per group per minute)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_RATE_PER_MINUTE', 20))
 
 # Elasticsearch cluster
 ELASTICSEARCH_HOST = os.getenv('ELASTICSEARCH_HOST')
 ELASTICSEARCH_INDEX = os.getenv('ELASTICSEARCH_INDEX')
 ELASTICSEARCH_APIKEY_ID = os.getenv('ELASTICSEARCH_APIKEY_ID')
 ELASTICSEARCH_APIKEY_VALUE = os.getenv('ELASTICSEARCH_APIKEY_VALUE')
+ES_BULK_SIZE = int(os.getenv('ES_BULK_SIZE', 500))
+ES_FLUSH_INTERVAL_MS = int(os.getenv('ES_FLUSH_INTERVAL_MS', 2000))
+ES_BULK_MAX_RETRIES = int(os.getenv('ES_BULK_MAX_RETRIES', 3))
+ES_SPOOL_FILE = os.getenv('ES_SPOOL_FILE', 'es_spool.jsonl')  # Unsent documents while the cluster is unreachable
+ES_SPOOL_RETRY_INTERVAL = int(os.getenv('ES_SPOOL_RETRY_INTERVAL', 60))
 
 # Log file path
 LOG_FILE_PATH = os.getenv('LOG_FILE_PATH', '/var/log/vsftpd.log')
+LOG_MONITOR_BACKEND = os.getenv('LOG_MONITOR_BACKEND', 'auto').lower()  # auto, inotify or polling
+LOG_POLLING_INTERVAL = float(os.getenv('LOG_POLLING_INTERVAL', 2))
+LOG_CHECKPOINT_FILE = os.getenv('LOG_CHECKPOINT_FILE', 'log_checkpoint.json')
+LOG_CHECKPOINT_INTERVAL = float(os.getenv('LOG_CHECKPOINT_INTERVAL', 10))  # Seconds between checkpoint writes
+LOG_READ_CHUNK_SIZE = int(os.getenv('LOG_READ_CHUNK_SIZE', 1024 * 1024))  # Bytes read from the log at a time
+
+# Scan FILES_DIRECTORY on startup. Can be disabled when the log checkpoint covers restarts;
+# files the job store knows as unfinished, e.g. waiting for a retry, are resumed either way.
+STARTUP_SCAN = os.getenv('STARTUP_SCAN', 'true').lower() in ('1', 'true', 'yes')
+BACKLOG_PROGRESS_INTERVAL = float(os.getenv('BACKLOG_PROGRESS_INTERVAL', 30))  # Seconds between progress lines
+
+# Re-indexing the processed archive with backfill.py
+BACKFILL_PROGRESS_FILE = os.getenv('BACKFILL_PROGRESS_FILE', 'backfill_progress.json')
+BACKFILL_PROCESSES = int(os.getenv('BACKFILL_PROCESSES', os.cpu_count() or 1))
+BACKFILL_SPOOL_FILE = os.getenv('BACKFILL_SPOOL_FILE', 'backfill_spool.jsonl')  # Kept apart from the application's spool
 
 # Directory paths
 FILES_DIRECTORY = os.getenv('FILES_DIRECTORY', '/path/to/files/')
 PROCESSED_DIRECTORY = os.getenv('PROCESSED_DIRECTORY', '/path/to/processed/')
 FAILED_DIRECTORY = os.getenv('FAILED_DIRECTORY', '/path/to/failed/')
+# Files Telegram refused, e.g. too large. Not re-driven, unlike the year-month directories of FAILED_DIRECTORY.
+REJECTED_DIRECTORY = os.getenv('REJECTED_DIRECTORY', os.path.join(FAILED_DIRECTORY, 'rejected'))
+
+# Moves to another filesystem are copied and their sources removed after an fsync per batch of files
+ARCHIVE_FSYNC_BATCH = int(os.getenv('ARCHIVE_FSYNC_BATCH', 32))
+ARCHIVE_FSYNC_INTERVAL = float(os.getenv('ARCHIVE_FSYNC_INTERVAL', 10))  # Seconds until a partial batch is flushed
+# Store processed files once per content under PROCESSED_DIRECTORY/.objects, hardlinked by year-month
+ARCHIVE_CONTENT_ADDRESSED = os.getenv('ARCHIVE_CONTENT_ADDRESSED', 'false').lower() in ('1', 'true', 'yes')
 
 # Application logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 APP_LOG_FILE = os.getenv('APP_LOG_FILE', 'app.log')
+# 'text' for the classic format or 'json' for one JSON object per line, e.g. for shipping to Elasticsearch
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+# Write log records from a background thread, so file I/O never blocks processing
+LOG_QUEUE = os.getenv('LOG_QUEUE', 'true').lower() in ('1', 'true', 'yes')
+
+# Metrics served in the Prometheus text format on METRICS_HOST:METRICS_PORT (0 disables)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_FILE = os.getenv('METRICS_FILE', '')  # JSON snapshot written on shutdown, empty disables
+
+# Job store recording how far each file got, so restarts resume instead of resending
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', 'jobs.db')
 
 # Retry settings
 MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 5))  # Seconds before the first retry, doubled per retry
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 600))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # Consecutive failed sends
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 60))  # Seconds before a trial send
+REDRIVE_INTERVAL = float(os.getenv('REDRIVE_INTERVAL', 300))  # Seconds between re-drives of FAILED_DIRECTORY, 0 disables
+REDRIVE_BATCH = int(os.getenv('REDRIVE_BATCH', 50))
+REDRIVE_MAX_AGE_DAYS = float(os.getenv('REDRIVE_MAX_AGE_DAYS', 7))
+REDRIVE_MAX_ATTEMPTS = int(os.getenv('REDRIVE_MAX_ATTEMPTS', 3))
+
+# Processing pipeline
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 4))
+QUEUE_SIZE = int(os.getenv('QUEUE_SIZE', 1000))
+STATS_INTERVAL = int(os.getenv('STATS_INTERVAL', 60))  # Seconds between pipeline stats log lines
+
+# 'threads' runs the worker pool above; 'asyncio' runs everything on one event loop (requires aiohttp)
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'threads').lower()
+ASYNC_CONCURRENCY = int(os.getenv('ASYNC_CONCURRENCY', 16))  # Files in flight at once in asyncio mode
+
+# Photos from one device arriving within this many seconds are sent as one album (0 disables)
+ALBUM_WINDOW = float(os.getenv('ALBUM_WINDOW', 3))
+
+# Photo downscaling before upload (0 disables). Telegram scales photos to about 1280px anyway.
+PHOTO_MAX_DIMENSION = int(os.getenv('PHOTO_MAX_DIMENSION', 0))
+PHOTO_JPEG_QUALITY = int(os.getenv('PHOTO_JPEG_QUALITY', 85))
+TRANSFORM_PROCESSES = int(os.getenv('TRANSFORM_PROCESSES', 2))
+UPLOAD_TMP_DIRECTORY = os.getenv('UPLOAD_TMP_DIRECTORY')  # Defaults to the system temp directory
+
+# Near-duplicate suppression: photos whose perceptual hash is within DEDUP_THRESHOLD bits
+# of one of the last DEDUP_WINDOW photos sent from the same device are indexed but not sent
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+DEDUP_THRESHOLD = int(os.getenv('DEDUP_THRESHOLD', 5))
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 20))
 
 # Define supported file extensions
 PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
 VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv']
 
-# Ensure directories exist
-os.makedirs(FILES_DIRECTORY, exist_ok=True)
-os.makedirs(PROCESSED_DIRECTORY, exist_ok=True)
-os.makedirs(FAILED_DIRECTORY, exist_ok=True)
+
+def ensure_directories():
+    """Creates the upload, processed and failed directories. Called on application startup."""
+    os.makedirs(FILES_DIRECTORY, exist_ok=True)
+    os.makedirs(PROCESSED_DIRECTORY, exist_ok=True)
+    os.makedirs(FAILED_DIRECTORY, exist_ok=True)
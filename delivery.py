@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import TELEGRAM_CHAT_ID, FANOUT_WORKERS
+from device_chats import DEVICE_CHATS
+from job_store import get_job_store, file_hash, STAGE_NEW
+from telegram_client import (send_file, send_existing, send_media_group, send_media_group_existing,
+                             SendFailure, TRANSIENT, ERROR, RATE_LIMITED, REJECTED)
+from utils import logger, get_device_id
+
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+# The failure a delivery reports when chats failed differently: one worth retrying wins
+FAILURE_PRECEDENCE = (TRANSIENT, ERROR, RATE_LIMITED, REJECTED)
+
+
+def get_chats(device_id):
+    """
+    Returns the chats a device's media is delivered to. The first one receives the upload.
+    """
+    return [str(chat_id) for chat_id in DEVICE_CHATS.get(device_id, [TELEGRAM_CHAT_ID])]
+
+
+def record_message(content_hash, filename, chat_id, message):
+    """Records a delivered Message and the file_id Telegram assigned to the media."""
+    get_job_store().record_delivery(content_hash, chat_id, message.message_id)
+    if message.file_id:
+        get_job_store().record(content_hash, filename, STAGE_NEW, file_id=message.file_id)
+
+
+class Delivery:
+    """
+    The state of delivering one file to the chats of its device, shared by the threaded
+    and the asyncio senders: the chats, the message ids of the chats that already have
+    the file according to the job store, the file_id to send it to further chats by and
+    the failure of the chats that did not get it.
+    """
+
+    def __init__(self, filepath, file_type, filename, device_id):
+        self.filepath = filepath
+        self.file_type = file_type
+        self.filename = filename
+        self.content_hash = file_hash(filepath)
+        self.chats = get_chats(device_id)
+        self.delivered = get_job_store().get_deliveries(self.content_hash)
+        job = get_job_store().get(self.content_hash)
+        self.file_id = job.file_id if job else None
+        self.pending = [chat_id for chat_id in self.chats if chat_id not in self.delivered]
+        self.failure = None
+
+    def upload_chat(self):
+        """Returns the chat to upload the file to, or None if it can be sent by file_id."""
+        if self.pending and not self.file_id:
+            return self.pending.pop(0)
+        return None
+
+    def record(self, chat_id, message):
+        """Records a message sent to `chat_id`, or the SendFailure. Returns False if sending failed."""
+        if not message:
+            failure = message if isinstance(message, SendFailure) else ERROR
+            if self.failure is None or FAILURE_PRECEDENCE.index(failure) < FAILURE_PRECEDENCE.index(self.failure):
+                self.failure = failure
+            return False
+        record_message(self.content_hash, self.filename, chat_id, message)
+        self.delivered[chat_id] = message.message_id
+        self.file_id = self.file_id or message.file_id
+        return True
+
+    def fanout_send(self, send_file, send_existing):
+        """
+        Returns the call that sends the file to one further chat, given its chat id:
+        `send_existing` with the file_id, or `send_file` uploading it again without one.
+        """
+        if self.file_id:
+            return lambda chat_id: send_existing(self.file_type, self.file_id, self.filename, chat_id)
+        logger.warning("No file_id returned for %s. Uploading it to each chat.", self.filename)
+        return lambda chat_id: send_file(self.filepath, self.file_type, self.filename, chat_id)
+
+    def result(self):
+        """
+        Returns the message id in the device's first chat if every chat has the file,
+        the SendFailure otherwise.
+        """
+        missing = [chat_id for chat_id in self.chats if chat_id not in self.delivered]
+        if missing:
+            logger.warning("%s is not yet delivered to chats: %s", self.filename, ', '.join(missing))
+            return self.failure if self.failure is not None else ERROR
+        return self.delivered[self.chats[0]]
+
+
+def deliver_file(filepath, file_type, filename, device_id):
+    """
+    Delivers a file to every chat of its device.
+    The file is uploaded once, to the first chat still missing it, and the other chats
+    receive the same media by its file_id in parallel. Chats that already have the file,
+    according to the job store, are skipped, so a retry never uploads it again.
+    Returns the message id in the device's first chat if every chat has the file, a SendFailure otherwise.
+    """
+    delivery = Delivery(filepath, file_type, filename, device_id)
+    chat_id = delivery.upload_chat()
+    if chat_id and not delivery.record(chat_id, send_file(filepath, file_type, filename, chat_id)):
+        return delivery.result()
+
+    if delivery.pending:
+        send = delivery.fanout_send(send_file, send_existing)
+        futures = {chat_id: _fanout_executor.submit(send, chat_id) for chat_id in delivery.pending}
+        for chat_id, future in futures.items():
+            delivery.record(chat_id, future.result())
+    return delivery.result()
+
+
+def deliver_album(album):
+    """
+    Delivers an album of (filepath, filename) photos from one device to all of its chats.
+    The album is uploaded to the first chat and sent to the others by file_id in parallel.
+    Returns one message id per photo if every chat received the album, None otherwise;
+    the caller then falls back to deliver_file per photo, which only fills the gaps.
+    """
+    device_id = get_device_id(album[0][1])
+    chats = get_chats(device_id)
+    hashes = [file_hash(filepath) for filepath, _ in album]
+    if any(get_job_store().get_deliveries(content_hash) for content_hash in hashes):
+        logger.info("Some photos of the album were delivered before. Delivering them one by one.")
+        return None
+
+    messages = send_media_group(album, chats[0])
+    if not messages:
+        return None
+    filenames = [filename for _, filename in album]
+    for content_hash, filename, message in zip(hashes, filenames, messages):
+        record_message(content_hash, filename, chats[0], message)
+
+    file_ids = [message.file_id for message in messages]
+    if len(chats) > 1 and not all(file_ids):
+        logger.warning("Missing file_ids for album %s. Delivering photos one by one.", ', '.join(filenames))
+        return None
+
+    complete = True
+    futures = {chat_id: _fanout_executor.submit(send_media_group_existing, file_ids, filenames, chat_id)
+               for chat_id in chats[1:]}
+    for chat_id, future in futures.items():
+        chat_messages = future.result()
+        if not chat_messages:
+            complete = False
+            continue
+        for content_hash, filename, message in zip(hashes, filenames, chat_messages):
+            record_message(content_hash, filename, chat_id, message)
+
+    return [message.message_id for message in messages] if complete else None
@@ -0,0 +1,5 @@
+# Telegram chats each device's media is delivered to, e.g. a family group, a hunting-team
+# group and an archive channel. Devices not listed here go to TELEGRAM_CHAT_ID only.
+DEVICE_CHATS = {
+    # "001": ["-1001111111111", "-1002222222222", "-1003333333333"]
+}
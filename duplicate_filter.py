@@ -0,0 +1,74 @@
+import threading
+from config import DEDUP_THRESHOLD, DEDUP_WINDOW
+from utils import logger
+
+HASH_SIZE = 8  # 8x8 gradient bits -> one 64-bit hash
+
+
+def dhash(filepath):
+    """
+    Computes a 64-bit difference hash of a photo.
+    JPEG draft mode decodes at 1/8 scale, so the full-resolution image is never built.
+    """
+    import numpy as np
+    from PIL import Image
+    with Image.open(filepath) as img:
+        img.draft('L', (HASH_SIZE * 16, HASH_SIZE * 16))
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
+
+
+def hamming_distances(hashes, frame_hash):
+    """Bit distance between `frame_hash` and every hash in a uint64 array."""
+    import numpy as np
+    xor = np.bitwise_xor(hashes, frame_hash)
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class DuplicateFilter:
+    """
+    Flags frames that look like one of the last `window` frames sent from the same device.
+
+    Only frames that were not duplicates enter the window, so a deer standing still for
+    an hour is compared against the frame that was actually sent rather than drifting
+    along a chain of near-identical frames.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, window=DEDUP_WINDOW):
+        self.threshold = threshold
+        self.window = window
+        self._hashes = {}  # device_id -> uint64 ring buffer
+        self._names = {}   # device_id -> file names in ring buffer order
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def check(self, device_id, filename, frame_hash):
+        """
+        Returns the name of the closest earlier frame within the threshold, or None.
+        Frames that are not duplicates are added to the device's window.
+        """
+        import numpy as np
+        with self._lock:
+            hashes = self._hashes.get(device_id)
+            count = self._counts.get(device_id, 0)
+            if hashes is None:
+                hashes = self._hashes[device_id] = np.zeros(self.window, dtype=np.uint64)
+                self._names[device_id] = [None] * self.window
+
+            filled = min(count, self.window)
+            if filled:
+                distances = hamming_distances(hashes[:filled], frame_hash)
+                closest = int(np.argmin(distances))
+                if distances[closest] <= self.threshold:
+                    original = self._names[device_id][closest]
+                    logger.info("%s is a near-duplicate of %s (distance %s).",
+                                filename, original, distances[closest])
+                    return original
+
+            slot = count % self.window
+            hashes[slot] = frame_hash
+            self._names[device_id][slot] = filename
+            self._counts[device_id] = count + 1
+            return None
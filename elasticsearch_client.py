@@ -1,16 +1,340 @@
-from elasticsearch import Elasticsearch
+import json
+import os
+import threading
+import time
 from datetime import datetime
-from config import ELASTICSEARCH_HOST, ELASTICSEARCH_INDEX, ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE
+from config import (ELASTICSEARCH_HOST, ELASTICSEARCH_INDEX, ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE,
+                    ES_BULK_SIZE, ES_FLUSH_INTERVAL_MS, ES_BULK_MAX_RETRIES, ES_SPOOL_FILE, ES_SPOOL_RETRY_INTERVAL)
+from metrics import STAGE_SECONDS
 from utils import logger
 
-# Initialize Elasticsearch client with API key authentication
-es = Elasticsearch(
-    hosts=ELASTICSEARCH_HOST,
-    api_key=(ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE)
-)
+_client = None
+_client_lock = threading.Lock()
 
-def create_index():
-    """Create an Elasticsearch index with ECS-compatible mapping."""
+
+def get_client():
+    """
+    Returns the shared Elasticsearch client. The elasticsearch package is imported and the
+    client created on first use, so importing this module costs no startup time.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from elasticsearch import Elasticsearch
+            # Initialize Elasticsearch client with API key authentication
+            _client = Elasticsearch(
+                hosts=ELASTICSEARCH_HOST,
+                api_key=(ELASTICSEARCH_APIKEY_ID, ELASTICSEARCH_APIKEY_VALUE)
+            )
+        return _client
+
+
+class BulkIndexer:
+    """
+    Buffers documents and indexes them through the bulk API.
+
+    The buffer is flushed once `bulk_size` documents are queued or `flush_interval`
+    seconds have passed. Items rejected with a retryable status are retried, and
+    batches that cannot be delivered are appended to `spool_file` and replayed once
+    the cluster accepts requests again. A document's `on_stored` callback runs once the
+    cluster acknowledged it or it was spooled. Without a `client` the shared client is used.
+    With `ensure_index` the index is created before the first batch is sent, so the
+    application does not wait for Elasticsearch on startup.
+    """
+
+    RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, client, index, bulk_size=ES_BULK_SIZE, flush_interval=ES_FLUSH_INTERVAL_MS / 1000,
+                 max_retries=ES_BULK_MAX_RETRIES, spool_file=ES_SPOOL_FILE,
+                 spool_retry_interval=ES_SPOOL_RETRY_INTERVAL, ensure_index=False):
+        self.client = client
+        self.index = index
+        self.ensure_index = ensure_index
+        self._index_ready = False
+        self.bulk_size = max(1, bulk_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spool_file = spool_file
+        self.spool_retry_interval = spool_retry_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_spool_attempt = 0.0
+        self._undelivered = False
+
+    def _ensure_started(self):
+        """Start the background flush thread on first use."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="es-bulk-indexer", daemon=True)
+                    self._thread.start()
+
+    @staticmethod
+    def _action(document, doc_id, on_stored):
+        action = {"_id": doc_id, "doc": document}
+        if on_stored:
+            action["on_stored"] = on_stored
+        return action
+
+    def add(self, document, doc_id=None, on_stored=None):
+        """Queue a document for indexing. `on_stored` is called once it is indexed or spooled."""
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append(self._action(document, doc_id, on_stored))
+            full = len(self._buffer) >= self.bulk_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                with self._flush_lock:
+                    self._flush()
+            except Exception as e:
+                logger.error("Error flushing documents to Elasticsearch: %s", e)
+
+    def flush(self):
+        """
+        Send everything currently buffered and replay the spool file if the cluster is reachable.
+        Returns False if any document was spooled instead of indexed since the previous flush().
+        """
+        with self._flush_lock:
+            self._flush()
+            undelivered, self._undelivered = self._undelivered, False
+        return not undelivered
+
+    def _flush(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+            if not self._send(batch):
+                self._spool_remaining(batch)
+                return
+
+        if self._replay_due():
+            self._replay_spool()
+
+    def _next_batch(self):
+        """Removes and returns up to `bulk_size` buffered actions."""
+        with self._lock:
+            batch = self._buffer[:self.bulk_size]
+            del self._buffer[:self.bulk_size]
+        return batch
+
+    def _spool_remaining(self, batch):
+        """Spools a batch the cluster did not accept, and everything still buffered after it."""
+        self._undelivered = True
+        self._spool(batch)
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._spool(batch)
+
+    def _replay_due(self):
+        """True if documents are spooled, or left from an interrupted replay, and the retry interval has passed."""
+        spooled = os.path.exists(self.spool_file) or os.path.exists(self.spool_file + ".replay")
+        return spooled and time.monotonic() - self._last_spool_attempt >= self.spool_retry_interval
+
+    def _operations(self, actions):
+        """Bulk API body for a batch of buffered actions."""
+        operations = []
+        for action in actions:
+            meta = {"_index": self.index}
+            if action["_id"] is not None:
+                meta["_id"] = action["_id"]
+            operations.append({"index": meta})
+            operations.append(action["doc"])
+        return operations
+
+    def _retryable(self, actions, response):
+        """
+        Returns the actions of a bulk response that failed with a retryable status.
+        Acknowledged actions are marked stored, others are logged.
+        """
+        retry = []
+        for action, item in zip(actions, response["items"]):
+            result = item.get("index", {})
+            status = result.get("status", 0)
+            if status < 300:
+                self._stored([action])
+                continue
+            if status in self.RETRYABLE_STATUSES:
+                retry.append(action)
+            else:
+                logger.error("Elasticsearch rejected document %s: %s",
+                             action['doc'].get('file'), result.get('error'))
+        return retry
+
+    def _send(self, actions):
+        """
+        Index a batch, retrying items that failed with a retryable status.
+        Returns False if the cluster could not be reached and the batch should be spooled.
+        """
+        if self.client is None:
+            self.client = get_client()
+        if self.ensure_index and not self._index_ready:
+            self._index_ready = create_index(self.index, self.client)
+        pending = actions
+        for attempt in range(self.max_retries + 1):
+            try:
+                with STAGE_SECONDS.time(stage='es_bulk'):
+                    response = self.client.bulk(operations=self._operations(pending))
+            except Exception as e:
+                self._bulk_failed(e)
+                return False
+            pending = self._to_retry(pending, response, attempt)
+            if not pending:
+                return True
+            time.sleep(self._retry_delay(attempt))
+        self._give_up(pending)
+        return True
+
+    def _bulk_failed(self, error):
+        """Notes a bulk request that did not reach the cluster, delaying the next spool replay."""
+        logger.error("Bulk request to Elasticsearch failed: %s", error)
+        self._last_spool_attempt = time.monotonic()
+
+    def _to_retry(self, pending, response, attempt):
+        """Returns the actions of a bulk response to send again, an empty list once the batch is done."""
+        if not response.get("errors"):
+            logger.debug("Bulk indexed %s documents into %s.", len(pending), self.index)
+            self._stored(pending)
+            return []
+        retry = self._retryable(pending, response)
+        if retry:
+            logger.warning("%s documents failed bulk indexing, retrying (%s/%s).",
+                           len(retry), attempt + 1, self.max_retries)
+        return retry
+
+    @staticmethod
+    def _retry_delay(attempt):
+        return min(2 ** attempt, 30)
+
+    def _give_up(self, pending):
+        logger.error("Giving up on %s documents after %s retries. Spooling them.", len(pending), self.max_retries)
+        self._undelivered = True
+        self._spool(pending)
+
+    def _stored(self, actions):
+        """Runs the `on_stored` callbacks of actions that were indexed or spooled, once each."""
+        callbacks = [action.pop("on_stored") for action in actions if "on_stored" in action]
+        if callbacks:
+            self._run_callbacks(callbacks)
+
+    def _run_callbacks(self, callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Error in on_stored callback of an indexed document: %s", e)
+
+    def _spool(self, actions):
+        """Append undelivered actions to the spool file."""
+        try:
+            with self._spool_lock, open(self.spool_file, "a") as f:
+                for action in actions:
+                    f.write(json.dumps({"_id": action["_id"], "doc": action["doc"]}) + "\n")
+            logger.warning("Spooled %s documents to %s.", len(actions), self.spool_file)
+        except Exception as e:
+            logger.error("Failed to spool %s documents to %s: %s", len(actions), self.spool_file, e)
+            return
+        self._stored(actions)
+
+    def _take_spool(self):
+        """Moves the spool file aside for replaying, so new failures can be spooled meanwhile."""
+        self._last_spool_attempt = time.monotonic()
+        replay_file = self.spool_file + ".replay"
+        with self._spool_lock:
+            # A replay file left by an interrupted replay is finished first
+            if not os.path.exists(replay_file):
+                os.replace(self.spool_file, replay_file)
+        logger.info("Replaying spooled documents from %s.", replay_file)
+        return replay_file
+
+    def _spooled_batches(self, replay_file):
+        """
+        Yields the actions of a spool file in bulk-sized batches. Lines that cannot be decoded,
+        such as one cut short by a crash while spooling, are moved to a `.bad` file.
+        """
+        with open(replay_file) as f:
+            batch = []
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    self._quarantine(line)
+                    continue
+                if len(batch) >= self.bulk_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def _quarantine(self, line):
+        """Keep an undecodable spool line aside for inspection instead of failing the replay."""
+        bad_file = self.spool_file + ".bad"
+        logger.warning("Skipping undecodable spooled document. Kept it in %s.", bad_file)
+        try:
+            with self._spool_lock, open(bad_file, "a") as f:
+                f.write(line if line.endswith("\n") else line + "\n")
+        except Exception as e:
+            logger.error("Failed to keep undecodable spooled document in %s: %s", bad_file, e)
+
+    def _replay_batches(self, replay_file):
+        """
+        Generator for replaying a spool file: yields each batch to resend and is sent back
+        whether it was indexed. After the first failure the remaining batches are spooled again.
+        """
+        sent = 0
+        reachable = True
+        for batch in self._spooled_batches(replay_file):
+            if reachable and (yield batch):
+                sent += len(batch)
+            else:
+                reachable = False
+                self._spool(batch)
+        os.remove(replay_file)
+        logger.info("Replayed %s spooled documents into %s.", sent, self.index)
+
+    def _replay_spool(self):
+        """Resend spooled actions in bulk-sized batches. Anything left undelivered is spooled again."""
+        replay = self._replay_batches(self._take_spool())
+        indexed = None
+        while True:
+            try:
+                batch = replay.send(indexed)
+            except StopIteration:
+                return
+            indexed = self._send(batch)
+
+    def close(self):
+        """Stop the flush thread and send whatever is still buffered."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+indexer = BulkIndexer(None, ELASTICSEARCH_INDEX, ensure_index=True)
+
+
+def create_index(index=ELASTICSEARCH_INDEX, client=None):
+    """
+    Create an Elasticsearch index with ECS-compatible mapping, through the shared client by default.
+    Returns True if the index exists afterwards.
+    """
+    es = client or get_client()
     mapping = {
         "mappings": {
             "properties": {
@@ -34,24 +358,30 @@ def create_index():
                     "properties": {
                         "name": {"type": "keyword"}
                     }
-                }
+                },
+                "duplicate_of": {"type": "keyword"}
             }
         }
     }
 
     try:
-        logger.debug(f"Checking if index '{ELASTICSEARCH_INDEX}' exists.")
-        if not es.indices.exists(index=ELASTICSEARCH_INDEX):
-            logger.debug(f"Creating index '{ELASTICSEARCH_INDEX}' with mapping: {mapping}")
-            es.indices.create(index=ELASTICSEARCH_INDEX, body=mapping)
-            logger.info(f"Created Elasticsearch index: {ELASTICSEARCH_INDEX}")
+        logger.debug("Checking if index '%s' exists.", index)
+        if not es.indices.exists(index=index):
+            logger.debug("Creating index '%s' with mapping: %s", index, mapping)
+            es.indices.create(index=index, body=mapping)
+            logger.info("Created Elasticsearch index: %s", index)
         else:
-            logger.info(f"Elasticsearch index already exists: {ELASTICSEARCH_INDEX}")
+            logger.info("Elasticsearch index already exists: %s", index)
+        return True
     except Exception as e:
-        logger.error(f"Error creating Elasticsearch index: {e}")
+        logger.error("Error creating Elasticsearch index: %s", e)
+        return False
 
-def ingest_metadata(device_id, gps_coords, timestamp_taken, filename):
-    """Ingest ECS-compliant metadata into Elasticsearch."""
+def build_document(device_id, gps_coords, timestamp_taken, filename, duplicate_of=None):
+    """
+    Returns the ECS-compliant document for a photo or video.
+    `duplicate_of` names the earlier photo a near-duplicate frame was suppressed in favour of.
+    """
     document = {
         "device": {
             "id": device_id
@@ -67,9 +397,28 @@ def ingest_metadata(device_id, gps_coords, timestamp_taken, filename):
             "name": filename
         }
     }
+    if duplicate_of:
+        document["duplicate_of"] = duplicate_of
+    return document
+
+
+@STAGE_SECONDS.time(stage='ingest_metadata')
+def ingest_metadata(device_id, gps_coords, timestamp_taken, filename, duplicate_of=None, target=None, doc_id=None,
+                    on_stored=None):
+    """
+    Queue ECS-compliant metadata for bulk ingestion into Elasticsearch.
+    `target` is the indexer to queue on, the shared BulkIndexer by default. Passing the
+    file's content hash as `doc_id` makes re-ingesting the same file overwrite its document.
+    `on_stored` is called once the document was indexed or spooled.
+    """
+    (target or indexer).add(build_document(device_id, gps_coords, timestamp_taken, filename, duplicate_of),
+                            doc_id=doc_id, on_stored=on_stored)
+    logger.info("Metadata queued for Elasticsearch for device: %s", device_id)
+
 
+def close_indexer():
+    """Flush pending documents. Call before the application exits."""
     try:
-        es.index(index=ELASTICSEARCH_INDEX, document=document)
-        logger.info(f"Metadata ingested into Elasticsearch for device: {device_id}")
+        indexer.close()
     except Exception as e:
-        logger.error(f"Failed to ingest metadata into Elasticsearch: {e}")
+        logger.error("Failed to flush metadata to Elasticsearch: %s", e)
@@ -1,8 +1,21 @@
+import errno
 import shutil
 import os
+import threading
 from datetime import datetime
-from config import PROCESSED_DIRECTORY, FAILED_DIRECTORY
-from utils import logger
+from config import (PROCESSED_DIRECTORY, FAILED_DIRECTORY, REJECTED_DIRECTORY, ARCHIVE_FSYNC_BATCH, ARCHIVE_FSYNC_INTERVAL,
+                    ARCHIVE_CONTENT_ADDRESSED)
+from job_store import file_hash
+from utils import logger, file_fields
+from metrics import STAGE_SECONDS
+
+# Destination directories known to exist, so the archive does not call makedirs for every file
+_created_directories = set()
+
+# Cross-device copies whose source is deleted once the copy is fsynced, as (source, destination, identity)
+_pending_deletes = []
+_pending_lock = threading.Lock()
+_flush_timer = None
 
 def get_file_timestamp(filepath):
     """
@@ -12,24 +25,153 @@ def get_file_timestamp(filepath):
         mtime = os.path.getmtime(filepath)
         return datetime.fromtimestamp(mtime)
     except Exception as e:
-        logger.error(f"Error getting timestamp for {filepath}: {e}")
+        logger.error("Error getting timestamp for %s: %s", filepath, e)
         return None
 
-def organize_file(filepath, processed=True):
+def ensure_directory(path):
+    """Creates a directory once per process."""
+    if path not in _created_directories:
+        os.makedirs(path, exist_ok=True)
+        _created_directories.add(path)
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _identity(stat):
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+def flush_archive():
+    """
+    Makes pending cross-device copies durable and removes their sources.
+    Files and their directories are fsynced once per batch rather than once per file.
+    A source is only removed if it is still the file that was copied, not a new upload of the same name.
+    """
+    global _pending_deletes, _flush_timer
+    with _pending_lock:
+        batch, _pending_deletes = _pending_deletes, []
+        if _flush_timer:
+            _flush_timer.cancel()
+            _flush_timer = None
+    if not batch:
+        return
+    try:
+        for _, destination, _ in batch:
+            _fsync_path(destination)
+        for directory in {os.path.dirname(destination) for _, destination, _ in batch}:
+            _fsync_path(directory)
+    except OSError as e:
+        # Keep the sources; the next run archives them again
+        logger.error("Could not fsync %s archived files. Keeping their sources: %s", len(batch), e)
+        return
+    for source, _, identity in batch:
+        try:
+            if _identity(os.stat(source)) != identity:
+                logger.info("%s was replaced since it was archived. Keeping the new file.", source)
+                continue
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+    logger.debug("Flushed %s cross-device archive copies.", len(batch))
+
+def _copy_across_devices(source, destination):
+    """
+    Copies a file to another filesystem under a temporary name and renames it into place.
+    The source is removed by flush_archive once a batch of copies has been fsynced,
+    or ARCHIVE_FSYNC_INTERVAL seconds after the first copy of a partial batch.
+    """
+    global _flush_timer
+    identity = _identity(os.stat(source))
+    partial = destination + ".part"
+    shutil.copyfile(source, partial)  # Uses sendfile() in the kernel on Linux
+    shutil.copystat(source, partial)
+    os.replace(partial, destination)
+    with _pending_lock:
+        _pending_deletes.append((source, destination, identity))
+        full = len(_pending_deletes) >= ARCHIVE_FSYNC_BATCH
+        if not full and _flush_timer is None:
+            _flush_timer = threading.Timer(ARCHIVE_FSYNC_INTERVAL, flush_archive)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+    if full:
+        flush_archive()
+
+def _move(source, destination):
+    """Renames a file atomically, or copies it when the destination is on another filesystem."""
+    try:
+        os.replace(source, destination)
+    except FileNotFoundError:
+        if not os.path.exists(source):
+            raise
+        # The destination directory was removed behind the cache's back
+        _created_directories.discard(os.path.dirname(destination))
+        ensure_directory(os.path.dirname(destination))
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        _copy_across_devices(source, destination)
+
+def _link(target, destination):
+    """Hardlinks `destination` to `target`, replacing a different file of the same name."""
+    try:
+        os.link(target, destination)
+    except FileExistsError:
+        if os.path.samefile(target, destination):
+            return
+        temporary = destination + ".link"
+        os.link(target, temporary)
+        os.replace(temporary, destination)
+
+def _archive_content_addressed(filepath, destination, content_hash):
+    """
+    Stores a file once per content under PROCESSED_DIRECTORY/.objects and hardlinks it
+    into the year-month directory. A byte-identical re-upload only adds a link.
+    """
+    object_dir = os.path.join(PROCESSED_DIRECTORY, ".objects", content_hash[:2])
+    ensure_directory(object_dir)
+    object_path = os.path.join(object_dir, content_hash)
+    if os.path.exists(object_path):
+        _link(object_path, destination)
+        os.remove(filepath)
+        logger.info("%s is identical to an archived file. Linked it.", os.path.basename(filepath))
+    else:
+        _move(filepath, object_path)
+        _link(object_path, destination)
+
+@STAGE_SECONDS.time(stage='organize_file')
+def organize_file(filepath, processed=True, timestamp=None, content_hash=None, rejected=False):
     """
     Moves the file to the processed or failed directory, organized by year-month.
+    Failed files that were `rejected` go to REJECTED_DIRECTORY, which is never re-driven.
+    `timestamp` is the capture time from the file's metadata; the modification time is used without it.
+    Processed files are stored content-addressed when ARCHIVE_CONTENT_ADDRESSED is enabled.
+    Returns True if the file was moved.
     """
-    timestamp = get_file_timestamp(filepath)
+    if timestamp and timestamp.tzinfo:
+        timestamp = timestamp.astimezone()  # Local time, like modification times
+    if not timestamp:
+        timestamp = get_file_timestamp(filepath)
     if not timestamp:
         # Use current time if timestamp retrieval failed
         timestamp = datetime.utcnow()
     year_month = timestamp.strftime('%Y-%m')
-    destination_dir = os.path.join(PROCESSED_DIRECTORY if processed else FAILED_DIRECTORY, year_month)
-    os.makedirs(destination_dir, exist_ok=True)
+    root = PROCESSED_DIRECTORY if processed else REJECTED_DIRECTORY if rejected else FAILED_DIRECTORY
+    destination_dir = os.path.join(root, year_month)
     destination = os.path.join(destination_dir, os.path.basename(filepath))
     try:
-        shutil.move(filepath, destination)
-        status = "Processed" if processed else "Failed"
-        logger.info(f"{status} file moved to {destination_dir}.")
+        ensure_directory(destination_dir)
+        if processed and ARCHIVE_CONTENT_ADDRESSED:
+            _archive_content_addressed(filepath, destination, content_hash or file_hash(filepath))
+        else:
+            _move(filepath, destination)
+        status = "Processed" if processed else "Rejected" if rejected else "Failed"
+        logger.info("%s file moved to %s.", status, destination_dir,
+                    extra=file_fields(os.path.basename(filepath), outcome=status.lower()))
+        return True
     except Exception as e:
-        logger.error(f"Error moving file {filepath} to {destination}: {e}")
+        logger.error("Error moving file %s to %s: %s", filepath, destination, e)
+        return False
@@ -1,96 +1,388 @@
+import heapq
 import os
+import threading
 import time
 from datetime import datetime, timezone
-from utils import logger, get_file_type
-from metadata_extractor import extract_gps, extract_timestamp
+from utils import logger, get_file_type, get_device_id
+from metadata_extractor import read_metadata, read_video_metadata
 from elasticsearch_client import ingest_metadata
-from telegram_client import send_file
+from delivery import deliver_file, deliver_album
+from telegram_client import TRANSIENT, RATE_LIMITED, REJECTED
 from file_organizer import organize_file
-from config import FILES_DIRECTORY, MAX_RETRIES
+from album_batcher import AlbumBatcher
+from duplicate_filter import DuplicateFilter, dhash
+from retry_scheduler import circuit_breaker, retry_scheduler
+from metrics import STAGE_SECONDS, FILES
+from job_store import get_job_store, file_hash, STAGE_NEW, STAGE_INDEXED, STAGE_SENT, STAGE_MOVED, STAGE_NAMES
+from config import FILES_DIRECTORY, ALBUM_WINDOW, BACKLOG_PROGRESS_INTERVAL, DEDUP_ENABLED
 from device_coordinates import DEVICE_COORDINATES
 
 
-def process_file(filepath):
+class SendAttempt:
     """
-    Processes a single file:
-    - For JPG files: extracts GPS and timestamp, ingests metadata into Elasticsearch.
-    - Sends the file via Telegram.
-    - Organizes the file based on the success of sending.
+    One send of a file guarded by the circuit breaker, shared by the threaded and the asyncio pipeline.
+
+    `allowed` tells whether the breaker lets the send through. Used as a context manager
+    around the send, the `result` set inside is reported to the breaker: only transient
+    failures count against it, while any answer from Telegram, even a 4xx, shows it is
+    reachable. `result` stays False for a send the breaker held back.
+    """
+
+    def __init__(self, filename):
+        self.allowed = circuit_breaker.allow()
+        self.result = None if self.allowed else False
+        if not self.allowed:
+            logger.info("Telegram is unreachable. Not sending %s now.", filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.result or self.result is RATE_LIMITED or self.result is REJECTED:
+            circuit_breaker.record_success()
+        elif self.result is TRANSIENT:
+            circuit_breaker.record_failure()
+        else:
+            # A local error, or the send raised
+            circuit_breaker.record_inconclusive()
+
+
+def send_once(filepath, file_type, filename):
+    """
+    Delivers a single file to its device's chats via Telegram, unless the circuit breaker
+    holds sends back while Telegram is unreachable. Failed files are retried later by complete_file.
+    Returns the Telegram message id in the first chat if the file was delivered everywhere, the
+    SendFailure if the send failed and False if the circuit breaker held it back.
+    """
+    attempt = SendAttempt(filename)
+    if attempt.allowed:
+        with attempt:
+            attempt.result = deliver_file(filepath, file_type, filename, get_device_id(filename))
+    return attempt.result
+
+
+def send_album_once(album):
+    """
+    Delivers an album unless the circuit breaker is open. A failed album is not counted
+    against the breaker, its photos are sent one by one right after.
+    """
+    if not circuit_breaker.is_closed():
+        return None
+    return deliver_album(album)
+
+
+def capture_time(content_hash):
+    """
+    Returns the capture time recorded in the job store when the file's metadata was read,
+    or None, in which case the archive falls back to the file's modification time.
+    """
+    job = get_job_store().get(content_hash)
+    if job and job.captured_at:
+        return datetime.fromtimestamp(job.captured_at, timezone.utc)
+    return None
+
+
+def finish_file(filepath, message_id, rejected=False):
+    """
+    Records the send in the job store and organizes the file based on success or failure of sending.
+    Files Telegram `rejected` are kept apart from the failed files that are re-driven.
+    """
+    filename = os.path.basename(filepath)
+    content_hash = file_hash(filepath)
+    if message_id:
+        get_job_store().record(content_hash, filename, STAGE_SENT, message_id)
+    FILES.inc(outcome='sent' if message_id else 'rejected' if rejected else 'failed')
+    if organize_file(filepath, processed=bool(message_id), timestamp=capture_time(content_hash),
+                     content_hash=content_hash, rejected=rejected) and message_id:
+        get_job_store().record(content_hash, filename, STAGE_MOVED)
+
+
+def complete_file(filepath, message_id):
+    """
+    Finishes a sent file, or schedules another attempt for a file that could not be sent.
+    A file the circuit breaker held back (message_id False) waits for the breaker's reset
+    and a rate limited one for the backoff, without using up a retry. Files stay in
+    FILES_DIRECTORY while they wait and are moved to the failed directory once their
+    retries are used up. Files Telegram rejected are not retried.
+    """
+    if message_id:
+        retry_scheduler.clear(filepath)
+    elif message_id is REJECTED:
+        logger.warning("Telegram rejected %s. Not retrying it.", os.path.basename(filepath))
+        retry_scheduler.clear(filepath)
+        finish_file(filepath, None, rejected=True)
+        return
+    elif message_id is False and retry_scheduler.defer(filepath, circuit_breaker.retry_in()):
+        return
+    elif message_id is RATE_LIMITED and retry_scheduler.defer(filepath, retry_scheduler.delay(0)):
+        return
+    elif retry_scheduler.schedule(filepath):
+        return
+    finish_file(filepath, message_id)
+
+
+_album_batcher = None
+_album_batcher_lock = threading.Lock()
+
+
+def get_album_batcher():
+    """Returns the shared album batcher, created on first use, or None if albums are disabled."""
+    global _album_batcher
+    if ALBUM_WINDOW <= 0:
+        return None
+    with _album_batcher_lock:
+        if _album_batcher is None:
+            _album_batcher = AlbumBatcher(
+                send_album=send_album_once,
+                send_single=lambda filepath, filename: send_once(filepath, 'photo', filename),
+                on_complete=complete_file)
+        return _album_batcher
+
+duplicate_filter = DuplicateFilter() if DEDUP_ENABLED else None
+
+
+def find_duplicate(filepath, device_id, filename):
+    """
+    Returns the name of an earlier photo from the same device that `filepath` is a
+    near-duplicate of, or None. Photos that cannot be hashed are never treated as duplicates.
+    """
+    if not duplicate_filter:
+        return None
+    try:
+        frame_hash = dhash(filepath)
+    except Exception as e:
+        logger.warning("Could not compute perceptual hash for %s: %s", filename, e)
+        return None
+    return duplicate_filter.check(device_id, filename, frame_hash)
+
+
+def archive_duplicate(filepath, content_hash):
+    """
+    Moves a suppressed near-duplicate to the processed directory without sending it.
     """
     filename = os.path.basename(filepath)
-    device_id = filename.split("-")[0]  # Extract device ID from filename
+    FILES.inc(outcome='duplicate')
+    if organize_file(filepath, processed=True, timestamp=capture_time(content_hash), content_hash=content_hash):
+        get_job_store().record(content_hash, filename, STAGE_MOVED)
+
+
+def mark_indexed(content_hash, filename):
+    """
+    Returns the indexer callback recording STAGE_INDEXED, run once the document was
+    acknowledged by Elasticsearch or spooled. Until then a restart ingests the file again,
+    which overwrites the same document.
+    """
+    return lambda: get_job_store().record(content_hash, filename, STAGE_INDEXED)
+
+
+def prepare_file(filepath, target=None):
+    """
+    Runs the stages of process_file that come before sending: the job store lookup,
+    metadata ingestion (queued on the `target` indexer) and near-duplicate suppression.
+    Returns (file_type, device_id) if the file is to be sent, None if it is done or skipped.
+    """
+    filename = os.path.basename(filepath)
+    device_id = get_device_id(filename)
     file_type = get_file_type(filename)
 
-    logger.debug(f"Processing file: {filename}")
-    logger.debug(f"Detected file type: {file_type}")
+    logger.debug("Processing file: %s", filename)
+    logger.debug("Detected file type: %s", file_type)
 
     if not file_type:
-        logger.warning(f"process_file: Unsupported file type for file {filename}. Skipping.")
-        return
+        logger.warning("process_file: Unsupported file type for file %s. Skipping.", filename)
+        return None
+
+    if not os.path.exists(filepath):
+        logger.warning("process_file: File %s no longer exists. Skipping.", filepath)
+        return None
+
+    content_hash = file_hash(filepath)
+    job = get_job_store().get(content_hash)
+    if job:
+        logger.info("File %s was seen before as %s (stage: %s).", filename, job.filename, STAGE_NAMES[job.stage])
+        if job.stage >= STAGE_SENT and not job.message_id:
+            logger.info("File %s was suppressed as a near-duplicate before. Skipping send.", filename)
+            archive_duplicate(filepath, content_hash)
+            return None
+        if job.stage >= STAGE_SENT:
+            logger.info("File %s was already sent as message %s. Skipping send.", filename, job.message_id)
+            finish_file(filepath, job.message_id)
+            return None
 
-    if file_type in ['photo']:
+    duplicate_of = None
+    if job and job.stage >= STAGE_INDEXED:
+        logger.info("Metadata for %s already ingested. Skipping metadata ingestion.", filename)
+    elif file_type in ['photo']:
         # Extract GPS metadata and timestamp for JPG files
-        logger.info(f"Extracting metadata for photo file: {filename}")
-        gps_coords = extract_gps(filepath)
-        timestamp_taken = extract_timestamp(filepath)
+        logger.info("Extracting metadata for photo file: %s", filename)
+        with STAGE_SECONDS.time(stage='metadata'):
+            metadata = read_metadata(filepath)
+        gps_coords = metadata.gps
+        timestamp_taken = metadata.timestamp
+        captured_at = timestamp_taken.timestamp() if timestamp_taken else None
 
         if not gps_coords:
             gps_coords = DEVICE_COORDINATES.get(device_id)
             if gps_coords:
-                logger.info(f"No GPS data found in image. Using fallback coordinates for device {device_id}: {gps_coords}")
+                logger.info("No GPS data found in image. Using fallback coordinates for device %s: %s",
+                            device_id, gps_coords)
             else:
-                logger.warning(f"No GPS data and no fallback coordinates for device {device_id}. Skipping ingestion.")
-                return
+                logger.warning("No GPS data and no fallback coordinates for device %s. Skipping ingestion.",
+                               device_id)
+                return None
 
         # Ensure timestamp_taken has a value
         if not timestamp_taken:
             timestamp_taken = datetime.now(timezone.utc)
 
-        # Ingest metadata into Elasticsearch
-        ingest_metadata(device_id, gps_coords, timestamp_taken, filename)
+        # A file seen before, e.g. a retry, was compared already and would match itself
+        duplicate_of = find_duplicate(filepath, device_id, filename) if not job else None
+
+        # Ingest metadata into Elasticsearch. duplicate_of is kept for backfill, which rebuilds the document
+        get_job_store().record(content_hash, filename, STAGE_NEW, captured_at=captured_at, duplicate_of=duplicate_of)
+        ingest_metadata(device_id, gps_coords, timestamp_taken, filename, duplicate_of=duplicate_of,
+                        target=target, doc_id=content_hash, on_stored=mark_indexed(content_hash, filename))
     elif file_type in ['video']:
-        logger.info(f"Skipping metadata ingestion for video file: {filename}")
+        logger.info("Extracting metadata for video file: %s", filename)
+        with STAGE_SECONDS.time(stage='metadata'):
+            metadata = read_video_metadata(filepath)
+        gps_coords = metadata.gps or DEVICE_COORDINATES.get(device_id)
+        captured_at = metadata.timestamp.timestamp() if metadata.timestamp else None
+        get_job_store().record(content_hash, filename, STAGE_NEW, captured_at=captured_at)
+        if gps_coords:
+            ingest_metadata(device_id, gps_coords, metadata.timestamp or datetime.now(timezone.utc), filename,
+                            target=target, doc_id=content_hash, on_stored=mark_indexed(content_hash, filename))
+        else:
+            # Unlike photos, videos are still sent without a location
+            logger.warning("No GPS data and no fallback coordinates for device %s. "
+                           "Skipping metadata ingestion for video file: %s",
+                           device_id, filename)
     else:
         # This case should not occur due to get_file_type restrictions
         logger.warning(
-            f"Unhandled file type for file {filename}. Skipping metadata extraction.")
-
-    # Attempt to send the file via Telegram with retries
-    retries = 0
-    success = False
-    while retries < MAX_RETRIES and not success:
-        success = send_file(filepath, file_type, filename)
-        if not success:
-            retries += 1
-            logger.warning(
-                f"Retrying ({retries}/{MAX_RETRIES}) for file {filename}...")
-            time.sleep(2)  # Wait before retrying
-
-    # Organize the file based on success or failure
-    if success:
-        organize_file(filepath, processed=True)
-    else:
-        organize_file(filepath, processed=False)
+            "Unhandled file type for file %s. Skipping metadata extraction.", filename)
+
+    if duplicate_of:
+        logger.info("Not sending %s: near-duplicate of %s.", filename, duplicate_of)
+        archive_duplicate(filepath, content_hash)
+        return None
 
+    return file_type, device_id
 
-def scan_and_send():
+
+@STAGE_SECONDS.time(stage='process_file')
+def process_file(filepath):
     """
-    Scans the FILES_DIRECTORY for files, sorts them from oldest to newest, and processes them.
+    Processes a single file:
+    - For JPG and MP4/MOV files: extracts GPS and timestamp, ingests metadata into Elasticsearch.
+    - Near-duplicates of a recent photo from the same device are indexed but not sent.
+    - Sends the file via Telegram, grouping photo bursts into albums when enabled.
+    - Organizes the file based on the success of sending.
+    Stages already completed for the same content, according to the job store, are skipped.
+    """
+    prepared = prepare_file(filepath)
+    if not prepared:
+        return
+    file_type, device_id = prepared
+    filename = os.path.basename(filepath)
+
+    # Photos are sent and organized by the album batcher once the burst window closes
+    album_batcher = get_album_batcher()
+    if album_batcher:
+        if file_type == 'photo':
+            album_batcher.add(device_id, filepath, filename)
+            return
+        # Earlier photos of the device go first, so a video does not overtake them
+        album_batcher.release(device_id)
+
+    # Attempt to send the file via Telegram, failures are retried by the retry scheduler
+    message_id = send_once(filepath, file_type, filename)
+    complete_file(filepath, message_id)
+
+
+def set_album_dispatch(dispatch):
+    """
+    Sends each album through `dispatch(device_id, task)`, e.g. Pipeline.run_on_device, so it
+    is sent by the worker that owns the device, in order with the device's other files.
+    """
+    album_batcher = get_album_batcher()
+    if album_batcher:
+        album_batcher.dispatch = dispatch
+
+
+def close_album_batcher():
+    """
+    Sends any pending albums. Call before the application exits.
+    """
+    if _album_batcher:
+        _album_batcher.close()
+
+
+def scan_backlog(directory=FILES_DIRECTORY):
+    """
+    Reads `directory` once with os.scandir and returns a heap of (mtime_ns, name) pairs,
+    so files can be popped oldest first without sorting the whole backlog up front.
+    """
+    heap = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    heap.append((entry.stat().st_mtime_ns, entry.name))
+            except OSError as e:
+                logger.warning("Skipping %s: %s", entry.path, e)
+    heapq.heapify(heap)
+    return heap
+
+
+def resume_unfinished(submit=process_file):
+    """
+    Hands the files in FILES_DIRECTORY that the job store knows as unfinished to `submit`,
+    e.g. those that were waiting for a retry when the application stopped. Runs on startup
+    instead of scan_and_send when STARTUP_SCAN is disabled.
     """
     try:
-        files = os.listdir(FILES_DIRECTORY)
-        if not files:
+        queued = set()
+        for filename in get_job_store().unfinished():
+            filepath = os.path.join(FILES_DIRECTORY, filename)
+            if filepath not in queued and os.path.exists(filepath):
+                submit(filepath)
+                queued.add(filepath)
+        if queued:
+            logger.info("Resumed %s unfinished files.", len(queued))
+    except Exception as e:
+        logger.error("Error resuming unfinished files: %s", e)
+
+
+def scan_and_send(submit=process_file):
+    """
+    Scans the FILES_DIRECTORY for files and hands them to `submit` from oldest to newest,
+    logging progress every BACKLOG_PROGRESS_INTERVAL seconds.
+    """
+    try:
+        backlog = scan_backlog(FILES_DIRECTORY)
+        total = len(backlog)
+        if not total:
             logger.info("No files to process.")
             return
 
-        # Sort files by modification time (oldest first)
-        files_sorted = sorted(files, key=lambda x: os.path.getmtime(
-            os.path.join(FILES_DIRECTORY, x)))
+        logger.info("Found %s files in backlog.", total)
+        queued = 0
+        start = last_report = time.monotonic()
+        while backlog:
+            _, file = heapq.heappop(backlog)
+            logger.debug("Queueing file: %s", file)
+            submit(os.path.join(FILES_DIRECTORY, file))
+            queued += 1
+
+            now = time.monotonic()
+            if now - last_report >= BACKLOG_PROGRESS_INTERVAL:
+                last_report = now
+                rate = queued / (now - start)
+                eta = (total - queued) / rate if rate else 0
+                logger.info("Backlog progress: %s/%s files queued, %.1f files/s, ETA %.0fs",
+                            queued, total, rate, eta)
 
-        for file in files_sorted:
-            filepath = os.path.join(FILES_DIRECTORY, file)
-            if os.path.isfile(filepath):
-                logger.info(f"Processing file: {file}")
-                process_file(filepath)
+        logger.info("Queued %s backlog files in %.1fs.", queued, time.monotonic() - start)
     except Exception as e:
-        logger.error(f"Error scanning directory {FILES_DIRECTORY}: {e}")
+        logger.error("Error scanning directory %s: %s", FILES_DIRECTORY, e)
@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from config import PHOTO_MAX_DIMENSION, PHOTO_JPEG_QUALITY, TRANSFORM_PROCESSES, UPLOAD_TMP_DIRECTORY
+from utils import logger
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Create the process pool on first use. Spawned workers avoid forking a threaded process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=TRANSFORM_PROCESSES,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def downscale_jpeg(source, destination, max_dimension, quality):
+    """
+    Writes a copy of `source` no larger than `max_dimension` on its longest side.
+    JPEG draft mode lets the decoder scale by 1/2, 1/4 or 1/8 during DCT decoding,
+    so most of the reduction costs nothing; EXIF is carried over unchanged.
+    Returns False if the image is already small enough.
+    """
+    from PIL import Image
+    with Image.open(source) as img:
+        if img.format != 'JPEG' or max(img.size) <= max_dimension:
+            return False
+        exif = img.info.get('exif', b'')
+        img.draft('RGB', (max_dimension, max_dimension))
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        img.save(destination, 'JPEG', quality=quality, exif=exif, optimize=True)
+    return True
+
+
+def _temp_path(filepath):
+    name = f"{uuid.uuid4().hex}-{os.path.basename(filepath)}"
+    return os.path.join(UPLOAD_TMP_DIRECTORY or tempfile.gettempdir(), name)
+
+
+def prepare_uploads(filepaths):
+    """
+    Downscales photos for upload in the process pool.
+    Returns one path per input: a temporary downscaled copy, or the original file when
+    the transform is disabled, not needed or failed. The originals are never modified.
+    """
+    if PHOTO_MAX_DIMENSION <= 0:
+        return list(filepaths)
+
+    executor = _get_executor()
+    jobs = []
+    for filepath in filepaths:
+        destination = _temp_path(filepath)
+        future = executor.submit(downscale_jpeg, filepath, destination, PHOTO_MAX_DIMENSION, PHOTO_JPEG_QUALITY)
+        jobs.append((filepath, destination, future))
+
+    upload_paths = []
+    for filepath, destination, future in jobs:
+        try:
+            if future.result():
+                logger.debug("Downscaled %s for upload: %s -> %s bytes.",
+                             filepath, os.path.getsize(filepath), os.path.getsize(destination))
+                upload_paths.append(destination)
+                continue
+        except Exception as e:
+            logger.error("Error downscaling %s. Uploading the original: %s", filepath, e)
+            if os.path.exists(destination):
+                os.remove(destination)
+        upload_paths.append(filepath)
+    return upload_paths
+
+
+def release_uploads(filepaths, upload_paths):
+    """Remove the temporary copies created by prepare_uploads."""
+    for filepath, upload_path in zip(filepaths, upload_paths):
+        if upload_path != filepath:
+            try:
+                os.remove(upload_path)
+            except OSError as e:
+                logger.warning("Could not remove temporary upload %s: %s", upload_path, e)
+
+
+def shutdown():
+    """Stop the process pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+from config import JOB_STORE_PATH
+from utils import logger
+
+# Stages a file passes through, in order
+STAGE_NEW = 0
+STAGE_INDEXED = 1
+STAGE_SENT = 2
+STAGE_MOVED = 3
+
+STAGE_NAMES = {STAGE_NEW: "new", STAGE_INDEXED: "indexed", STAGE_SENT: "sent", STAGE_MOVED: "moved"}
+
+# captured_at is the capture time read from the file's metadata, as a Unix timestamp;
+# duplicate_of the filename of the photo a near-duplicate was suppressed in favour of
+Job = namedtuple("Job", ["content_hash", "filename", "stage", "message_id", "file_id", "captured_at",
+                         "duplicate_of", "updated_at"])
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=1024)
+def _file_hash_cached(filepath, mtime_ns, size):
+    """Hashes one version of a file. The stat fields only serve as cache key."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(filepath):
+    """
+    Returns the SHA-256 of a file's content. Results are cached by path, mtime and size,
+    so the stages of one pipeline run hash each file only once.
+    """
+    stat = os.stat(filepath)
+    return _file_hash_cached(filepath, stat.st_mtime_ns, stat.st_size)
+
+
+class JobStore:
+    """
+    Durable record of how far each file got through the pipeline, keyed by content hash.
+
+    Backed by SQLite in WAL mode so lookups stay indexed point queries however many
+    historical rows accumulate, and a crash never loses more than the current stage.
+    Deliveries to individual chats are tracked separately, together with the Telegram
+    file_id of the first upload, so a partially delivered file is never uploaded again.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                content_hash TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                stage INTEGER NOT NULL,
+                message_id INTEGER,
+                file_id TEXT,
+                captured_at REAL,
+                duplicate_of TEXT,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "file_id" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN file_id TEXT")
+        if "captured_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN captured_at REAL")
+        if "duplicate_of" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN duplicate_of TEXT")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                content_hash TEXT NOT NULL,
+                chat_id TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                delivered_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, chat_id)
+            ) WITHOUT ROWID
+        """)
+        # Small, as almost every job reaches STAGE_MOVED
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS jobs_unfinished ON jobs (updated_at) "
+                           f"WHERE stage < {STAGE_MOVED}")
+        logger.info("Opened job store: %s", path)
+
+    def get(self, content_hash):
+        """Return the Job recorded for a content hash, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, filename, stage, message_id, file_id, captured_at, duplicate_of, updated_at "
+                "FROM jobs "
+                "WHERE content_hash = ?",
+                (content_hash,)).fetchone()
+        return Job(*row) if row else None
+
+    def record(self, content_hash, filename, stage, message_id=None, file_id=None, captured_at=None,
+               duplicate_of=None):
+        """
+        Record that a file reached `stage`. Stages never move backwards and a known
+        message id, file id, capture time or duplicate_of is kept unless a new one is given.
+        """
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO jobs (content_hash, filename, stage, message_id, file_id, captured_at, duplicate_of,
+                                  updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET
+                    filename = excluded.filename,
+                    stage = MAX(jobs.stage, excluded.stage),
+                    message_id = COALESCE(excluded.message_id, jobs.message_id),
+                    file_id = COALESCE(excluded.file_id, jobs.file_id),
+                    captured_at = COALESCE(excluded.captured_at, jobs.captured_at),
+                    duplicate_of = COALESCE(excluded.duplicate_of, jobs.duplicate_of),
+                    updated_at = excluded.updated_at
+            """, (content_hash, filename, stage, message_id, file_id, captured_at, duplicate_of, time.time()))
+        logger.debug("Job %s (%s) reached stage %s.", content_hash[:12], filename, STAGE_NAMES[stage])
+
+    def unfinished(self):
+        """Return the filenames of the jobs that have not reached STAGE_MOVED, least recently updated first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM jobs WHERE stage < ? ORDER BY updated_at", (STAGE_MOVED,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_deliveries(self, content_hash):
+        """Return {chat_id: message_id} for the chats a file was already delivered to."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, message_id FROM deliveries WHERE content_hash = ?", (content_hash,)).fetchall()
+        return dict(rows)
+
+    def record_delivery(self, content_hash, chat_id, message_id):
+        """Record that a file was delivered to a chat."""
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO deliveries (content_hash, chat_id, message_id, delivered_at)
+                VALUES (?, ?, ?, ?)
+            """, (content_hash, str(chat_id), message_id, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Returns the shared job store, opening JOB_STORE_PATH on first use rather than on import."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
@@ -1,73 +1,227 @@
+import calendar
+import hashlib
+import json
 import os
-import re
+import time
 from watchdog.events import FileSystemEventHandler
-from config import FILES_DIRECTORY
-from utils import logger
+from config import FILES_DIRECTORY, LOG_CHECKPOINT_FILE, LOG_CHECKPOINT_INTERVAL
+from utils import logger, file_fields
+from log_reader import LogReader
+from metrics import STAGE_SECONDS, LOG_LINES, UPLOAD_LAG_SECONDS
 from file_processor import process_file
 
 
+def _line_hash(line):
+    return hashlib.sha1(line).hexdigest()
+
+
+def _line_before(f, offset, limit=65536):
+    """
+    Returns the line of the binary file `f` that ends at `offset`, read without moving the file position.
+    Returns b'' at the start of the file or if the line is longer than `limit`.
+    """
+    start = max(0, offset - limit)
+    data = os.pread(f.fileno(), offset - start, start)
+    begin = data.rfind(b'\n', 0, len(data) - 1) + 1
+    if not begin and start:
+        return b''
+    return data[begin:]
+
+
+def _logged_at(line):
+    """
+    Returns the epoch time a vsftpd log line was written, or None.
+    vsftpd logs in UTC unless use_localtime is enabled.
+    """
+    try:
+        return calendar.timegm(time.strptime(line[:24], '%a %b %d %H:%M:%S %Y'))
+    except ValueError:
+        return None
+
+
 class LogHandler(FileSystemEventHandler):
     """
     Handler for monitoring the vsftpd.log file for new upload entries and detecting log rotations.
+
+    The read position is checkpointed as (inode, offset, hash of the last line read) so a
+    restart resumes where the previous run stopped, including lines written to a file
+    that was rotated in the meantime.
     """
 
-    def __init__(self, log_file_path):
+    def __init__(self, log_file_path, submit=process_file, checkpoint_file=LOG_CHECKPOINT_FILE):
         super().__init__()
         self.log_file_path = log_file_path
+        self.submit = submit
+        self.checkpoint_file = checkpoint_file
         self._position = 0
         self._inode = None
+        self._last_line = b''
+        self._last_checkpoint = 0.0
         self.file = None
-        self._upload_pattern = re.compile(r'OK UPLOAD:.*?"[^"]+",\s*"([^"]+)"')
-        self._open_log_file()
+        self._open_log_file(resume=True)
 
-    def _open_log_file(self):
-        """Open the log file and initialize the position and inode."""
+    def _open_log_file(self, resume=False):
+        """
+        Open the log file and initialize the position and inode.
+        With `resume`, continue from the saved checkpoint instead of the end of the file.
+        """
         try:
             if os.path.exists(self.log_file_path):
-                self.file = open(self.log_file_path, 'r')
-                self.file.seek(0, os.SEEK_END)
-                self._position = self.file.tell()
+                self.file = open(self.log_file_path, 'rb')
                 self._inode = os.fstat(self.file.fileno()).st_ino
+                self._last_line = b''
+                if not (resume and self._resume_from_checkpoint()):
+                    self.file.seek(0, os.SEEK_END)
+                    self._position = self.file.tell()
                 logger.info(
-                    f"Opened log file: {self.log_file_path} with inode: {self._inode}")
+                    "Opened log file: %s with inode: %s at offset %s",
+                    self.log_file_path, self._inode, self._position)
             else:
-                logger.error(f"Log file {self.log_file_path} does not exist.")
+                logger.error("Log file %s does not exist.", self.log_file_path)
                 self.file = None
         except Exception as e:
-            logger.error(f"Error opening log file {self.log_file_path}: {e}")
+            logger.error("Error opening log file %s: %s", self.log_file_path, e)
             self.file = None
 
+    def _load_checkpoint(self):
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return None
+        try:
+            with open(self.checkpoint_file) as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable log checkpoint %s: %s", self.checkpoint_file, e)
+            return None
+
+    def _checkpoint_matches(self, f, checkpoint):
+        """Check that the line ending at the checkpoint offset is the one that was last read."""
+        offset = checkpoint['offset']
+        line_length = checkpoint.get('line_length', 0)
+        if offset > os.fstat(f.fileno()).st_size:
+            return False
+        if not line_length:
+            return offset == 0
+        f.seek(offset - line_length)
+        return _line_hash(f.read(line_length)) == checkpoint.get('line_hash')
+
+    def _resume_from_checkpoint(self):
+        """
+        Position the freshly opened log file at the saved checkpoint.
+        If the checkpoint belongs to the rotated predecessor, its unread lines are
+        processed first and the current file is read from the beginning.
+        Returns False if there is no usable checkpoint.
+        """
+        checkpoint = self._load_checkpoint()
+        if not checkpoint:
+            return False
+
+        if checkpoint.get('inode') == self._inode:
+            if self._checkpoint_matches(self.file, checkpoint):
+                self._position = checkpoint['offset']
+                # Carried forward, so a run that reads nothing saves a checkpoint that still matches
+                self._last_line = _line_before(self.file, self._position, checkpoint.get('line_length', 0))
+                self.file.seek(self._position)
+                logger.info("Resuming %s from checkpoint at offset %s.", self.log_file_path, self._position)
+                return True
+            logger.warning("Log checkpoint does not match %s. Starting at the end of the file.",
+                           self.log_file_path)
+            return False
+
+        rotated_path = f"{self.log_file_path}.1"
+        try:
+            with open(rotated_path, 'rb') as rotated:
+                if os.fstat(rotated.fileno()).st_ino != checkpoint.get('inode') or \
+                        not self._checkpoint_matches(rotated, checkpoint):
+                    logger.warning("Log checkpoint matches neither %s nor %s. Starting at the end of the file.",
+                                   self.log_file_path, rotated_path)
+                    return False
+                logger.info("Log was rotated since the last run. Finishing %s from offset %s.",
+                            rotated_path, checkpoint['offset'])
+                reader = LogReader(rotated, checkpoint['offset'])
+                for upload in reader.uploads(final=True):
+                    self._process_upload(upload)
+                LOG_LINES.inc(reader.lines)
+        except FileNotFoundError:
+            logger.warning("Log checkpoint refers to a rotated file that no longer exists. "
+                           "Starting at the end of %s.",
+                           self.log_file_path)
+            return False
+
+        self._position = 0
+        self.file.seek(0)
+        return True
+
+    def save_checkpoint(self):
+        """Persist the current inode, offset and last line hash."""
+        if not self.checkpoint_file or self._inode is None:
+            return
+        if self._position and not self._last_line and self.file:
+            self._last_line = _line_before(self.file, self._position)
+        if self._position and not self._last_line:
+            # Without the last line the checkpoint could not be verified on the next start
+            logger.warning("Not saving log checkpoint at offset %s without its last line.", self._position)
+            return
+        checkpoint = {
+            'inode': self._inode,
+            'offset': self._position,
+            'line_length': len(self._last_line),
+            'line_hash': _line_hash(self._last_line) if self._last_line else None,
+        }
+        try:
+            tmp_path = f"{self.checkpoint_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, self.checkpoint_file)
+            self._last_checkpoint = time.monotonic()
+        except Exception as e:
+            logger.error("Error saving log checkpoint %s: %s", self.checkpoint_file, e)
+
+    def _read_new_lines(self, final=False):
+        """
+        Process complete lines from the current position. A trailing line without a newline
+        is left for the next read unless `final` is set. During a long catch-up the checkpoint
+        is saved every LOG_CHECKPOINT_INTERVAL seconds.
+        """
+        reader = LogReader(self.file, self._position, self._last_line)
+        try:
+            with STAGE_SECONDS.time(stage='log_read'):
+                for upload in reader.uploads(final):
+                    self._process_upload(upload)
+                    if time.monotonic() - self._last_checkpoint >= LOG_CHECKPOINT_INTERVAL:
+                        # The reader's position covers the uploads handled before this one
+                        self._position, self._last_line = reader.position, reader.last_line
+                        self.save_checkpoint()
+        finally:
+            self._position, self._last_line = reader.position, reader.last_line
+            LOG_LINES.inc(reader.lines)
+
     def _check_for_rotation(self):
         """Check if the log file has been rotated by comparing inodes or detecting file deletion."""
         try:
             current_inode = os.stat(self.log_file_path).st_ino
             if self._inode != current_inode:
                 logger.info(
-                    f"Log rotation detected for {self.log_file_path}. Inode changed from {self._inode} to {current_inode}.")
+                    "Log rotation detected for %s. Inode changed from %s to %s.",
+                    self.log_file_path, self._inode, current_inode)
                 self._read_remaining_lines()
                 self._reopen_log_file()
         except FileNotFoundError:
             logger.warning(
-                f"Log file {self.log_file_path} not found. It may have been rotated. Reopening...")
+                "Log file %s not found. It may have been rotated. Reopening...", self.log_file_path)
             self._read_remaining_lines()
             self._reopen_log_file()
         except Exception as e:
             logger.error(
-                f"Error checking log rotation for {self.log_file_path}: {e}")
+                "Error checking log rotation for %s: %s", self.log_file_path, e)
 
     def _read_remaining_lines(self):
         """Read and process any remaining lines in the current log file before closing it."""
         if self.file:
             try:
-                self.file.seek(self._position)
-                new_lines = self.file.readlines()
-                self._position = self.file.tell()
-
-                for line in new_lines:
-                    self._process_upload_line(line)
+                self._read_new_lines(final=True)
             except Exception as e:
                 logger.error(
-                    f"Error reading remaining lines from {self.log_file_path}: {e}")
+                    "Error reading remaining lines from %s: %s", self.log_file_path, e)
             finally:
                 self.file.close()
                 logger.info(
@@ -82,52 +236,68 @@ class LogHandler(FileSystemEventHandler):
             # Start reading from the beginning of the new log file
             self.file.seek(0)
             self._position = 0
+            self.save_checkpoint()
             logger.info(
-                f"Reopened log file {self.log_file_path} and reset position to the beginning.")
-
-    def _process_upload_line(self, line):
-        """Process a single line to check for upload entries and handle them."""
-        if 'OK UPLOAD:' in line:
-            logger.info(f"Detected upload line: {line.strip()}")
-            match = self._upload_pattern.search(line)
-            if match:
-                filepath = match.group(1)
-                filename = os.path.basename(filepath)
-                uploaded_file_path = os.path.join(FILES_DIRECTORY, filename)
-
-                if os.path.exists(uploaded_file_path):
-                    logger.info(f"Newly uploaded file detected: {filename}")
-                    process_file(uploaded_file_path)
-                else:
-                    logger.error(
-                        f"Uploaded file {uploaded_file_path} does not exist.")
+                "Reopened log file %s and reset position to the beginning.", self.log_file_path)
+
+    def _process_upload(self, upload):
+        """Submit the file of an upload line if it exists. Errors are logged, not raised."""
+        line = upload.line.decode('utf-8', errors='replace').strip()
+        logger.info("Detected upload line: %s", line)
+        if not upload.path:
+            logger.warning("Could not extract filename from line: %s", line)
+            return
+        filename = os.path.basename(upload.path)
+        uploaded_file_path = os.path.join(FILES_DIRECTORY, filename)
+        try:
+            if os.path.exists(uploaded_file_path):
+                logger.info("Newly uploaded file detected: %s", filename, extra=file_fields(filename))
+                self.submit(uploaded_file_path)
+                logged_at = _logged_at(line)
+                if logged_at:
+                    UPLOAD_LAG_SECONDS.observe(max(0.0, time.time() - logged_at))
             else:
-                logger.warning(
-                    f"Could not extract filename from line: {line.strip()}")
+                logger.error(
+                    "Uploaded file %s does not exist.", uploaded_file_path)
+        except Exception as e:
+            logger.error("Error handling upload of %s: %s", filename, e)
 
     def on_modified(self, event):
         if event.src_path == self.log_file_path:
-            try:
-                self._check_for_rotation()
+            self._handle_change()
 
-                if self.file is None:
-                    return
+    def on_created(self, event):
+        # A new log file after rotation; event-driven observers report no modification for it
+        if event.src_path == self.log_file_path:
+            self._handle_change()
 
-                self.file.seek(self._position)
-                new_lines = self.file.readlines()
-                self._position = self.file.tell()
+    def on_moved(self, event):
+        # Rotation by rename, e.g. vsftpd.log -> vsftpd.log.1
+        if self.log_file_path in (event.src_path, event.dest_path):
+            self._handle_change()
 
-                for line in new_lines:
-                    self._process_upload_line(line)
-            except Exception as e:
-                logger.error(
-                    f"Error processing log file {self.log_file_path}: {e}")
-                if self.file:
-                    self.file.close()
-                    self.file = None
+    def _handle_change(self):
+        """Check for rotation and process any new lines in the log file."""
+        try:
+            self._check_for_rotation()
+
+            if self.file is None:
+                return
+
+            self._read_new_lines()
+
+            if time.monotonic() - self._last_checkpoint >= LOG_CHECKPOINT_INTERVAL:
+                self.save_checkpoint()
+        except Exception as e:
+            logger.error(
+                "Error processing log file %s: %s", self.log_file_path, e)
+            if self.file:
+                self.file.close()
+                self.file = None
 
     def close(self):
-        """Close the log file when stopping the observer."""
+        """Save the checkpoint and close the log file when stopping the observer."""
         if self.file:
+            self.save_checkpoint()
             self.file.close()
             logger.info("Closed log file.")
@@ -0,0 +1,68 @@
+import re
+from collections import namedtuple
+from config import LOG_READ_CHUNK_SIZE
+
+UPLOAD_MARKER = b'OK UPLOAD:'
+UPLOAD_PATTERN = re.compile(rb'OK UPLOAD:.*?"[^"]+",\s*"([^"]+)"')
+
+# `path` is the uploaded path from the line or None if it could not be parsed, `line` the raw line
+UploadLine = namedtuple('UploadLine', ['path', 'line'])
+
+
+class LogReader:
+    """
+    Reads upload lines from a binary log file in fixed-size chunks, starting at `position`.
+
+    Chunks are searched for the `OK UPLOAD:` marker as bytes; only lines containing it are
+    matched and decoded, so other lines are never turned into Python objects. A trailing
+    line without a newline is left for the next read. `position` and `last_line` follow the
+    lines the caller has consumed, for checkpointing, and `lines` counts the lines read.
+    """
+
+    def __init__(self, file, position=0, last_line=b'', chunk_size=LOG_READ_CHUNK_SIZE):
+        self.file = file
+        self.position = position
+        self.last_line = last_line
+        self.chunk_size = chunk_size
+        self.lines = 0
+
+    def uploads(self, final=False):
+        """
+        Yields an UploadLine for each upload line after `position`. With `final`, a trailing
+        line without a newline is read as well. `position` advances past an upload line once
+        the caller asks for the next one, so a line is not skipped if handling it fails.
+        """
+        self.file.seek(self.position)
+        carry = b''
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            block = carry + chunk
+            if not block:
+                return
+            end = len(block) if final and not chunk else block.rfind(b'\n') + 1
+            if not end:
+                if not chunk:
+                    return
+                carry = block  # A single line longer than the chunk size
+                continue
+            base = self.position
+            start = 0
+            while True:
+                hit = block.find(UPLOAD_MARKER, start, end)
+                if hit < 0:
+                    break
+                line_start = block.rfind(b'\n', 0, hit) + 1
+                line_end = block.find(b'\n', hit, end) + 1 or end
+                line = block[line_start:line_end]
+                match = UPLOAD_PATTERN.search(line)
+                path = match.group(1).decode('utf-8', errors='replace') if match else None
+                yield UploadLine(path, line)
+                self.position = base + line_end
+                self.last_line = line
+                start = line_end
+            self.lines += block.count(b'\n', 0, end) + (not block.endswith(b'\n', 0, end))
+            self.position = base + end
+            self.last_line = block[block.rfind(b'\n', 0, end - 1) + 1:end]
+            carry = block[end:]
+            if not chunk:
+                return
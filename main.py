@@ -1,22 +1,56 @@
-from file_processor import scan_and_send
+import threading
+from file_processor import scan_and_send, resume_unfinished, set_album_dispatch, close_album_batcher
 from monitor import run_monitoring
-from elasticsearch_client import create_index
-from utils import logger
+from elasticsearch_client import close_indexer
+from pipeline import Pipeline
+from retry_scheduler import retry_scheduler, failed_redriver
+from image_transformer import shutdown as shutdown_transformer
+from file_organizer import flush_archive
+from config import STARTUP_SCAN, PIPELINE_MODE, ensure_directories
+from utils import logger, setup_logging
+from metrics import start_server, stop_server, dump_json
 
 def main():
     """
     Main function to run the file sender application.
     """
+    setup_logging()
+    ensure_directories()
     logger.info("Starting File Sender Application.")
 
-    # Create Elasticsearch index
-    create_index()
+    if PIPELINE_MODE == 'asyncio':
+        # Imported here so the threaded mode does not need aiohttp
+        import asyncio
+        from async_pipeline import run_async
+        asyncio.run(run_async())
+        return
 
-    # Initial scan and send
-    scan_and_send()
+    # Start the processing workers
+    pipeline = Pipeline()
+    pipeline.start()
+    set_album_dispatch(pipeline.run_on_device)
+    retry_scheduler.start(pipeline.submit)
+    failed_redriver.start(pipeline.submit)
+    metrics_server = start_server()
 
-    # Start log monitoring
-    run_monitoring()
+    try:
+        # Drain the backlog in the background so live uploads are picked up right away
+        # Without the scan, files left unfinished by the last run are still resumed
+        threading.Thread(target=scan_and_send if STARTUP_SCAN else resume_unfinished, args=(pipeline.submit,),
+                         name="backlog-scan", daemon=True).start()
+
+        # Start log monitoring
+        run_monitoring(pipeline.submit)
+    finally:
+        failed_redriver.stop()
+        retry_scheduler.stop()
+        pipeline.stop()
+        close_album_batcher()
+        shutdown_transformer()
+        flush_archive()
+        close_indexer()
+        stop_server(metrics_server)
+        dump_json()
 
 if __name__ == "__main__":
     main()
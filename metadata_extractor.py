@@ -1,68 +1,293 @@
+import mmap
 import os
-from datetime import datetime
-import pytz
-from PIL import Image
-import piexif
+import re
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from utils import logger
 
-def extract_gps(image_path):
+PhotoMetadata = namedtuple("PhotoMetadata", ["gps", "timestamp", "orientation", "width", "height"])
+EMPTY_METADATA = PhotoMetadata(None, None, None, None, None)
+
+# `streamable` is True when the moov atom precedes the media data, so playback can start early
+VideoMetadata = namedtuple("VideoMetadata", ["gps", "timestamp", "duration", "width", "height", "streamable"])
+EMPTY_VIDEO_METADATA = VideoMetadata(None, None, None, None, None, False)
+
+# Start-of-frame markers carry the image dimensions; C4, C8 and CC share the range but are not frames
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+_SOS_MARKER = 0xDA
+_EOI_MARKER = 0xD9
+_APP1_MARKER = 0xE1
+
+
+def _read_jpeg_header(f):
     """
-    Extracts GPS coordinates from an image's EXIF data.
-    Returns a dictionary with 'lat' and 'lon' or None if GPS data is unavailable.
+    Walks the JPEG marker segments up to the start of scan without decoding image data.
+    Returns (exif_bytes, width, height).
     """
-    try:
-        img = Image.open(image_path)
-        exif_data = piexif.load(img.info.get("exif", b""))
-
-        gps_info = exif_data.get("GPS", {})
-        if not gps_info:
-            logger.info(f"No GPS data found in {image_path}.")
-            return None
-
-        def dms_to_decimal(degrees, minutes, seconds, ref):
-            decimal = degrees + (minutes / 60.0) + (seconds / 3600.0)
-            if ref in ['S', 'W']:
-                decimal *= -1
-            return decimal
-
-        lat_data = gps_info.get(piexif.GPSIFD.GPSLatitude)
-        lat_ref = gps_info.get(piexif.GPSIFD.GPSLatitudeRef)
-        lon_data = gps_info.get(piexif.GPSIFD.GPSLongitude)
-        lon_ref = gps_info.get(piexif.GPSIFD.GPSLongitudeRef)
-
-        if lat_data and lat_ref and lon_data and lon_ref:
-            lat = dms_to_decimal(*[val[0] / val[1] for val in lat_data], lat_ref.decode())
-            lon = dms_to_decimal(*[val[0] / val[1] for val in lon_data], lon_ref.decode())
-            return {"lat": lat, "lon": lon}
-        else:
-            logger.info(f"Incomplete GPS data in {image_path}.")
-            return None
+    if f.read(2) != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
 
-    except Exception as e:
-        logger.error(f"Error extracting GPS metadata from {image_path}: {e}")
+    exif_bytes = None
+    width = height = None
+    while True:
+        byte = f.read(1)
+        if not byte:
+            break
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            break
+        marker = marker[0]
+        if marker in _STANDALONE_MARKERS:
+            continue
+        if marker in (_SOS_MARKER, _EOI_MARKER):
+            break
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            break
+        length = struct.unpack(">H", length_bytes)[0] - 2
+
+        if marker == _APP1_MARKER and exif_bytes is None:
+            segment = f.read(length)
+            if segment.startswith(b"Exif\x00\x00"):
+                exif_bytes = segment
+            continue
+        if marker in _SOF_MARKERS:
+            segment = f.read(length)
+            height, width = struct.unpack(">HH", segment[1:5])
+            break  # The frame header follows the APP segments
+        f.seek(length, os.SEEK_CUR)
+
+    return exif_bytes, width, height
+
+
+# Top-level atoms that may open an ISO base media (MP4/MOV) file
+_MP4_TOP_LEVEL = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+_MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+_ISO6709 = re.compile(rb"([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)")
+
+
+def _iter_boxes(buf, start, end):
+    """Yields (type, payload_start, box_end) for the boxes between start and end."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:  # 64-bit size follows the type
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif size == 0:  # Box extends to the end of its parent
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _find_box(buf, start, end, box_type):
+    for found, payload, box_end in _iter_boxes(buf, start, end):
+        if found == box_type:
+            return payload, box_end
+    return None, None
+
+
+def _parse_mvhd(buf, offset):
+    """Returns (creation time, duration in seconds) from a movie header."""
+    version = buf[offset]
+    if version == 1:
+        created, _, timescale, duration = struct.unpack_from(">QQIQ", buf, offset + 4)
+    else:
+        created, _, timescale, duration = struct.unpack_from(">IIII", buf, offset + 4)
+    timestamp = _MP4_EPOCH + timedelta(seconds=created) if created else None
+    return timestamp, duration / timescale if timescale else None
+
+
+def _parse_tkhd(buf, offset):
+    """Returns the displayed (width, height) of a track; (0, 0) for audio tracks."""
+    version = buf[offset]
+    offset += 4 + (32 if version == 1 else 20) + 16  # Times, track id, duration, layer, volume
+    matrix = struct.unpack_from(">9i", buf, offset)
+    width, height = struct.unpack_from(">II", buf, offset + 36)
+    width, height = width >> 16, height >> 16
+    if matrix[0] == 0 and matrix[1] != 0:  # Rotated by 90 or 270 degrees
+        width, height = height, width
+    return width, height
+
+
+def _parse_xyz(buf, offset, end):
+    """Parses an ISO 6709 location string such as +59.3293+018.0686/ from a udta ©xyz atom."""
+    match = _ISO6709.match(bytes(buf[offset + 4:end]))  # Skip string length and language
+    if not match:
         return None
+    return {"lat": float(match.group(1)), "lon": float(match.group(2))}
 
-def extract_timestamp(filepath):
+
+def _read_mp4_header(buf):
     """
-    Extracts the timestamp from the image metadata and converts it to UTC.
+    Walks the box tree of an MP4/MOV file down to mvhd, tkhd and udta/©xyz.
+    The large mdat box is skipped by its size, so only the header pages are ever read.
+    """
+    end = len(buf)
+    moov, moov_end = None, None
+    mdat_offset = None
+    for box_type, payload, box_end in _iter_boxes(buf, 0, end):
+        if box_type == b"moov":
+            moov, moov_end = payload, box_end
+            break
+        if box_type == b"mdat" and mdat_offset is None:
+            mdat_offset = payload
+    if moov is None:
+        raise ValueError("No moov atom")
+
+    timestamp = duration = gps = None
+    width = height = None
+    for box_type, payload, box_end in _iter_boxes(buf, moov, moov_end):
+        if box_type == b"mvhd":
+            timestamp, duration = _parse_mvhd(buf, payload)
+        elif box_type == b"trak" and not width:
+            tkhd, _ = _find_box(buf, payload, box_end, b"tkhd")
+            if tkhd is not None:
+                width, height = _parse_tkhd(buf, tkhd)
+        elif box_type == b"udta":
+            xyz, xyz_end = _find_box(buf, payload, box_end, b"\xa9xyz")
+            if xyz is not None:
+                gps = _parse_xyz(buf, xyz, xyz_end)
+    return VideoMetadata(gps, timestamp, duration, width or None, height or None, mdat_offset is None)
+
+
+@lru_cache(maxsize=1024)
+def _read_video_metadata_cached(video_path, mtime_ns, size):
+    """Reads the metadata for one version of a video. The stat fields only serve as cache key."""
+    with open(video_path, "rb") as f:
+        if f.read(8)[4:] not in _MP4_TOP_LEVEL:
+            logger.info("%s is not an MP4/MOV file. No video metadata read.", video_path)
+            return EMPTY_VIDEO_METADATA
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _read_mp4_header(buf)
+
+
+def read_video_metadata(video_path):
+    """
+    Reads duration, dimensions, creation time (UTC) and location from an MP4/MOV file.
+    The file is memory-mapped and only the moov atom is touched, however large the clip.
+    Returns EMPTY_VIDEO_METADATA for other containers or files that cannot be parsed.
     """
     try:
-        img = Image.open(filepath)
-        exif_data = img._getexif()
+        stat = os.stat(video_path)
+        return _read_video_metadata_cached(video_path, stat.st_mtime_ns, stat.st_size)
+    except Exception as e:
+        logger.error("Error extracting video metadata from %s: %s", video_path, e)
+        return EMPTY_VIDEO_METADATA
+
+
+def _dms_to_decimal(dms, ref):
+    degrees, minutes, seconds = [val[0] / val[1] for val in dms]
+    decimal = degrees + (minutes / 60.0) + (seconds / 3600.0)
+    if ref in ['S', 'W']:
+        decimal *= -1
+    return decimal
+
+
+def _parse_gps(exif_data, image_path):
+    import piexif
+    gps_info = exif_data.get("GPS", {})
+    if not gps_info:
+        logger.info("No GPS data found in %s.", image_path)
+        return None
+
+    lat_data = gps_info.get(piexif.GPSIFD.GPSLatitude)
+    lat_ref = gps_info.get(piexif.GPSIFD.GPSLatitudeRef)
+    lon_data = gps_info.get(piexif.GPSIFD.GPSLongitude)
+    lon_ref = gps_info.get(piexif.GPSIFD.GPSLongitudeRef)
+
+    if lat_data and lat_ref and lon_data and lon_ref:
+        lat = _dms_to_decimal(lat_data, lat_ref.decode())
+        lon = _dms_to_decimal(lon_data, lon_ref.decode())
+        return {"lat": lat, "lon": lon}
+
+    logger.info("Incomplete GPS data in %s.", image_path)
+    return None
+
+
+def _parse_timestamp(exif_data):
+    """Returns DateTimeOriginal converted to UTC, assuming the camera stores local time."""
+    import piexif
+    import pytz
+    timestamp_raw = exif_data.get("Exif", {}).get(piexif.ExifIFD.DateTimeOriginal)
+    if not timestamp_raw:
+        return None
+    local_timestamp = datetime.strptime(timestamp_raw.decode().strip("\x00"), "%Y:%m:%d %H:%M:%S")
+
+    # Convert local time to UTC
+    local_tz = pytz.timezone('Europe/Stockholm')
+    local_timestamp = local_tz.localize(local_timestamp)
+    return local_timestamp.astimezone(pytz.utc)
+
+
+@lru_cache(maxsize=1024)
+def _read_metadata_cached(image_path, mtime_ns, size):
+    """Reads the metadata for one version of a file. The stat fields only serve as cache key."""
+    import piexif  # Imported on first use like Pillow, to keep startup fast
+    with open(image_path, "rb") as f:
+        if f.read(2) == b"\xff\xd8":
+            f.seek(0)
+            exif_bytes, width, height = _read_jpeg_header(f)
+        else:
+            # PNG and GIF are rare from trail cameras; Pillow only parses their header here
+            f.seek(0)
+            from PIL import Image
+            with Image.open(f) as img:
+                exif_bytes = img.info.get("exif")
+                width, height = img.size
 
-        if exif_data is not None:
-            timestamp_str = exif_data.get(36867)  # 36867 is the DateTimeOriginal tag
-            if timestamp_str:
-                # Parse the local timestamp (assuming the camera stores it in local time)
-                local_timestamp = datetime.strptime(timestamp_str, "%Y:%m:%d %H:%M:%S")
+    if not exif_bytes:
+        logger.info("No EXIF data found in %s.", image_path)
+        return PhotoMetadata(None, None, None, width, height)
+
+    exif_data = piexif.load(exif_bytes)
+    gps = _parse_gps(exif_data, image_path)
+    try:
+        timestamp = _parse_timestamp(exif_data)
+    except ValueError as e:
+        logger.error("Error extracting timestamp from %s: %s", image_path, e)
+        timestamp = None
+    orientation = exif_data.get("0th", {}).get(piexif.ImageIFD.Orientation)
+    return PhotoMetadata(gps, timestamp, orientation, width, height)
 
-                # Convert local time to UTC
-                local_tz = pytz.timezone('Europe/Stockholm')
-                local_timestamp = local_tz.localize(local_timestamp)
-                utc_timestamp = local_timestamp.astimezone(pytz.utc)
 
-                return utc_timestamp
+def read_metadata(image_path):
+    """
+    Reads GPS, DateTimeOriginal (as UTC), orientation and dimensions from a photo in a single pass.
+    Only the header segments are read; results are cached by path, mtime and size.
+    Returns EMPTY_METADATA if the file cannot be parsed.
+    """
+    try:
+        stat = os.stat(image_path)
+        return _read_metadata_cached(image_path, stat.st_mtime_ns, stat.st_size)
     except Exception as e:
-        logger.error(f"Error extracting timestamp from {filepath}: {e}")
+        logger.error("Error extracting metadata from %s: %s", image_path, e)
+        return EMPTY_METADATA
 
-    return None
\ No newline at end of file
+
+def extract_gps(image_path):
+    """
+    Extracts GPS coordinates from an image's EXIF data.
+    Returns a dictionary with 'lat' and 'lon' or None if GPS data is unavailable.
+    """
+    return read_metadata(image_path).gps
+
+
+def extract_timestamp(filepath):
+    """
+    Extracts the timestamp from the image metadata and converts it to UTC.
+    """
+    return read_metadata(filepath).timestamp
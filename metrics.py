@@ -0,0 +1,257 @@
+"""
+In-process metrics: counters, gauges and latency histograms for the processing stages.
+
+Recording a value takes a lock and a few additions, cheap enough to leave on in
+production. The metrics are served in the Prometheus text format on METRICS_HOST:METRICS_PORT
+when METRICS_PORT is set, and can be written to a JSON file with dump_json() for comparing
+benchmark runs offline.
+"""
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_HOST, METRICS_PORT, METRICS_FILE
+from utils import logger
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+SIZE_BUCKETS = tuple(2 ** power for power in range(14, 28))  # 16 KiB to 128 MiB
+
+_registry = []
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """A value that goes up and down. A gauge with a function reads its value when collected."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, function, **labels):
+        """Collect the gauge by calling `function`, e.g. a queue's depth."""
+        with self._lock:
+            self._functions[_label_key(labels)] = function
+
+    def _collect(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.debug("Could not collect gauge %s: %s", self.name, e)
+        return values
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self._collect().items()]
+
+    def snapshot(self):
+        return [{"labels": dict(key), "value": value} for key, value in self._collect().items()]
+
+
+class Histogram:
+    """Counts observations into fixed buckets, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., count of larger values, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block in seconds. Also usable as a decorator."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q, **labels):
+        """Estimate the `q` quantile by interpolating within its bucket. Returns None without data."""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            series = list(series) if series else None
+        return self._quantile(series, q)
+
+    def _quantile(self, series, q):
+        if not series:
+            return None
+        counts = series[:-1]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # Beyond the largest bucket
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        samples = []
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                samples.append((f"{self.name}_bucket", key + (("le", le),), cumulative))
+            samples.append((f"{self.name}_sum", key, values[-1]))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        return [{
+            "labels": dict(key),
+            "count": sum(values[:-1]),
+            "sum": values[-1],
+            "p50": self._quantile(values, 0.5),
+            "p90": self._quantile(values, 0.9),
+            "p99": self._quantile(values, 0.99),
+        } for key, values in series.items()]
+
+
+STAGE_SECONDS = Histogram("filesender_stage_seconds", "Time spent in each processing stage")
+UPLOAD_BYTES = Histogram("filesender_upload_bytes", "Bytes uploaded to Telegram per media request", SIZE_BUCKETS)
+TELEGRAM_REQUESTS = Counter("filesender_telegram_requests_total", "Telegram Bot API requests by HTTP status")
+SEND_RETRIES = Counter("filesender_send_retries_total", "Sends scheduled for another attempt")
+FILES = Counter("filesender_files_total", "Files finished, by outcome")
+LOG_LINES = Counter("filesender_log_lines_total", "Lines read from the FTP server log")
+UPLOAD_LAG_SECONDS = Histogram("filesender_upload_lag_seconds",
+                               "Time from the FTP log line of an upload until it was queued", LAG_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram("filesender_queue_wait_seconds",
+                               "Time files waited in the pipeline queue", LAG_BUCKETS)
+QUEUE_DEPTH = Gauge("filesender_queue_depth", "Files waiting in the pipeline queues")
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Returns all metrics as a JSON-serializable dict."""
+    return {metric.name: {"type": metric.kind, "series": metric.snapshot()} for metric in _registry}
+
+
+def dump_json(path=METRICS_FILE):
+    """Writes the snapshot to `path` atomically. Does nothing without a path."""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({"time": time.time(), "metrics": snapshot()}, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info("Wrote metrics to %s.", path)
+    except Exception as e:
+        logger.error("Error writing metrics to %s: %s", path, e)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves /metrics in a daemon thread. Returns the server, or None if METRICS_PORT is 0."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, server.server_port)
+    return server
+
+
+def stop_server(server):
+    """Stops a server returned by start_server."""
+    if server is not None:
+        server.shutdown()
+        server.server_close()
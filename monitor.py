@@ -4,48 +4,76 @@ import signal
 import time
 from watchdog.observers.polling import PollingObserver
 from log_handler import LogHandler
-from config import LOG_FILE_PATH
+from file_processor import process_file
+from config import LOG_FILE_PATH, LOG_MONITOR_BACKEND, LOG_POLLING_INTERVAL
 from utils import logger
 
-def start_log_monitoring(log_file_path):
+def create_observer(backend=LOG_MONITOR_BACKEND):
+    """
+    Creates the watchdog observer for the configured backend:
+    - 'inotify': event-driven, Linux only. Watching the log directory also reports rotations.
+    - 'polling': re-stats the log directory every LOG_POLLING_INTERVAL seconds. Works everywhere.
+    - 'auto': inotify when available, polling otherwise.
+    """
+    if backend in ('auto', 'inotify'):
+        try:
+            from watchdog.observers.inotify import InotifyObserver
+            return InotifyObserver()
+        except Exception as e:
+            if backend == 'inotify':
+                raise
+            logger.info("inotify is not available (%s). Falling back to polling.", e)
+    elif backend != 'polling':
+        logger.warning("Unknown log monitor backend '%s'. Falling back to polling.", backend)
+    return PollingObserver(timeout=LOG_POLLING_INTERVAL)
+
+def start_log_monitoring(log_file_path, submit=process_file, backend=LOG_MONITOR_BACKEND):
     """
     Starts monitoring the vsftpd.log file for new upload entries.
+    Detected uploads are handed to `submit`.
     """
-    event_handler = LogHandler(log_file_path)
-    observer = PollingObserver(timeout=2)  # Polling interval set to 2 seconds
+    event_handler = LogHandler(log_file_path, submit)
     log_dir = os.path.dirname(log_file_path)
+    observer = create_observer(backend)
     observer.schedule(event_handler, path=log_dir, recursive=False)
-    observer.start()
-    logger.info(f"Started monitoring log file: {log_file_path}")
+    try:
+        observer.start()
+    except OSError as e:
+        # inotify instances and watches are limited per user and only run out here
+        if backend != 'auto' or isinstance(observer, PollingObserver):
+            raise
+        logger.info("inotify could not watch %s (%s). Falling back to polling.", log_dir, e)
+        observer = create_observer('polling')
+        observer.schedule(event_handler, path=log_dir, recursive=False)
+        observer.start()
+    logger.info("Started monitoring log file: %s using %s", log_file_path, type(observer).__name__)
     return observer, event_handler
 
 def handle_exit(signum, frame):
     """
     Handles graceful shutdown upon receiving termination signals.
     """
-    logger.info(f"Received signal {signum}. Shutting down gracefully...")
+    logger.info("Received signal %s. Shutting down gracefully...", signum)
     sys.exit(0)
 
-# Register signal handlers for graceful shutdown
-signal.signal(signal.SIGTERM, handle_exit)
-signal.signal(signal.SIGINT, handle_exit)
-
-def run_monitoring():
+def run_monitoring(submit=process_file):
     """
     Starts the log monitoring and keeps the process running.
     """
-    observer, event_handler = start_log_monitoring(LOG_FILE_PATH)
+    # Register signal handlers for graceful shutdown
+    signal.signal(signal.SIGTERM, handle_exit)
+    signal.signal(signal.SIGINT, handle_exit)
+    observer, event_handler = start_log_monitoring(LOG_FILE_PATH, submit)
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         logger.info("Stopping File Sender Application.")
-        observer.stop()
-        event_handler.close()
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
+    finally:
+        # Also runs on SystemExit from handle_exit, so the log checkpoint is always saved
         observer.stop()
+        observer.join()
         event_handler.close()
-
-    observer.join()
-    logger.info("File Sender Application stopped.")
+        logger.info("File Sender Application stopped.")
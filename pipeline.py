@@ -0,0 +1,162 @@
+import os
+import queue
+import threading
+import time
+import zlib
+from config import WORKER_COUNT, QUEUE_SIZE, STATS_INTERVAL
+from utils import logger, get_device_id, file_fields
+from file_processor import process_file
+from metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+
+
+class Pipeline:
+    """
+    Bounded worker pool that processes uploaded files off the log monitoring thread.
+
+    Each worker owns its own queue and files are routed to a worker by device ID,
+    so uploads from the same camera are always processed in arrival order. A path
+    that is already queued or being processed is not queued again, which happens when
+    the backlog scan and the log monitor both see a file uploaded during startup.
+    Other work for a device, such as sending an album, can be queued in order with its
+    files through run_on_device().
+    """
+
+    def __init__(self, handler=process_file, worker_count=WORKER_COUNT,
+                 queue_size=QUEUE_SIZE, stats_interval=STATS_INTERVAL):
+        self.handler = handler
+        self.worker_count = max(1, worker_count)
+        self.stats_interval = stats_interval
+        per_worker_size = max(1, queue_size // self.worker_count)
+        self._queues = [queue.Queue(maxsize=per_worker_size) for _ in range(self.worker_count)]
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._submitted = 0
+        self._processed = 0
+        self._errors = 0
+        self._busy_seconds = 0.0
+        self._max_depth = 0
+        self._started_at = None
+
+    def start(self):
+        """Start the worker threads and the stats reporter."""
+        self._started_at = time.monotonic()
+        for index in range(self.worker_count):
+            thread = threading.Thread(target=self._worker, args=(index,),
+                                      name=f"pipeline-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        QUEUE_DEPTH.set_function(self.queue_depth)
+        if self.stats_interval > 0:
+            threading.Thread(target=self._report_stats, name="pipeline-stats", daemon=True).start()
+        logger.info("Started processing pipeline with %s workers.", self.worker_count)
+
+    def submit(self, filepath):
+        """
+        Queue a file for processing. Blocks while the owning worker's queue is full.
+        """
+        with self._lock:
+            if filepath in self._in_flight:
+                logger.debug("%s is already queued. Skipping.", filepath)
+                return
+            self._in_flight.add(filepath)
+        index = self._worker_index(get_device_id(os.path.basename(filepath)))
+        self._queues[index].put((filepath, time.monotonic()))
+        with self._lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self.queue_depth())
+        logger.debug("Queued %s on worker %s.", filepath, index)
+
+    def run_on_device(self, device_id, task):
+        """
+        Queue `task`, a callable without arguments, on the worker that owns `device_id`.
+        It runs after the device's files queued before it. Blocks while that queue is full.
+        """
+        self._queues[self._worker_index(device_id)].put((task, time.monotonic()))
+
+    def _worker_index(self, device_id):
+        return zlib.crc32(device_id.encode()) % self.worker_count
+
+    def queue_depth(self):
+        """Return the number of files waiting across all worker queues."""
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        """Return a snapshot of the pipeline counters."""
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            return {
+                "workers": self.worker_count,
+                "queue_depth": self.queue_depth(),
+                "max_queue_depth": self._max_depth,
+                "submitted": self._submitted,
+                "processed": self._processed,
+                "errors": self._errors,
+                "files_per_second": self._processed / elapsed if elapsed else 0.0,
+                "avg_processing_seconds": self._busy_seconds / self._processed if self._processed else 0.0,
+                "utilization": self._busy_seconds / (elapsed * self.worker_count) if elapsed else 0.0,
+            }
+
+    def _worker(self, index):
+        """Process files from one queue until a stop sentinel is received."""
+        q = self._queues[index]
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                break
+            filepath, queued_at = item
+            if callable(filepath):
+                self._run_task(filepath)
+                q.task_done()
+                continue
+            start = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(start - queued_at)
+            failed = False
+            try:
+                self.handler(filepath)
+            except Exception as e:
+                failed = True
+                logger.error("Unhandled error processing %s: %s", filepath, e,
+                             extra=file_fields(os.path.basename(filepath)))
+            finally:
+                with self._lock:
+                    self._in_flight.discard(filepath)
+                    self._processed += 1
+                    self._errors += failed
+                    self._busy_seconds += time.monotonic() - start
+                q.task_done()
+
+    def _run_task(self, task):
+        """Run a task queued with run_on_device. Errors are logged, not raised."""
+        try:
+            task()
+        except Exception as e:
+            logger.error("Unhandled error in device task: %s", e)
+
+    def _report_stats(self):
+        """Periodically log queue depth and throughput."""
+        last_processed = 0
+        while not self._stop_event.wait(self.stats_interval):
+            stats = self.stats()
+            interval_rate = (stats["processed"] - last_processed) / self.stats_interval
+            last_processed = stats["processed"]
+            with self._lock:
+                self._max_depth = stats["queue_depth"]
+            logger.info(
+                "Pipeline stats: queue_depth=%s max_queue_depth=%s processed=%s errors=%s "
+                "rate=%.2f files/s avg=%.2fs utilization=%.0f%%",
+                stats['queue_depth'], stats['max_queue_depth'], stats['processed'], stats['errors'],
+                interval_rate, stats['avg_processing_seconds'], stats['utilization'] * 100)
+
+    def stop(self, timeout=None):
+        """
+        Drain the queues and stop the workers. Files already queued are processed first.
+        """
+        self._stop_event.set()
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        logger.info("Stopped processing pipeline. Final stats: %s", self.stats())
@@ -0,0 +1,121 @@
+import threading
+import time
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE_PER_MINUTE
+from utils import logger
+
+
+class TokenBucket:
+    """
+    Token bucket that may go into debt: a request is admitted whenever at least one
+    token is available and then pays its full cost, so album sends costing more than
+    the bucket capacity still pass and simply delay the requests behind them.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Return the seconds until a request can be admitted."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, cost):
+        self.tokens -= cost
+
+
+class RateLimiter:
+    """
+    Process-wide limiter for Telegram Bot API calls.
+
+    Every call needs a permit from the global bucket (about 30 messages per second per
+    bot) and from the bucket of its chat (1 message per second in private chats, 20
+    messages per minute in groups and channels). A 429 response pauses all senders
+    until its retry_after has elapsed.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 group_rate_per_minute=TELEGRAM_GROUP_RATE_PER_MINUTE):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60.0
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _chat_bucket(self, chat_id):
+        chat_id = str(chat_id)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group and channel IDs are negative
+            if chat_id.startswith('-'):
+                bucket = TokenBucket(self.group_rate, 3)
+            else:
+                bucket = TokenBucket(self.chat_rate, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def try_acquire(self, chat_id, cost=1):
+        """
+        Take a permit for `cost` messages to `chat_id` if one is available right now.
+        Returns 0 if the permit was granted, otherwise the seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            chat_bucket = self._chat_bucket(chat_id)
+            wait = max(self._paused_until - now, self._global.delay(now), chat_bucket.delay(now))
+            if wait > 0:
+                return wait
+            self._global.consume(cost)
+            chat_bucket.consume(cost)
+            return 0.0
+
+    def acquire(self, chat_id, cost=1, timeout=None):
+        """
+        Block until a permit is granted. Returns False if `timeout` seconds pass first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(chat_id, cost)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self, chat_id, cost=1, timeout=None):
+        """
+        Await a permit without blocking the event loop. Returns False if `timeout` seconds pass first.
+        """
+        import asyncio  # Only the asyncio pipeline awaits permits
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(chat_id, cost)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop granting permits to every sender for `seconds`, e.g. a 429 retry_after."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning("Telegram rate limit hit. Pausing all sends for %s seconds.", seconds)
+
+
+rate_limiter = RateLimiter()
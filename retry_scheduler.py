@@ -0,0 +1,300 @@
+import heapq
+import itertools
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from config import (MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD,
+                    CIRCUIT_RESET_TIMEOUT, REDRIVE_INTERVAL, REDRIVE_BATCH, REDRIVE_MAX_AGE_DAYS,
+                    REDRIVE_MAX_ATTEMPTS, FILES_DIRECTORY, FAILED_DIRECTORY)
+from utils import logger, get_file_type
+from metrics import SEND_RETRIES
+
+MONTH_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+
+
+class CircuitBreaker:
+    """
+    Stops sends to Telegram after `failure_threshold` consecutive failures.
+
+    While open, allow() refuses every send for `reset_timeout` seconds. After that a
+    single trial send is let through (half-open): success closes the circuit, failure
+    opens it for another `reset_timeout`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a send may be attempted now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                logger.info("Circuit half-open. Trying one send to Telegram.")
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Telegram is reachable again. Circuit closed.")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or \
+                    (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+                logger.warning("Circuit open after %s failed sends. Pausing sends for %s seconds.",
+                               self._failures, self.reset_timeout)
+
+    def record_inconclusive(self):
+        """A send that failed without telling whether Telegram is reachable. The next send may be the trial."""
+        with self._lock:
+            self._trial_running = False
+
+    def is_closed(self):
+        with self._lock:
+            return self.state == self.CLOSED
+
+    def probe_due(self):
+        """Returns True if the circuit is open but the next allow() would let a trial send through."""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def retry_in(self):
+        """Seconds until sends are worth attempting again. While a trial send runs, a full reset timeout."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            if self.state == self.HALF_OPEN:
+                return self.reset_timeout
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+
+class RetryScheduler:
+    """
+    Re-submits files whose send failed after an exponential backoff with jitter.
+
+    Waiting files sit in a heap ordered by due time and a single timer thread hands
+    them back to `submit` when they are due, so no worker is held while waiting. A
+    file's k-th retry is due after about base_delay * 2^k seconds, capped at max_delay.
+    Files still waiting when the application stops, or failing while the pipeline drains
+    after stop(), remain in FILES_DIRECTORY. The next start submits them again, through
+    the startup scan or, without it, from the job store.
+    """
+
+    def __init__(self, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, max_attempts=MAX_RETRIES):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.submit = None
+        self._heap = []  # (due, sequence, filepath)
+        self._attempts = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self, submit):
+        """Start handing due files to `submit`, usually the pipeline's submit."""
+        self.submit = submit
+        self._thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+        self._thread.start()
+
+    def delay(self, attempt):
+        """Backoff before retry number `attempt` (0-based): half fixed, half random."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(self, filepath):
+        """
+        Schedule another attempt for a file. Returns False once it has used up its retries.
+        After stop() the file is left for the next start.
+        """
+        with self._condition:
+            if self._stopped:
+                return self._leave(filepath)
+            attempt = self._attempts.get(filepath, 0)
+            if attempt >= self.max_attempts or self._thread is None:
+                self._attempts.pop(filepath, None)
+                return False
+            self._attempts[filepath] = attempt + 1
+            delay = self.delay(attempt)
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), filepath))
+            self._condition.notify()
+        SEND_RETRIES.inc()
+        logger.warning("Retrying (%s/%s) %s in %.1f seconds.",
+                       attempt + 1, self.max_attempts, os.path.basename(filepath), delay)
+        return True
+
+    def defer(self, filepath, delay):
+        """
+        Submit a file again after `delay` seconds without using up one of its retries, e.g. when
+        the circuit breaker held its send back. Returns False if the scheduler was not started.
+        After stop() the file is left for the next start.
+        """
+        with self._condition:
+            if self._stopped:
+                return self._leave(filepath)
+            if self._thread is None:
+                return False
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), filepath))
+            self._condition.notify()
+        logger.info("Sending %s again in %.1f seconds.", os.path.basename(filepath), delay)
+        return True
+
+    def _leave(self, filepath):
+        logger.info("Stopping. %s stays in %s for the next start.", os.path.basename(filepath), FILES_DIRECTORY)
+        return True
+
+    def clear(self, filepath):
+        """Forget the attempts of a file that was delivered."""
+        with self._condition:
+            self._attempts.pop(filepath, None)
+
+    def pending(self):
+        """Return the number of files waiting for a retry."""
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, filepath = heapq.heappop(self._heap)
+            try:
+                self.submit(filepath)
+            except Exception as e:
+                logger.error("Error re-submitting %s: %s", filepath, e)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._heap:
+            logger.info("%s files waiting for a retry stay in %s.", len(self._heap), FILES_DIRECTORY)
+
+
+class FailedRedriver:
+    """
+    Moves files from FAILED_DIRECTORY/<YYYY-MM> back into the pipeline while Telegram is reachable.
+
+    Every `interval` seconds, if the circuit breaker is closed, up to `batch` files that
+    failed within the last `max_age_days` are moved back to FILES_DIRECTORY and submitted.
+    While the breaker is open a single file is re-driven once its reset timeout has passed,
+    as the trial send that closes it again when no new uploads arrive. A file is re-driven
+    at most `max_attempts` times per run of the application.
+    """
+
+    def __init__(self, breaker, interval=REDRIVE_INTERVAL, batch=REDRIVE_BATCH,
+                 max_age_days=REDRIVE_MAX_AGE_DAYS, max_attempts=REDRIVE_MAX_ATTEMPTS):
+        self.breaker = breaker
+        self.interval = interval
+        self.batch = batch
+        self.max_age_days = max_age_days
+        self.max_attempts = max_attempts
+        self.submit = None
+        self._attempts = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, submit):
+        """Start re-driving into `submit`. Does nothing if the interval is 0."""
+        if self.interval <= 0:
+            return
+        self.submit = submit
+        self._thread = threading.Thread(target=self._run, name="failed-redriver", daemon=True)
+        self._thread.start()
+
+    def _candidates(self):
+        """Failed files young enough to re-drive, oldest first, as (ctime, path) pairs."""
+        # A rename updates st_ctime, so it tells when the file was moved to FAILED_DIRECTORY
+        cutoff = time.time() - self.max_age_days * 86400
+        candidates = []
+        with os.scandir(FAILED_DIRECTORY) as months:
+            for month in months:
+                # Files are filed by capture month, which can be older than the failure
+                if not (month.is_dir() and MONTH_PATTERN.match(month.name)):
+                    continue
+                with os.scandir(month.path) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or not get_file_type(entry.name) or \
+                                self._attempts.get(entry.name, 0) >= self.max_attempts:
+                            continue
+                        ctime = entry.stat().st_ctime
+                        if ctime >= cutoff:
+                            candidates.append((ctime, entry.path))
+        return sorted(candidates)
+
+    def redrive(self):
+        """Move one batch of failed files back into the pipeline. Returns the number re-driven."""
+        if self.breaker.is_closed():
+            limit = self.batch
+        elif self.breaker.probe_due():
+            limit = 1
+        else:
+            logger.debug("Telegram is still unreachable. Not re-driving failed files.")
+            return 0
+        count = 0
+        for _, path in self._candidates()[:limit]:
+            name = os.path.basename(path)
+            destination = os.path.join(FILES_DIRECTORY, name)
+            if os.path.exists(destination):
+                continue
+            try:
+                shutil.move(path, destination)  # FAILED_DIRECTORY may be on another filesystem
+            except OSError as e:
+                logger.error("Could not move %s back to %s: %s", path, FILES_DIRECTORY, e)
+                continue
+            self._attempts[name] = self._attempts.get(name, 0) + 1
+            self.submit(destination)
+            count += 1
+            if not self.breaker.is_closed():
+                break
+        if count:
+            logger.info("Re-drove %s failed files back into the pipeline.", count)
+        return count
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.redrive()
+            except Exception as e:
+                logger.error("Error re-driving failed files: %s", e)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+circuit_breaker = CircuitBreaker()
+retry_scheduler = RetryScheduler()
+failed_redriver = FailedRedriver(circuit_breaker)
@@ -1,65 +1,434 @@
 # telegram_client.py
 
 import os
+import json
+import threading
 import time
+import uuid
+from collections import namedtuple
 import requests
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
-from utils import logger
+from requests.adapters import HTTPAdapter
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_API_URL, TELEGRAM_CONNECT_TIMEOUT,
+                    TELEGRAM_READ_TIMEOUT, WORKER_COUNT, FANOUT_WORKERS, UPLOAD_CHUNK_SIZE)
+from rate_limiter import rate_limiter
+from image_transformer import prepare_uploads, release_uploads
+from metadata_extractor import read_video_metadata
+from utils import logger, file_fields
+from metrics import STAGE_SECONDS, UPLOAD_BYTES, TELEGRAM_REQUESTS
 
-def send_file(filepath, file_type, filename):
+# A delivered message and the file_id Telegram assigned to its media
+Message = namedtuple("Message", ["message_id", "file_id"])
+
+
+class SendFailure:
     """
-    Sends a file via Telegram using HTTP requests.
-    Returns True if successful, False otherwise.
+    Returned instead of a Message when a send failed. Falsy, so `if message:` still tells
+    success from failure, while the instance tells what went wrong. Compare with `is`.
     """
-    
-    logger.debug(f"send_file called with: {filename}, file_type: {file_type}")
-    
-    try:
-        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/'
 
-        if file_type == 'photo':
-            method = 'sendPhoto'
-            files = {'photo': open(filepath, 'rb')}
-            data = {'chat_id': TELEGRAM_CHAT_ID}
-        elif file_type == 'video':
-            method = 'sendVideo'
-            files = {'video': open(filepath, 'rb')}
-            data = {
-                'chat_id': TELEGRAM_CHAT_ID,
-                'width': 1280,   # Static width for trailcam videos
-                'height': 720    # Static height for trailcam videos
-            }
-        else:
-            logger.warning(f"send_file: Unsupported file type for file {filename}. Skipping.")
-            return False
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"SendFailure({self.kind!r})"
+
+
+# Connection errors, timeouts and 5xx responses: Telegram may be down, the send is retried
+TRANSIENT = SendFailure('transient')
+# 429 responses: the rate limiter pauses every sender, the send is retried
+RATE_LIMITED = SendFailure('rate_limited')
+# Other 4xx responses, e.g. 403 from a chat the bot may not post to or 413 for an oversized
+# file, and unsupported media: sending again would fail the same way
+REJECTED = SendFailure('rejected')
+# Unexpected local errors, which say nothing about Telegram: the send is retried
+ERROR = SendFailure('error')
+
+
+def failure_for_status(status):
+    """The SendFailure for an unsuccessful HTTP status other than 429."""
+    return REJECTED if 400 <= status < 500 else TRANSIENT
+
+
+class MultipartStream:
+    """
+    multipart/form-data request body that is read from disk in fixed-size chunks.
+
+    requests builds multipart bodies for `files=` in memory; this stream has a known
+    Content-Length up front and never holds more than one chunk of a file, so memory
+    use does not depend on the size of the upload. Files are opened only while they
+    are being read and are always closed by close().
+
+    `fields` maps form names to values; `files` is a list of (form name, filename, path).
+    `progress` is called with (bytes_sent, total_bytes) after every chunk. `started_at` and
+    `finished_at` are the perf_counter() times the first and the last byte were read.
+    """
+
+    def __init__(self, fields, files, chunk_size=UPLOAD_CHUNK_SIZE, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._parts = []  # bytes, or a path whose content is streamed
+        for name, value in fields.items():
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'.encode())
+        for name, filename, path in files:
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+            self._parts.append(path)
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+        self.length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part)
+                          for part in self._parts)
+        self.sent = 0
+        self._index = 0
+        self._offset = 0
+        self._file = None
+        self.started_at = None
+        self.finished_at = None
+
+    def __len__(self):
+        return self.length
 
-        response = requests.post(url + method, data=data, files=files, timeout=60)
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
 
-        # Close the file
-        files['photo'].close() if file_type == 'photo' else files['video'].close()
+    def read(self, size=-1):
+        """Return up to `size` bytes (one chunk if unspecified) of the body."""
+        if size is None or size < 0:
+            size = self.chunk_size
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        while self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+            else:
+                if self._file is None:
+                    self._file = open(part, 'rb')
+                chunk = self._file.read(min(size, self.chunk_size))
+                if not chunk:
+                    self._file.close()
+                    self._file = None
+            if chunk:
+                self.sent += len(chunk)
+                if self.progress:
+                    self.progress(self.sent, self.length)
+                return chunk
+            self._index += 1
+            self._offset = 0
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+        return b''
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TelegramClient:
+    """
+    Long-lived Telegram Bot API client.
+
+    Requests go through one requests.Session whose connection pool is sized to the
+    number of sending threads, the pipeline and fan-out workers plus one for albums sent
+    at shutdown, so uploads reuse open TCP/TLS connections instead of handshaking with
+    api.telegram.org for every file.
+    """
+
+    def __init__(self, token=TELEGRAM_BOT_TOKEN, chat_id=TELEGRAM_CHAT_ID, api_url=TELEGRAM_API_URL,
+                 pool_size=WORKER_COUNT + FANOUT_WORKERS + 1, connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+                 read_timeout=TELEGRAM_READ_TIMEOUT):
+        self.chat_id = chat_id
+        self.base_url = f'{api_url.rstrip("/")}/bot{token}/'
+        self.timeout = (connect_timeout, read_timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _progress_logger(self, description):
+        """Returns a progress callback that logs each quarter of an upload at debug level."""
+        state = {'next': 0.25}
+
+        def progress(sent, total):
+            if total and sent / total >= state['next']:
+                logger.debug("Upload of %s: %s/%s bytes (%.0f%%)", description, sent, total, sent / total * 100)
+                state['next'] += 0.25
+        return progress
+
+    def _post(self, method, data, files, description):
+        """
+        Posts a Bot API request as a streamed multipart body and logs its timing at debug level.
+        `files` is a list of (form name, filename, path).
+        The timing is split into `connect`, until the body starts being sent, which includes
+        the TCP/TLS handshake of a new connection, `upload` of the body, `server` time until
+        the response headers arrive and `total`, which also includes reading the response body.
+        """
+        start = time.perf_counter()
+        headers_at = []
+        with MultipartStream(data, files, progress=self._progress_logger(description)) as body:
+            response = self.session.post(self.base_url + method, data=body, timeout=self.timeout,
+                                         headers={'Content-Type': body.content_type,
+                                                  'Content-Length': str(len(body))},
+                                         hooks={'response': lambda r, *args, **kwargs:
+                                                headers_at.append(time.perf_counter())})
+        end = time.perf_counter()
+        TELEGRAM_REQUESTS.inc(method=method, status=response.status_code)
+        if files:
+            UPLOAD_BYTES.observe(body.sent)
+        sending = body.started_at or start
+        sent = body.finished_at or sending
+        headers = headers_at[0] if headers_at else end
+        logger.debug("%s for %s: status=%s connect=%.3fs upload=%.3fs server=%.3fs total=%.3fs",
+                     method, description, response.status_code,
+                     sending - start, sent - sending, headers - sent, end - start)
+        return response
+
+    def _handle_rate_limit(self, response, description):
+        """
+        Pauses all Telegram senders for the retry_after of a 429 response.
+        """
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 30)
+        except ValueError:
+            logger.error("Rate limit exceeded when sending %s, but failed to parse 'retry_after'.", description)
+            retry_after = 30
+        logger.error("Rate limit exceeded when sending %s. Retry after %s seconds.", description, retry_after)
+        rate_limiter.pause(retry_after)
+
+    def _send(self, method, data, files, chat_id, cost, description):
+        """
+        Takes a rate limit permit and posts the request.
+        Returns the `result` of a successful response, a SendFailure otherwise.
+        """
+        rate_limiter.acquire(chat_id, cost=cost)
+        response = self._post(method, data, files, description)
 
         if response.status_code == 200:
-            logger.info(f"Successfully sent {filename} via Telegram.")
-            return True
+            return response.json()['result']
         elif response.status_code == 429:
-            # Handle rate limiting
-            try:
-                response_json = response.json()
-                retry_after = response_json.get('parameters', {}).get('retry_after', 30)
-                logger.error(f"Rate limit exceeded when sending {filename}. "
-                             f"Retrying after {retry_after + 5} seconds.")
-                time.sleep(retry_after + 5)
-            except ValueError:
-                logger.error(f"Rate limit exceeded when sending {filename}, but failed to parse 'retry_after'. "
-                             f"Sleeping for 35 seconds.")
-                time.sleep(35)  # Fallback sleep duration
-            return False
+            self._handle_rate_limit(response, description)
+            return RATE_LIMITED
+        logger.error("Failed to send %s. Status Code: %s, Response: %s",
+                     description, response.status_code, response.text)
+        return failure_for_status(response.status_code)
+
+    @staticmethod
+    def _media_request(file_type, chat_id):
+        """Returns the Bot API method and base parameters for a media type, or (None, None)."""
+        if file_type == 'photo':
+            return 'sendPhoto', {'chat_id': chat_id}
+        if file_type == 'video':
+            return 'sendVideo', {'chat_id': chat_id}
+        return None, None
+
+    @staticmethod
+    def _video_parameters(filepath):
+        """
+        sendVideo parameters read from the video's header. Clips whose header cannot be
+        read fall back to the 1280x720 most trail cameras record.
+        """
+        metadata = read_video_metadata(filepath)
+        parameters = {'width': metadata.width or 1280, 'height': metadata.height or 720}
+        if metadata.duration:
+            parameters['duration'] = round(metadata.duration)
+        if metadata.streamable:
+            parameters['supports_streaming'] = 'true'
+        return parameters
+
+    @staticmethod
+    def _message(result):
+        """Extracts the message id and the file_id of the media from a sent message."""
+        if result.get('photo'):
+            file_id = result['photo'][-1]['file_id']  # Largest size
         else:
-            logger.error(f"Failed to send {filename}. Status Code: {response.status_code}, Response: {response.text}")
-            return False
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"RequestException while sending {filename}: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error while sending {filename}: {e}")
-    return False
+            file_id = (result.get('video') or result.get('document') or {}).get('file_id')
+        return Message(result['message_id'], file_id)
+
+    @STAGE_SECONDS.time(stage='send_file')
+    def send_file(self, filepath, file_type, filename, chat_id=None):
+        """
+        Uploads a file via Telegram to `chat_id`, or the default chat.
+        Returns a Message with the message id and file_id if successful, a SendFailure otherwise.
+        """
+
+        logger.debug("send_file called with: %s, file_type: %s", filename, file_type)
+
+        chat_id = chat_id or self.chat_id
+        method, data = self._media_request(file_type, chat_id)
+        if not method:
+            logger.warning("send_file: Unsupported file type for file %s. Skipping.", filename)
+            return REJECTED
+
+        upload_paths = [filepath]
+        start = time.perf_counter()
+        try:
+            if file_type == 'photo':
+                upload_paths = prepare_uploads([filepath])
+            elif file_type == 'video':
+                data.update(self._video_parameters(filepath))
+            result = self._send(method, data, [(file_type, filename, upload_paths[0])], chat_id, 1, filename)
+            if result:
+                logger.info("Successfully sent %s via Telegram.", filename, extra=file_fields(
+                    filename, stage='send_file', duration=round(time.perf_counter() - start, 3)))
+                return self._message(result)
+            return result
+
+        except requests.exceptions.RequestException as e:
+            logger.error("RequestException while sending %s: %s", filename, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending %s: %s", filename, e)
+            return ERROR
+        finally:
+            release_uploads([filepath], upload_paths)
+
+    def send_existing(self, file_type, file_id, filename, chat_id):
+        """
+        Sends an already uploaded file to another chat by its file_id, without uploading it again.
+        Returns a Message if successful, a SendFailure otherwise.
+        """
+        method, data = self._media_request(file_type, chat_id)
+        if not method:
+            logger.warning("send_existing: Unsupported file type for file %s. Skipping.", filename)
+            return REJECTED
+        data[file_type] = file_id
+
+        description = f"{filename} to chat {chat_id}"
+        try:
+            result = self._send(method, data, [], chat_id, 1, description)
+            if result:
+                logger.info("Successfully sent %s via Telegram.", description)
+                return self._message(result)
+            return result
+        except requests.exceptions.RequestException as e:
+            logger.error("RequestException while sending %s: %s", description, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending %s: %s", description, e)
+            return ERROR
+
+    def send_media_group(self, items, chat_id=None):
+        """
+        Uploads up to 10 photos as a single album via sendMediaGroup.
+        `items` is a list of (filepath, filename) tuples.
+        Returns one Message per item if the whole album was delivered, a SendFailure otherwise.
+        """
+        filenames = ", ".join(filename for _, filename in items)
+        logger.debug("send_media_group called with: %s", filenames)
+
+        chat_id = chat_id or self.chat_id
+        filepaths = [filepath for filepath, _ in items]
+        upload_paths = filepaths
+        try:
+            upload_paths = prepare_uploads(filepaths)
+            media = []
+            files = []
+            for index, ((_, filename), upload_path) in enumerate(zip(items, upload_paths)):
+                name = f'photo{index}'
+                files.append((name, filename, upload_path))
+                media.append({'type': 'photo', 'media': f'attach://{name}'})
+            data = {'chat_id': chat_id, 'media': json.dumps(media)}
+
+            result = self._send('sendMediaGroup', data, files, chat_id, len(items), f"album {filenames}")
+            if result:
+                logger.info("Successfully sent album of %s photos via Telegram: %s", len(items), filenames)
+                return [self._message(message) for message in result]
+            return result
+
+        except requests.exceptions.RequestException as e:
+            logger.error("RequestException while sending album %s: %s", filenames, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending album %s: %s", filenames, e)
+            return ERROR
+        finally:
+            release_uploads(filepaths, upload_paths)
+
+    def send_media_group_existing(self, file_ids, filenames, chat_id):
+        """
+        Sends an album of already uploaded photos to another chat by their file_ids.
+        Returns one Message per photo if the whole album was delivered, a SendFailure otherwise.
+        """
+        description = f"album {', '.join(filenames)} to chat {chat_id}"
+        media = [{'type': 'photo', 'media': file_id} for file_id in file_ids]
+        data = {'chat_id': chat_id, 'media': json.dumps(media)}
+        try:
+            result = self._send('sendMediaGroup', data, [], chat_id, len(file_ids), description)
+            if result:
+                logger.info("Successfully sent %s via Telegram.", description)
+                return [self._message(message) for message in result]
+            return result
+        except requests.exceptions.RequestException as e:
+            logger.error("RequestException while sending %s: %s", description, e)
+            return TRANSIENT
+        except Exception as e:
+            logger.error("Unexpected error while sending %s: %s", description, e)
+            return ERROR
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared Telegram client, created on first use rather than on import."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TelegramClient()
+        return _client
+
+
+def send_file(filepath, file_type, filename, chat_id=None):
+    """
+    Uploads a file via the shared Telegram client.
+    Returns a Message with the message id and file_id if successful, a SendFailure otherwise.
+    """
+    return get_client().send_file(filepath, file_type, filename, chat_id)
+
+
+def send_existing(file_type, file_id, filename, chat_id):
+    """
+    Sends an already uploaded file to another chat via the shared Telegram client.
+    Returns a Message if successful, a SendFailure otherwise.
+    """
+    return get_client().send_existing(file_type, file_id, filename, chat_id)
+
+
+def send_media_group(items, chat_id=None):
+    """
+    Uploads an album via the shared Telegram client.
+    Returns one Message per item if the whole album was delivered, a SendFailure otherwise.
+    """
+    return get_client().send_media_group(items, chat_id)
+
+
+def send_media_group_existing(file_ids, filenames, chat_id):
+    """
+    Sends an album of already uploaded photos to another chat via the shared Telegram client.
+    Returns one Message per photo if the whole album was delivered, a SendFailure otherwise.
+    """
+    return get_client().send_media_group_existing(file_ids, filenames, chat_id)
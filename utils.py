@@ -1,27 +1,113 @@
 import sys
 import os
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
-from config import APP_LOG_FILE, PHOTO_EXTENSIONS, VIDEO_EXTENSIONS, LOG_LEVEL
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import APP_LOG_FILE, PHOTO_EXTENSIONS, VIDEO_EXTENSIONS, LOG_LEVEL, LOG_FORMAT, LOG_QUEUE
 
-# Set up logging
 logger = logging.getLogger('FileSender')
 numeric_log_level = getattr(logging, LOG_LEVEL, logging.INFO)
 logger.setLevel(numeric_log_level)
 
-# Create handlers
-file_handler = RotatingFileHandler(
-    APP_LOG_FILE, maxBytes=5*1024*1024, backupCount=5)
-stream_handler = logging.StreamHandler(sys.stdout)
+# Attributes of every log record; any other attribute was passed with `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
 
-# Create formatters and add them to handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-stream_handler.setFormatter(formatter)
+_listener = None
 
-# Add handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line, ready to be shipped to Elasticsearch.
+    Fields passed with `extra=`, such as file, device_id, stage and duration, are included.
+    """
+
+    def format(self, record):
+        document = {
+            "@timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document["error"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class _BackgroundQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread as they are. Unlike QueueHandler, the message is
+    not formatted by the thread that logged it, so logging costs a queue put on the hot path.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging():
+    """
+    Adds the log file and stdout handlers. Called once by the entry points, so importing
+    a module never opens the log file; until then warnings go to stderr.
+    With LOG_QUEUE the handlers run on a listener thread behind a queue, so a slow disk
+    or a log rotation never blocks the thread that logs.
+    """
+    global _listener
+    if logger.handlers:
+        return
+
+    # Create handlers
+    file_handler = RotatingFileHandler(
+        APP_LOG_FILE, maxBytes=5*1024*1024, backupCount=5)
+    stream_handler = logging.StreamHandler(sys.stdout)
+
+    # Create formatters and add them to handlers
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+
+    # Add handlers to the logger
+    if LOG_QUEUE:
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, file_handler, stream_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+        logger.addHandler(_BackgroundQueueHandler(log_queue))
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(stream_handler)
+
+
+def stop_logging():
+    """
+    Writes the records still queued and stops the listener thread. Records logged
+    afterwards are written directly. Runs at exit.
+    """
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+def file_fields(filename, **fields):
+    """
+    Returns the `extra` fields of a log record about an uploaded file: its name, device ID
+    and any given fields, e.g. file_fields(filename, stage='send_file', duration=1.2).
+    """
+    return {'file': filename, 'device_id': get_device_id(filename), **fields}
 
 
 def get_file_type(filename):
@@ -32,3 +118,10 @@ def get_file_type(filename):
         return 'video'
     else:
         return None
+
+
+def get_device_id(filename):
+    """
+    Returns the device ID prefix of an uploaded file name, e.g. '001' for '001-IMG_0001.JPG'.
+    """
+    return filename.split("-")[0]